@@ -1,70 +1,150 @@
+import io
+import os
+import threading
+
+import pandas as pd
 import streamlit as st
-from time import sleep
-from functions.segregator import process_multiple_files
-from functions.consolidater import process_and_merge_files
-from functions.balance_summary import process_file
-from functions.age_summary import generate_summary
-from functions.combiner import combine_sheets
-from functions.get_details import fetch_all_reports
-
-def process_files():
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    status_text.text("Fetching all reports...")
-    fetch_all_reports()
-    progress_bar.progress(10)
-    
-    status_text.text("Processing AR aging details files...")
-    file1 = 'csvdata/invoice_aging_details_nvb.xlsx'
-    file2 = 'csvdata/invoice_aging_details_smcs.xlsx'
-    process_multiple_files(file1, file2)
-    progress_bar.progress(30)
-    
-    
-    status_text.text("Generating age summary...")
-    input_files = {
-        'SMCS': 'output/SMCS_Age_Range_Columns.xlsx',
-        'NVB': 'output/NVB_Age_Range_Columns.xlsx'
-    }
-    output_file = 'output/Age_summary.xlsx'
-    generate_summary(input_files, output_file)
-    progress_bar.progress(50)
-    
-    status_text.text("Merging customer balance files...")
-    file1_path = 'csvdata/customer_balance_summary_details_nvb.xlsx'
-    file2_path = 'csvdata/customer_balance_summary_details_smcs.xlsx'
-    output_file_path = 'output/unified_file.csv'
-    process_and_merge_files(file1_path, file2_path, output_file_path)
-    progress_bar.progress(70)
-    
-    status_text.text("Processing consolidated file...")
-    input_file = 'output/unified_file.csv'
-    output_file = 'output/balances_summary.xlsx'
-    process_file(input_file, output_file)
-    progress_bar.progress(85)
-    
-    status_text.text("Combining all summaries...")
-    input_file1 = 'output/balances_summary.xlsx'
-    input_file2 = 'output/Age_summary.xlsx'
-    final_output = 'output/Final.xlsx'
-    combine_sheets(input_file1, input_file2, final_output)
-    progress_bar.progress(100)
-    
-    st.success("Final Report Generated Successfully!")
-    st.download_button(label="Download Final Report", data=open(final_output, "rb").read(), file_name="Final.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-    st.session_state.processing = False
-
-def main():
+
+import main
+from functions.report_store import REPORT_STORE_TTL_SECONDS, sidecar_path
+
+# Zoho date filters offered in the sidebar
+DATE_FILTERS = [
+    "Today", "ThisWeek", "ThisMonth", "ThisQuarter", "ThisYear",
+    "PreviousWeek", "PreviousMonth", "PreviousQuarter", "PreviousYear",
+]
+# How long fetched reports and built outputs stay cached in the app, in seconds
+APP_CACHE_TTL_SECONDS = int(os.environ.get("APP_CACHE_TTL_SECONDS", str(REPORT_STORE_TTL_SECONDS)))
+FINAL_OUTPUT = 'output/Final.xlsx'
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+@st.cache_resource
+def pipeline_lock():
+    # Every session shares csvdata/ and output/, so fetches and builds take turns
+    return threading.Lock()
+
+
+def read_files(paths):
+    files = {}
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                files[path] = f.read()
+    return files
+
+
+def write_files(files):
+    for path, data in files.items():
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+@st.cache_data(ttl=APP_CACHE_TTL_SECONDS, max_entries=len(DATE_FILTERS), show_spinner=False)
+def fetch_sources(date_filter, _force_fetch=False):
+    """
+    Fetch date_filter's source reports through main.fetch_reports; _force_fetch
+    skips the report store too (it is not part of the cache key).
+
+    Returns:
+        tuple: The sources' fingerprint and their contents, workbooks followed by
+        their columnar sidecars so the sidecars stay newer when written back.
+    """
+    with pipeline_lock():
+        fingerprint = main.fetch_reports(date_filter, _force_fetch)
+        paths = main.SOURCE_REPORTS + [sidecar_path(path) for path in main.SOURCE_REPORTS]
+        return fingerprint, read_files(paths)
+
+
+@st.cache_data(ttl=APP_CACHE_TTL_SECONDS, max_entries=len(DATE_FILTERS), show_spinner=False)
+def build_outputs(date_filter, fingerprint, _sources, _on_stage=None):
+    """
+    Run main.run_pipeline over the fetched sources, keyed by date_filter and
+    the sources' fingerprint.
+
+    Returns:
+        dict: Output path -> contents of the Combined_Report and Final workbooks.
+    """
+    with pipeline_lock():
+        # Another session may have fetched a different filter in the meantime
+        write_files(_sources)
+        main.run_pipeline(on_stage=_on_stage)
+        return read_files([main.COMBINED_REPORT, FINAL_OUTPUT])
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_sheets(workbook):
+    return pd.read_excel(io.BytesIO(workbook), sheet_name=None)
+
+
+def process_files(date_filter, force_fetch=False):
+    """Fetch and build the reports for date_filter, showing progress per pipeline stage."""
+    total = len(main.pipeline_stages()) + 1
+    progress_bar = st.progress(0.0, text=f"Fetching {date_filter} reports from Zoho...")
+    fingerprint, sources = fetch_sources(date_filter, force_fetch)
+    progress_bar.progress(1 / total, text="Reports fetched")
+
+    def on_stage(name, done, stages, outcome):
+        text = {
+            "running": f"Running {name} ({done + 1}/{stages})...",
+            "ran": f"{name} done",
+            "cached": f"{name}: inputs unchanged, restored",
+        }[outcome]
+        progress_bar.progress((1 + done) / total, text=text)
+
+    outputs = build_outputs(date_filter, fingerprint, sources, on_stage)
+    progress_bar.progress(1.0, text="Report ready")
+    return outputs
+
+
+def show_outputs(date_filter, outputs):
+    st.success(f"{date_filter} report generated")
+    col1, col2 = st.columns(2)
+    if FINAL_OUTPUT in outputs:
+        col1.download_button(
+            label="Download Final Report", data=outputs[FINAL_OUTPUT], file_name="Final.xlsx", mime=XLSX_MIME
+        )
+    if main.COMBINED_REPORT not in outputs:
+        return
+    col2.download_button(
+        label="Download Combined Report", data=outputs[main.COMBINED_REPORT], file_name="Combined_Report.xlsx",
+        mime=XLSX_MIME
+    )
+
+    # Browsing only re-renders the cached workbook; nothing is fetched or rebuilt
+    sheets = load_sheets(outputs[main.COMBINED_REPORT])
+    sheet_name = st.selectbox("Sheet", list(sheets))
+    df = sheets[sheet_name]
+    customer = st.text_input("Customer name contains")
+    if customer and "customer_name" in df.columns:
+        df = df[df["customer_name"].astype(str).str.contains(customer, case=False, regex=False)]
+    st.dataframe(df, use_container_width=True)
+
+
+def app():
     st.title("Automated File Processing Application")
-    
-    if "processing" not in st.session_state:
-        st.session_state.processing = False
-    
-    if not st.session_state.processing:
-        if st.button("Start Processing"):
-            st.session_state.processing = True
-            process_files()
+
+    date_filter = st.sidebar.selectbox("Date filter", DATE_FILTERS, index=DATE_FILTERS.index("ThisMonth"))
+    if st.sidebar.button("Refresh from Zoho"):
+        # Built outputs are keyed by the sources' fingerprint, so only the fetch is dropped;
+        # the next fetch also skips the report store's copies
+        fetch_sources.clear()
+        st.session_state.force_fetch = True
+
+    if st.button("Generate Report"):
+        st.session_state.date_filter = date_filter
+    if "date_filter" not in st.session_state:
+        return
+
+    try:
+        outputs = process_files(st.session_state.date_filter, st.session_state.get("force_fetch", False))
+    except Exception as e:
+        st.error(f"Processing failed: {e}")
+        return
+    st.session_state.force_fetch = False
+    show_outputs(st.session_state.date_filter, outputs)
+
 
 if __name__ == "__main__":
-    main()
+    app()
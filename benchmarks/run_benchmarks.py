@@ -0,0 +1,175 @@
+"""
+Time each pipeline stage on synthetic data and record its peak memory.
+
+Usage:
+    python benchmarks/run_benchmarks.py                      # 1k, 10k and 100k rows
+    python benchmarks/run_benchmarks.py --sizes 1000 --json bench.json
+    python benchmarks/run_benchmarks.py --replay-dir cache/zoho_recordings --date-filter ThisMonth
+
+Every size runs in its own temporary working directory, laid out like the
+service's (csvdata/ and output/). Stages run in pipeline order because each
+reads the files written by the one before it. Timing and memory are measured
+in separate passes so tracemalloc overhead does not skew the timings.
+
+With --replay-dir the inputs come from recorded Zoho responses (see
+functions/zoho_transport.py) instead of synthetic data, and the fetch step
+is timed too, with optional simulated per-call latency.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.synthetic_data import generate_dataset, write_dataset  # noqa: E402
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+
+def pipeline_benchmarks(date_filter=None):
+    """Benchmarked stages in pipeline order, as (name, callable) pairs."""
+    # Imported here so the result cache main.py creates lands in the benchmark directory
+    import main
+    from functions import segregator, age_summary, consolidater, balance_summary, combiner, combined_report
+    from functions.get_details import fetch_all_reports
+
+    combined_file = "output/Combined_Report.xlsx"
+    fetch = [("get_details.fetch_all_reports", lambda: fetch_all_reports(date_filter))]
+    return (fetch if date_filter is not None else []) + [
+        ("segregator.process_file", lambda: (
+            segregator.process_file('csvdata/input_invoice_aging_nvb.xlsx', 'output/NVB_Age_Range_Columns.xlsx', org='NVB'),
+            segregator.process_file('csvdata/input_invoice_aging_smcs.xlsx', 'output/SMCS_Age_Range_Columns.xlsx', org='SMCS'),
+        )),
+        ("age_summary.generate_summary", lambda: age_summary.generate_summary(
+            {'SMCS': 'output/SMCS_Age_Range_Columns.xlsx', 'NVB': 'output/NVB_Age_Range_Columns.xlsx'},
+            'output/Age_summary.xlsx'
+        )),
+        ("consolidater.process_and_merge_files", lambda: consolidater.process_and_merge_files(
+            'csvdata/input_customer_balance_nvb.xlsx',
+            'csvdata/input_customer_balance_smcs.xlsx',
+            'output/unified_file.csv'
+        )),
+        ("balance_summary.process_file", lambda: balance_summary.process_file(
+            'output/unified_file.xlsx', 'output/balances_summary.xlsx'
+        )),
+        ("combiner.combine_sheets", lambda: combiner.combine_sheets(
+            'output/balances_summary.xlsx', 'output/Age_summary.xlsx', 'output/Final.xlsx'
+        )),
+        ("create_combined_excel", lambda: combined_report.create_combined_excel(combined_file, main.REPORT_FILES)),
+        ("add_hyperlinks", lambda: combined_report.add_hyperlinks(combined_file)),
+    ]
+
+
+def run_pass(benchmarks, measure_memory, verbose):
+    results = {}
+    for name, func in benchmarks:
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        if measure_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with output:
+            func()
+        elapsed = time.perf_counter() - start
+        peak = None
+        if measure_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        results[name] = {"seconds": elapsed, "peak_bytes": peak}
+    return results
+
+
+def run_size(rows, args):
+    work_dir = tempfile.mkdtemp(prefix=f"bench_{rows}_")
+    cwd = os.getcwd()
+    try:
+        os.chdir(work_dir)
+        os.makedirs("output", exist_ok=True)
+        if args.replay_dir:
+            from functions import zoho_transport
+            zoho_transport.configure(mode="replay", recordings_dir=args.replay_dir,
+                                     latency_ms=args.replay_latency_ms)
+            benchmarks = pipeline_benchmarks(args.date_filter)
+        else:
+            dataset = generate_dataset(rows, num_customers=args.customers, num_orgs=args.orgs, seed=args.seed)
+            write_dataset(dataset, "csvdata")
+            benchmarks = pipeline_benchmarks()
+
+        if args.stages:
+            # Earlier stages still run (untimed) because later ones read their outputs
+            last = max(i for i, (name, _) in enumerate(benchmarks) if name in args.stages)
+            benchmarks = benchmarks[:last + 1]
+
+        timings = [run_pass(benchmarks, False, args.verbose) for _ in range(args.repeat)]
+        memory = run_pass(benchmarks, True, args.verbose) if not args.no_memory else {}
+
+        results = {}
+        for name, _ in benchmarks:
+            if args.stages and name not in args.stages:
+                continue
+            seconds = min(t[name]["seconds"] for t in timings)
+            results[name] = {
+                "seconds": seconds,
+                "peak_bytes": memory.get(name, {}).get("peak_bytes"),
+            }
+        return results
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        else:
+            print(f"Kept benchmark directory: {work_dir}")
+
+
+def format_bytes(num_bytes):
+    if num_bytes is None:
+        return "-"
+    return f"{num_bytes / (1024 * 1024):.1f} MiB"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Aging rows per org")
+    parser.add_argument("--customers", type=int, default=None, help="Customers per org (default rows/10)")
+    parser.add_argument("--orgs", type=int, default=2, help="Number of orgs to generate")
+    parser.add_argument("--repeat", type=int, default=1, help="Timing passes per size (best is kept)")
+    parser.add_argument("--stages", nargs="+", default=None, help="Only report these stages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass")
+    parser.add_argument("--json", default=None, help="Write results to this JSON file")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated working directories")
+    parser.add_argument("--verbose", action="store_true", help="Show stage output")
+    parser.add_argument("--replay-dir", default=None, help="Use recorded Zoho responses from this directory")
+    parser.add_argument("--date-filter", default="", help="date_filter the responses were recorded with")
+    parser.add_argument("--replay-latency-ms", type=float, default=0, help="Simulated latency per Zoho call")
+    args = parser.parse_args(argv)
+    if args.replay_dir:
+        # Recorded data has a fixed size
+        args.replay_dir = os.path.abspath(args.replay_dir)
+        args.sizes = ["replay"]
+
+    all_results = {}
+    for rows in args.sizes:
+        print(f"== {rows} rows per org ==")
+        results = run_size(rows, args)
+        for name, result in results.items():
+            print(f"  {name:<40} {result['seconds']:>9.3f}s  peak {format_bytes(result['peak_bytes'])}")
+        all_results[str(rows)] = results
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(all_results, f, indent=2)
+        print(f"Results written to {args.json}")
+    return all_results
+
+
+if __name__ == "__main__":
+    main()
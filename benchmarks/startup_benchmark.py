@@ -0,0 +1,111 @@
+"""
+Measure service cold start: import time of main.py and time to first byte.
+
+Usage:
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --repeat 5 --no-warmup --json startup.json
+
+Each run starts a fresh interpreter in an empty working directory:
+
+- import: seconds to `import main`.
+- first_byte: seconds from launching uvicorn to the first byte of a /health response.
+- warm: seconds from launch until /health reports the startup warm-up as done
+  (skipped with --no-warmup).
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _env(warmup):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["WARMUP_ON_STARTUP"] = "1" if warmup else "0"
+    return env
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import(work_dir, warmup):
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=work_dir, env=_env(warmup),
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def measure_server(work_dir, warmup, timeout):
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/health"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=work_dir, env=_env(warmup), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    first_byte = warm = None
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if first_byte is None:
+                        response.read(1)
+                        first_byte = time.perf_counter() - start
+                        response.read()
+                        if not warmup:
+                            break
+                        continue
+                    if json.loads(response.read()).get("warm"):
+                        warm = time.perf_counter() - start
+                        break
+            except OSError:
+                pass
+            time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    return first_byte, warm
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="Cold starts to measure (best is kept)")
+    parser.add_argument("--no-warmup", action="store_true", help="Start with WARMUP_ON_STARTUP=0")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for the server")
+    parser.add_argument("--json", default=None, help="Write results to this JSON file")
+    args = parser.parse_args(argv)
+    warmup = not args.no_warmup
+
+    runs = []
+    for _ in range(args.repeat):
+        with tempfile.TemporaryDirectory(prefix="startup_bench_") as work_dir:
+            import_seconds = measure_import(work_dir, warmup)
+            first_byte, warm = measure_server(work_dir, warmup, args.timeout)
+        runs.append({"import": import_seconds, "first_byte": first_byte, "warm": warm})
+
+    results = {}
+    for name in ("import", "first_byte", "warm"):
+        values = [run[name] for run in runs if run[name] is not None]
+        results[name] = min(values) if values else None
+        shown = f"{results[name]:.3f}s" if results[name] is not None else "-"
+        print(f"  {name:<12} {shown:>9}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"best": results, "runs": runs}, f, indent=2)
+        print(f"Results written to {args.json}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
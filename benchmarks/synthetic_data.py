@@ -0,0 +1,171 @@
+"""
+Synthetic Zoho-shaped reports for benchmarking the pipeline.
+
+The frames use the same column layout as the reports saved by
+functions.get_details.fetch_all_reports, so they can be written to csvdata/
+and fed straight into segregator, consolidater and balance_summary.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+# Column layout of the aragingdetails export after process_excel_file
+AGING_COLUMNS = [
+    "date", "status", "entity_id", "entity", "age", "reminders_sent",
+    "transaction_number", "customer_id", "customer_name", "currency_code",
+    "balance", "amount", "exchange_rate",
+]
+
+# Column layout of the customerbalancesummary export after process_excel_file
+CUSTOMER_BALANCE_COLUMNS = [
+    "customer_name", "customer_id", "closing_balance", "bcy_invoice_balance",
+    "bcy_available_credits", "last_name", "email", "mobile_phone",
+    "contact.CF.Client Coordinator", "contact.CF.Leadership",
+    "contact.CF.Is Customer part of the Group of Companies",
+]
+
+# The pipeline reads the first two orgs under these names
+DEFAULT_ORGS = ["smcs", "nvb"]
+
+COORDINATORS = ["Abishek Sriram", "Harsh Ranka", "Priya Nair", "Vikram Rao"]
+LEADERSHIP = ["Krishnan Varadharajan", "Meera Iyer", None]
+NAME_WORDS = [
+    "ALPHA", "BHARAT", "CROWN", "DELTA", "EASTERN", "FUSION", "GLOBAL", "HORIZON",
+    "INFRA", "JUPITER", "KAVERI", "LOTUS", "METRO", "NOVA", "ORBIT", "PRIME",
+]
+SUFFIXES = ["PRIVATE LIMITED", "LLP", "TRADERS", "SOLUTIONS", "INDUSTRIES"]
+
+
+def org_names(num_orgs):
+    """Org names for a dataset; the first two match the pipeline's smcs/nvb files."""
+    return DEFAULT_ORGS[:num_orgs] + [f"org{i}" for i in range(len(DEFAULT_ORGS), num_orgs)]
+
+
+def customer_names(num_customers, rng):
+    words = rng.choice(NAME_WORDS, size=(num_customers, 2))
+    suffixes = rng.choice(SUFFIXES, size=num_customers)
+    return [f"{a} {b} {suffix} {i}" for i, ((a, b), suffix) in enumerate(zip(words, suffixes))]
+
+
+def generate_aging_frame(customers, num_invoices, org_index=0, seed=0):
+    """
+    Generate an invoice aging report.
+
+    Args:
+        customers (list): Customer names to draw invoices for.
+        num_invoices (int): Number of invoice rows.
+        org_index (int): Position of the org, used to keep ids unique across orgs.
+        seed (int): Random seed.
+
+    Returns:
+        pd.DataFrame: Frame with AGING_COLUMNS.
+    """
+    rng = np.random.default_rng(seed + 1000 * org_index)
+    customer_idx = rng.integers(0, len(customers), size=num_invoices)
+
+    # Ages spread over all buckets, with a few rows missing an age
+    age = rng.integers(0, 2500, size=num_invoices).astype(float)
+    age[rng.random(num_invoices) < 0.01] = np.nan
+    dates = pd.Timestamp("2025-09-30") - pd.to_timedelta(np.nan_to_num(age, nan=0), unit="D")
+
+    amount = np.round(rng.lognormal(mean=10.5, sigma=1.2, size=num_invoices), 2)
+    paid_fraction = rng.choice([0.0, 0.0, 0.25, 0.5, 1.0], size=num_invoices)
+    balance = np.round(amount * (1 - paid_fraction), 2)
+
+    entity_base = 1941648000000000000 + org_index * 10_000_000_000
+    return pd.DataFrame({
+        "date": dates.strftime("%Y-%m-%d"),
+        "status": np.where(age >= 0, "overdue", "open"),
+        "entity_id": entity_base + np.arange(num_invoices),
+        "entity": "invoice",
+        "age": age,
+        "reminders_sent": rng.integers(0, 3, size=num_invoices),
+        "transaction_number": [f"INV-{org_index}{i:07d}" for i in range(num_invoices)],
+        "customer_id": entity_base + 5_000_000_000 + customer_idx,
+        "customer_name": np.asarray(customers, dtype=object)[customer_idx],
+        "currency_code": "INR",
+        "balance": balance,
+        "amount": amount,
+        "exchange_rate": 1,
+    }, columns=AGING_COLUMNS)
+
+
+def generate_customer_balance_frame(customers, aging_df, org_index=0, seed=0):
+    """
+    Generate a customer balance summary consistent with an aging frame.
+
+    Returns:
+        pd.DataFrame: Frame with CUSTOMER_BALANCE_COLUMNS, one row per customer.
+    """
+    rng = np.random.default_rng(seed + 7 + 1000 * org_index)
+    num_customers = len(customers)
+    invoice_balance = (
+        aging_df.groupby("customer_name")["balance"].sum()
+        .reindex(customers, fill_value=0.0).to_numpy()
+    )
+    credits = np.where(rng.random(num_customers) < 0.2,
+                       np.round(rng.lognormal(mean=9, sigma=1, size=num_customers), 0), 0)
+    entity_base = 1941648000000000000 + org_index * 10_000_000_000
+    return pd.DataFrame({
+        "customer_name": customers,
+        "customer_id": entity_base + 5_000_000_000 + np.arange(num_customers),
+        "closing_balance": np.round(invoice_balance - credits, 2),
+        "bcy_invoice_balance": np.round(invoice_balance, 2),
+        "bcy_available_credits": credits,
+        "last_name": [name.split(" ")[0].title() for name in customers],
+        "email": [f"accounts{i}@example.com" for i in range(num_customers)],
+        "mobile_phone": (9000000000 + rng.integers(0, 999999999, size=num_customers)).astype(str),
+        "contact.CF.Client Coordinator": rng.choice(COORDINATORS, size=num_customers),
+        "contact.CF.Leadership": rng.choice(np.array(LEADERSHIP, dtype=object), size=num_customers),
+        "contact.CF.Is Customer part of the Group of Companies": rng.choice(np.array(["Yes", None], dtype=object), size=num_customers),
+    }, columns=CUSTOMER_BALANCE_COLUMNS)
+
+
+def generate_dataset(num_invoices, num_customers=None, num_orgs=2, seed=0):
+    """
+    Generate aging and customer balance frames for several orgs.
+
+    Customers are partly shared between orgs so that consolidation has both
+    matched and one-sided rows.
+
+    Args:
+        num_invoices (int): Aging rows per org.
+        num_customers (int): Customers per org; defaults to one per ten invoices.
+        num_orgs (int): Number of orgs.
+        seed (int): Random seed.
+
+    Returns:
+        dict: org -> {"invoice_aging": DataFrame, "customer_balance": DataFrame}
+    """
+    if num_customers is None:
+        num_customers = max(10, num_invoices // 10)
+    rng = np.random.default_rng(seed)
+    pool = customer_names(int(num_customers * 1.5), rng)
+
+    dataset = {}
+    for org_index, org in enumerate(org_names(num_orgs)):
+        org_rng = np.random.default_rng(seed + org_index + 1)
+        customers = sorted(org_rng.choice(pool, size=num_customers, replace=False).tolist())
+        aging_df = generate_aging_frame(customers, num_invoices, org_index, seed)
+        balance_df = generate_customer_balance_frame(customers, aging_df, org_index, seed)
+        dataset[org] = {"invoice_aging": aging_df, "customer_balance": balance_df}
+    return dataset
+
+
+def write_dataset(dataset, folder="csvdata"):
+    """
+    Write a dataset as the input_{report}_{org}.xlsx files fetch_all_reports produces.
+
+    Returns:
+        list: Paths of the written files.
+    """
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for org, reports in dataset.items():
+        for report_name, df in reports.items():
+            path = os.path.join(folder, f"input_{report_name}_{org}.xlsx")
+            with pd.ExcelWriter(path, engine="xlsxwriter") as writer:
+                df.to_excel(writer, index=False, sheet_name="Sheet1")
+            paths.append(path)
+    return paths
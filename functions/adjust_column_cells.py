@@ -1,35 +1,80 @@
+import multiprocessing
 import os
+import posixpath
 import shutil
+import zipfile
+import xml.etree.ElementTree as ET
 import pandas as pd
 from openpyxl import load_workbook
-from openpyxl.utils import get_column_letter
+
+from concurrent.futures import ProcessPoolExecutor
+
+from functions.column_widths import estimate_column_widths, set_column_widths
+
+# Worker processes for process_output_folder (0 = one per CPU)
+PROCESS_OUTPUT_WORKERS = int(os.environ.get("PROCESS_OUTPUT_WORKERS", "0"))
+# Widths closer than this to the fitted width are left as they are; writers round widths slightly
+WIDTH_TOLERANCE = 1
+
+SHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+REL_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+PACKAGE_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}Relationship"
+
+def fitted_widths(sheet):
+    """Column widths that fit a sheet's values; works on read-only sheets."""
+    # Read the cell values once and size the columns on a DataFrame
+    values = pd.DataFrame(list(sheet.iter_rows(values_only=True)))
+    if values.empty:
+        return []
+    # Blank and zero cells never widened a column
+    values = values.where(values.astype(bool))
+    return estimate_column_widths(values, max_width=None, include_header=False)
 
 def adjust_column_widths(sheet):
-    for col in sheet.columns:
-        max_length = 0
-        column = col[0].column  # 1-based index
-        column_letter = get_column_letter(column)
-        for cell in col:
-            try:
-                if cell.value:
-                    max_length = max(max_length, len(str(cell.value)))
-            except Exception:
-                continue
-        sheet.column_dimensions[column_letter].width = max_length + 2
+    set_column_widths(sheet, fitted_widths(sheet))
+
+def current_widths(file_path):
+    """
+    Column widths set on each sheet, read from the sheet XML up to the cell data,
+    so no cell is loaded.
+
+    Returns:
+        dict: Sheet name -> {column index (0-based): width}.
+    """
+    with zipfile.ZipFile(file_path) as zf:
+        rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+        targets = {rel.get("Id"): rel.get("Target") for rel in rels.iter(PACKAGE_REL)}
+        workbook = ET.fromstring(zf.read("xl/workbook.xml"))
+        widths = {}
+        for sheet in workbook.iter(f"{SHEET_NS}sheet"):
+            target = targets[sheet.get(REL_ID)]
+            part = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+            sheet_widths = widths[sheet.get("name")] = {}
+            with zf.open(part) as f:
+                for event, element in ET.iterparse(f, events=("start", "end")):
+                    if event == "start" and element.tag == f"{SHEET_NS}sheetData":
+                        # <cols> comes before the cells; nothing after this is needed
+                        break
+                    if event == "end" and element.tag == f"{SHEET_NS}col" and element.get("width"):
+                        for col in range(int(element.get("min")), int(element.get("max")) + 1):
+                            sheet_widths[col - 1] = float(element.get("width"))
+    return widths
+
+def _needs_widths(fitted, current):
+    return any(
+        current.get(col) is None or abs(current[col] - width) > WIDTH_TOLERANCE
+        for col, width in enumerate(fitted)
+    )
 
 def convert_csv_to_xlsx_and_replace(csv_path):
     try:
         df = pd.read_csv(csv_path)
         temp_xlsx_path = csv_path.replace(".csv", "_temp.xlsx")
         
-        # Save to temp xlsx
-        df.to_excel(temp_xlsx_path, index=False)
-
-        # Load, format column widths
-        wb = load_workbook(temp_xlsx_path)
-        sheet = wb.active
-        adjust_column_widths(sheet)
-        wb.save(temp_xlsx_path)
+        # Save to temp xlsx in one write, with column widths set as it is written
+        with pd.ExcelWriter(temp_xlsx_path, engine="xlsxwriter") as writer:
+            df.to_excel(writer, index=False, sheet_name="Sheet1")
+            set_column_widths(writer.sheets["Sheet1"], estimate_column_widths(df, max_width=None))
 
         # Replace CSV with formatted XLSX
         os.remove(csv_path)
@@ -40,6 +85,37 @@ def convert_csv_to_xlsx_and_replace(csv_path):
     except Exception as e:
         print(f"Failed to convert/replace {csv_path}: {e}")
 
+def format_workbook(file_path):
+    """
+    Adjust column widths on every sheet of one workbook and save it in place.
+    Widths are measured in read-only mode; the workbook is loaded for writing
+    only when a sheet's widths are off. Runs in a worker process of process_output_folder.
+    """
+    filename = os.path.basename(file_path)
+    if not os.access(file_path, os.W_OK):
+        # A read-only workbook cannot be saved back; don't pay for loading it
+        print(f"Skipping read-only workbook: {filename}")
+        return
+    try:
+        wb = load_workbook(file_path, read_only=True)
+        try:
+            fitted = {sheet.title: fitted_widths(sheet) for sheet in wb.worksheets}
+        finally:
+            wb.close()
+        current = current_widths(file_path)
+        changed = {name: widths for name, widths in fitted.items() if _needs_widths(widths, current.get(name, {}))}
+        if not changed:
+            print(f"Column widths already fit: {filename}")
+            return
+
+        wb = load_workbook(file_path, keep_links=False)
+        print(f"Adjusting column widths for: {filename}")
+        for name, widths in changed.items():
+            set_column_widths(wb[name], widths)
+        wb.save(file_path)
+    except Exception as e:
+        print(f"Failed to format {filename}: {e}")
+
       
 def move_xlsx_to_output(csvdata_folder, output_folder):
     try:
@@ -54,22 +130,31 @@ def move_xlsx_to_output(csvdata_folder, output_folder):
     except Exception as e:
         print(f"Failed to copy files from {csvdata_folder} to {output_folder}: {e}")
 
-def process_output_folder(folder_path="output"):
+def process_output_folder(folder_path="output", max_workers=PROCESS_OUTPUT_WORKERS):
+    """
+    Fit column widths for every workbook in folder_path and convert CSVs to xlsx.
+    Files are independent, so each one is handled by its own worker process.
+    """
+    jobs = []
     for filename in os.listdir(folder_path):
         file_path = os.path.join(folder_path, filename)
 
         if filename.endswith(".xlsx") and not filename.startswith("~$"):
-            try:
-                wb = load_workbook(file_path)
-                print(f"Adjusting column widths for: {filename}")
-                for sheet in wb.worksheets:
-                    adjust_column_widths(sheet)
-                wb.save(file_path)
-            except Exception as e:
-                print(f"Failed to format {filename}: {e}")
-
+            jobs.append((format_workbook, file_path))
         elif filename.endswith(".csv"):
-            convert_csv_to_xlsx_and_replace(file_path)
-
+            jobs.append((convert_csv_to_xlsx_and_replace, file_path))
 
+    workers = min(max_workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        for func, file_path in jobs:
+            func(file_path)
+        return
 
+    # spawn: forking a process that runs threads is not safe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(func, file_path) for func, file_path in jobs]
+        for future, (_, file_path) in zip(futures, jobs):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Failed to process {os.path.basename(file_path)}: {e}")
@@ -1,5 +1,16 @@
 import pandas as pd
-from openpyxl.utils import get_column_letter
+import xlsxwriter
+
+from functions.aggregates import bucket_totals
+from functions.metrics import record_rows
+from functions.report_store import AGING_CHUNK_ROWS, iter_frames
+from functions.schema import (
+    AGE_BUCKET_LABELS, HEADER_FORMAT, WHOLE_NUMBER_FORMAT, from_paise, set_whole_number_format, to_paise,
+    whole_numbers, whole_rupees,
+)
+
+SUMMARY_HEADER_FORMAT = {'bold': True, 'bg_color': '#DCE6F1'}
+LINK_FORMAT = {'font_color': 'blue', 'underline': 1}
 
 def clean_sheet_name(name):
     """Clean sheet name to be Excel-compatible and hyperlink-safe"""
@@ -15,12 +26,83 @@ def clean_sheet_name(name):
         name = name.replace(k, v)
     return name[:31]  # Excel sheet name limit
 
+def summary_frame(summary_data):
+    """Summary rows per org plus the Total row, in whole numbers."""
+    summary_df = pd.DataFrame(summary_data)
+    
+    # Calculate totals
+    totals = summary_df.drop(columns=['Ageing bucket']).sum().to_dict()
+    totals['Ageing bucket'] = 'Total'
+    
+    # Append totals
+    return whole_numbers(pd.concat([summary_df, pd.DataFrame([totals])], ignore_index=True))
+
+def write_summary_sheet(worksheet, summary_df, sheet_mapping, header_format, number_format):
+    """
+    Write the Summary sheet row by row, linking each bucket total to its detail sheet.
+    Rows are written in order, so this also works in constant_memory mode.
+    """
+    # Format headers and apply number formatting
+    for col_idx, col_name in enumerate(summary_df.columns):
+        worksheet.write(0, col_idx, col_name, header_format)
+        if col_name != 'Ageing bucket':
+            worksheet.set_column(col_idx, col_idx, None, number_format)
+
+    total_row_idx = len(summary_df) - 1
+    for row_idx, row in summary_df.iterrows():
+        for col_idx, col in enumerate(summary_df.columns):
+            value = row[col]
+            if col == 'Ageing bucket' or row_idx == total_row_idx:
+                worksheet.write(row_idx + 1, col_idx, value)
+            elif col == 'Unpaid Invoices':
+                worksheet.write_number(row_idx + 1, col_idx, value, number_format)
+            elif value > 0 and sheet_mapping.get((row['Ageing bucket'], col)):
+                # Add hyperlinks with integer values
+                sheet_name = sheet_mapping[(row['Ageing bucket'], col)]
+                try:
+                    worksheet.write_url(
+                        row_idx + 1, col_idx,
+                        f"internal:'{sheet_name}'!A1",
+                        string=str(int(value)),  # Ensure integer display
+                        tip=f"Go to {sheet_name}",
+                        cell_format=number_format  # Apply number format
+                    )
+                except:
+                    worksheet.write_number(row_idx + 1, col_idx, value, number_format)
+            else:
+                worksheet.write_number(row_idx + 1, col_idx, value)
+
+def read_aging_file(file_name, file_path, chunk_rows=None):
+    """
+    Yield a segregator output without its total rows, whole or (with chunk_rows)
+    in batches. Yields nothing if the age range columns are missing.
+    """
+    frames = iter_frames(file_path, chunk_rows) if chunk_rows else [pd.read_excel(file_path)]
+    for df in frames:
+        record_rows("age_summary", file_name, len(df))
+        df.columns = df.columns.str.strip()
+        df = df[~df.iloc[:, 0].astype(str).str.strip().str.lower().str.contains('total')]
+
+        missing_cols = [col for col in AGE_BUCKET_LABELS if col not in df.columns]
+        if missing_cols:
+            print(f"Missing columns in {file_name}: {missing_cols}")
+            return
+        yield df
+
+def org_bucket_totals(file_name, transaction_numbers, paise):
+    """
+    One org's bucket totals in paise, applied to the kept aggregates when the
+    rows have invoice ids (see functions/aggregates.py), summed otherwise.
+    """
+    if transaction_numbers is None:
+        return paise.sum()
+    return bucket_totals(file_name, transaction_numbers, paise)
+
 def generate_summary(input_files, output_file):
-    ageing_cols = [
-        '3Yrs>=', '3Yr<=2Yr', '2Yr<=1Yr',
-        '1Yr<=180days', '180<=90days', '90<=60days',
-        '60<=30days', '>=30days', 'Age_Not_Provided'
-    ]
+    if AGING_CHUNK_ROWS:
+        return generate_summary_chunked(input_files, output_file, AGING_CHUNK_ROWS)
+
+    ageing_cols = AGE_BUCKET_LABELS
 
     summary_data = []
     detail_sheets = []
@@ -28,28 +110,26 @@ def generate_summary(input_files, output_file):
 
     for file_name, file_path in input_files.items():
         try:
-            df = pd.read_excel(file_path)
+            df = next(read_aging_file(file_name, file_path), None)
         except Exception as e:
             print(f"Error reading {file_path}: {e}")
             continue
-
-        df.columns = df.columns.str.strip()
-        df = df[~df.iloc[:, 0].astype(str).str.strip().str.lower().str.contains('total')]
-
-        missing_cols = [col for col in ageing_cols if col not in df.columns]
-        if missing_cols:
-            print(f"Missing columns in {file_name}: {missing_cols}")
+        if df is None:
             continue
 
-        df['Unpaid Invoices'] = df[ageing_cols].sum(axis=1)
+        # Sum in integer paise so the totals are exact
+        paise = df[ageing_cols].apply(to_paise).fillna(0)
+        unpaid_paise = paise.sum(axis=1)
+        df['Unpaid Invoices'] = from_paise(unpaid_paise)
 
         row_data = {'Ageing bucket': file_name}
+        totals = org_bucket_totals(file_name, df.get('transaction_number'), paise)
         for col in ageing_cols:
-            value = int(df[col].sum())  # Convert to integer here
+            value = whole_rupees(totals[col])  # Convert to integer here
             sheet_name = clean_sheet_name(f"{file_name}_{col}")
             sheet_mapping[(file_name, col)] = sheet_name
             row_data[col] = value
-        row_data['Unpaid Invoices'] = int(df['Unpaid Invoices'].sum())  # Convert to integer
+        row_data['Unpaid Invoices'] = whole_rupees(totals.sum())  # Convert to integer
         summary_data.append(row_data)
 
         for col in ageing_cols:
@@ -61,61 +141,23 @@ def generate_summary(input_files, output_file):
     try:
         with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
             workbook = writer.book
-            header_format = workbook.add_format({'bold': True, 'bg_color': '#DCE6F1'})
-            total_format = workbook.add_format({'bold': True, 'top': 1, 'bg_color': '#F2F2F2'})
-            number_format = workbook.add_format({'num_format': '0'})  # No decimals format
-            link_format = workbook.add_format({'font_color': 'blue', 'underline': 1})
-
-            # Create summary DataFrame
-            summary_df = pd.DataFrame(summary_data)
-            
-            # Calculate totals (converted to integers)
-            totals = {k: int(v) if isinstance(v, (int, float)) else v 
-                     for k, v in summary_df.drop(columns=['Ageing bucket']).sum().to_dict().items()}
-            totals['Ageing bucket'] = 'Total'
-            
-            # Append totals
-            summary_df = pd.concat([summary_df, pd.DataFrame([totals])], ignore_index=True)
-            
+            header_format = workbook.add_format(SUMMARY_HEADER_FORMAT)
+            number_format = workbook.add_format({'num_format': WHOLE_NUMBER_FORMAT})  # No decimals format
+            link_format = workbook.add_format(LINK_FORMAT)
+
             # Write Summary sheet
-            summary_df.to_excel(writer, sheet_name='Summary', index=False)
-            worksheet = writer.sheets['Summary']
-
-            # Format headers and apply number formatting
-            for col_idx, col_name in enumerate(summary_df.columns):
-                worksheet.write(0, col_idx, col_name, header_format)
-                if col_name != 'Ageing bucket':
-                    worksheet.set_column(col_idx, col_idx, None, number_format)
-
-            # Add hyperlinks with integer values
-            for row_idx, row in summary_df.iloc[:-1].iterrows():  # Skip total row
-                for col_idx, col in enumerate(summary_df.columns):
-                    if col == 'Ageing bucket':
-                        continue
-                    value = row[col]
-                    if col in ageing_cols and value > 0:
-                        sheet_name = sheet_mapping.get((row['Ageing bucket'], col))
-                        if sheet_name:
-                            try:
-                                worksheet.write_url(
-                                    row_idx + 1, col_idx,
-                                    f"internal:'{sheet_name}'!A1",
-                                    string=str(int(value)),  # Ensure integer display
-                                    tip=f"Go to {sheet_name}",
-                                    cell_format=number_format  # Apply number format
-                                )
-                            except:
-                                worksheet.write_number(row_idx + 1, col_idx, value, number_format)
-                    elif col == 'Unpaid Invoices':
-                        worksheet.write_number(row_idx + 1, col_idx, value, number_format)
+            worksheet = workbook.add_worksheet('Summary')
+            write_summary_sheet(worksheet, summary_frame(summary_data), sheet_mapping, header_format, number_format)
 
             # Write detail sheets with return hyperlinks
             for sheet_name, df, source_file, source_col in detail_sheets:
                 clean_sheet = clean_sheet_name(sheet_name)
+                df = whole_numbers(df)
                 df.to_excel(writer, sheet_name=clean_sheet, index=False)
                 
                 # Add ONE hyperlink in A1 only
                 ws_detail = writer.sheets[clean_sheet]
+                set_whole_number_format(ws_detail, number_format, df)
                 ws_detail.write_url(
                     0, 0,  # First row, first column (A1)
                     f"internal:'Summary'!A1",
@@ -138,4 +180,100 @@ def generate_summary(input_files, output_file):
         print(f"Excel file saved with bidirectional hyperlinks at {output_file}")
 
     except Exception as e:
-        print(f"Error saving Excel file: {e}")
\ No newline at end of file
+        print(f"Error saving Excel file: {e}")
+
+def generate_summary_chunked(input_files, output_file, chunk_rows):
+    """
+    Chunked variant of generate_summary for very large aging reports.
+
+    The first pass collects each batch's bucket balances for the totals; the second streams
+    each batch's detail rows straight to their sheets in constant_memory mode.
+    Only one batch is held in memory at a time.
+    """
+    ageing_cols = AGE_BUCKET_LABELS
+
+    # Pass 1: bucket totals and which detail sheets have rows
+    summary_data = []
+    sheet_mapping = {}
+    detail_sheets = []
+    for file_name, file_path in input_files.items():
+        paise_chunks, id_chunks = [], []
+        has_rows = pd.Series(False, index=ageing_cols)
+        try:
+            for df in read_aging_file(file_name, file_path, chunk_rows):
+                paise_chunks.append(df[ageing_cols].apply(to_paise).fillna(0).astype("int64"))
+                id_chunks.append(df.get('transaction_number'))
+                has_rows |= (df[ageing_cols] > 0).any()
+        except Exception as e:
+            print(f"Error reading {file_path}: {e}")
+            continue
+        if not paise_chunks:
+            continue
+
+        transaction_numbers = None if id_chunks[0] is None else pd.concat(id_chunks, ignore_index=True)
+        totals = org_bucket_totals(file_name, transaction_numbers, pd.concat(paise_chunks, ignore_index=True))
+        row_data = {'Ageing bucket': file_name}
+        for col in ageing_cols:
+            sheet_mapping[(file_name, col)] = clean_sheet_name(f"{file_name}_{col}")
+            row_data[col] = whole_rupees(totals[col])
+        row_data['Unpaid Invoices'] = whole_rupees(totals.sum())
+        summary_data.append(row_data)
+        detail_sheets.extend((file_name, col) for col in ageing_cols if has_rows[col])
+
+    try:
+        workbook = xlsxwriter.Workbook(output_file, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+        header_format = workbook.add_format(SUMMARY_HEADER_FORMAT)
+        detail_header_format = workbook.add_format(HEADER_FORMAT)
+        number_format = workbook.add_format({'num_format': WHOLE_NUMBER_FORMAT})
+        link_format = workbook.add_format(LINK_FORMAT)
+
+        worksheet = workbook.add_worksheet('Summary')
+        write_summary_sheet(worksheet, summary_frame(summary_data), sheet_mapping, header_format, number_format)
+        detail_worksheets = {
+            key: workbook.add_worksheet(clean_sheet_name(sheet_mapping[key])) for key in detail_sheets
+        }
+
+        # Pass 2: stream detail rows to their sheets
+        next_row = {key: 0 for key in detail_sheets}
+        for file_name, file_path in input_files.items():
+            if not any(key[0] == file_name for key in detail_sheets):
+                continue
+            for df in read_aging_file(file_name, file_path, chunk_rows):
+                df['Unpaid Invoices'] = from_paise(df[ageing_cols].apply(to_paise).fillna(0).sum(axis=1))
+                for col in ageing_cols:
+                    key = (file_name, col)
+                    if key not in detail_worksheets:
+                        continue
+                    filtered_df = df[df[col] > 0]
+                    if filtered_df.empty:
+                        continue
+                    cols_to_write = [c for c in df.columns if c not in ageing_cols or c == col]
+                    filtered_df = whole_numbers(filtered_df[cols_to_write])
+                    ws_detail = detail_worksheets[key]
+                    if next_row[key] == 0:
+                        set_whole_number_format(ws_detail, number_format, filtered_df)
+                        ws_detail.write_row(0, 0, cols_to_write, detail_header_format)
+                        ws_detail.write_url(0, 0, f"internal:'Summary'!A1", string="date", cell_format=link_format)
+                        next_row[key] = 1
+                    next_row[key] = write_detail_rows(ws_detail, filtered_df, next_row[key], link_format)
+        workbook.close()
+        print(f"Excel file saved with bidirectional hyperlinks at {output_file} (chunks of {chunk_rows} rows)")
+
+    except Exception as e:
+        print(f"Error saving Excel file: {e}")
+
+def write_detail_rows(worksheet, df, first_row, link_format):
+    """Write df's rows from first_row on, with date cells linking back to the Summary sheet."""
+    date_cols = {idx for idx, col in enumerate(df.columns) if 'date' in col.lower()}
+    raw_values = df.itertuples(index=False, name=None)
+    values = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    row_idx = first_row
+    for raw_row, row in zip(raw_values, values):
+        for col_idx, value in enumerate(row):
+            if col_idx in date_cols:
+                worksheet.write_url(row_idx, col_idx, f"internal:'Summary'!A1",
+                                    string=str(raw_row[col_idx]), cell_format=link_format)
+            elif value is not None:
+                worksheet.write(row_idx, col_idx, value)
+        row_idx += 1
+    return row_idx
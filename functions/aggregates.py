@@ -0,0 +1,250 @@
+"""
+Summary totals kept between runs and moved by row deltas.
+
+age_summary totals every org's aging buckets and balance_summary every
+balance range. Between two runs only a few invoices change balance or move
+bucket, so the totals are kept as state under AGGREGATES_DIR, in integer
+paise, together with the keyed rows they were summed from:
+
+- aging: one row per invoice and bucket (transaction_number, bucket) with its
+  balance, per org;
+- balances: one row per customer_name with its balance range and money columns.
+
+A new run is joined to the stored rows on the key and only the group and
+amounts are compared; rows that were added, removed or changed are then
+subtracted from or added to the totals. Finding the churn is one keyed join
+and an array compare; the totals are updated in proportion to the churn.
+Keys are factorized to integers across both runs, and rows that share a key
+are told apart by their order of appearance, as in compare.reconcile_frames.
+"""
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from functions.schema import as_text
+
+AGGREGATES_DIR = os.environ.get("AGGREGATES_DIR", "cache/aggregates")
+# Bumped whenever the stored layout changes; older state is rebuilt
+STATE_VERSION = 1
+_GROUP = "_group"
+
+
+def key_text(values):
+    """A key column as a numpy array of text: whole floats without ".0", missing as ""."""
+    values = pd.Series(values).reset_index(drop=True)
+    if pd.api.types.is_float_dtype(values):
+        values = as_text(values)
+    return values.astype(object).where(values.notna(), "").astype(str).to_numpy(dtype=object)
+
+
+def _occurrences(keys):
+    return pd.Series(keys).groupby(keys, sort=False).cumcount().to_numpy(dtype=np.int64)
+
+
+def joint_keys(old, new):
+    """
+    Integer keys of two key frames' rows, equal where the rows' keys are equal.
+    Each column's text is factorized across both frames at once, and a row's
+    occurrence of its key is folded in so the keys are unique on each side.
+    """
+    old_keys, new_keys = np.zeros(len(old), dtype=np.int64), np.zeros(len(new), dtype=np.int64)
+    for col in old.columns:
+        codes, uniques = pd.factorize(np.concatenate([old[col].to_numpy(dtype=object), new[col].to_numpy(dtype=object)]))
+        old_keys = old_keys * len(uniques) + codes[:len(old)]
+        new_keys = new_keys * len(uniques) + codes[len(old):]
+    old_seen, new_seen = _occurrences(old_keys), _occurrences(new_keys)
+    repeats = max(old_seen.max(initial=0), new_seen.max(initial=0)) + 1
+    return old_keys * repeats + old_seen, new_keys * repeats + new_seen
+
+
+class KeyedTotals:
+    """
+    Amount totals per group plus the keyed rows they were summed from.
+
+    Args:
+        groups (list): Group labels; rows carry their group's position.
+        columns (list): Amount column names.
+        keys (pd.DataFrame): Key text columns of each row.
+        row_groups (np.ndarray): Group position of each row.
+        amounts (np.ndarray): int64 amounts, one row per key and one column per amount column.
+        totals (np.ndarray): int64 totals, one row per group.
+    """
+
+    def __init__(self, groups, columns, keys, row_groups, amounts, totals):
+        self.groups = list(groups)
+        self.columns = list(columns)
+        self.keys = keys.reset_index(drop=True)
+        self.row_groups = row_groups
+        self.amounts = amounts
+        self.totals = totals
+
+    @classmethod
+    def empty(cls, groups, columns, key_names):
+        return cls(
+            groups, columns,
+            keys=pd.DataFrame({name: pd.Series(dtype=object) for name in key_names}),
+            row_groups=np.zeros(0, dtype=np.int16),
+            amounts=np.zeros((0, len(columns)), dtype=np.int64),
+            totals=np.zeros((len(groups), len(columns)), dtype=np.int64),
+        )
+
+    def apply(self, keys, row_groups, amounts):
+        """
+        Move the totals to a new run's rows, applying only the rows that differ.
+
+        Returns:
+            dict: Added, removed and changed row counts.
+        """
+        old_keys, new_keys = joint_keys(self.keys, keys)
+        old_positions = pd.Index(old_keys).get_indexer(new_keys)
+        matched = old_positions >= 0
+        matched_rows = np.flatnonzero(matched)
+        old_matched = old_positions[matched]
+        same = (self.row_groups[old_matched] == row_groups[matched_rows]) & \
+            (self.amounts[old_matched] == amounts[matched_rows]).all(axis=1)
+        kept = np.zeros(len(self.keys), dtype=bool)
+        kept[old_matched] = True
+
+        removed = np.concatenate([np.flatnonzero(~kept), old_matched[~same]])
+        added = np.concatenate([np.flatnonzero(~matched), matched_rows[~same]])
+        np.subtract.at(self.totals, self.row_groups[removed], self.amounts[removed])
+        np.add.at(self.totals, row_groups[added], amounts[added])
+
+        self.keys, self.row_groups, self.amounts = keys.reset_index(drop=True), row_groups, amounts
+        return {
+            "added": int((~matched).sum()),
+            "removed": int((~kept).sum()),
+            "changed": int((~same).sum()),
+            "rows": len(keys),
+        }
+
+    def frame(self):
+        """Totals as a frame indexed by group, in paise."""
+        return pd.DataFrame(self.totals, index=self.groups, columns=self.columns)
+
+    def save(self, path):
+        """Write the state to path, replacing any previous state atomically."""
+        table = pa.Table.from_pandas(self.keys, preserve_index=False)
+        table = table.append_column(_GROUP, pa.array(self.row_groups, type=pa.int16()))
+        for position, name in enumerate(self.columns):
+            table = table.append_column(f"amount_{position}", pa.array(self.amounts[:, position], type=pa.int64()))
+        table = table.replace_schema_metadata({"aggregates": json.dumps({
+            "version": STATE_VERSION,
+            "groups": self.groups,
+            "columns": self.columns,
+            "totals": self.totals.tolist(),
+        })})
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, groups, columns, key_names):
+        """Read a saved state, or None when it is missing or has another layout."""
+        try:
+            table = feather.read_table(path, memory_map=True)
+            meta = json.loads(table.schema.metadata[b"aggregates"])
+        except (OSError, KeyError, TypeError, ValueError, pa.ArrowInvalid):
+            return None
+        if (meta.get("version") != STATE_VERSION or meta.get("groups") != list(groups)
+                or meta.get("columns") != list(columns)
+                or table.column_names[:len(key_names)] != list(key_names)):
+            return None
+        keys = pd.DataFrame({name: table.column(name).to_numpy(zero_copy_only=False) for name in key_names})
+        amounts = np.column_stack([
+            table.column(f"amount_{position}").to_numpy() for position in range(len(columns))
+        ]) if len(columns) else np.zeros((table.num_rows, 0), dtype=np.int64)
+        return cls(
+            groups, columns, keys,
+            row_groups=table.column(_GROUP).to_numpy().astype(np.int16),
+            amounts=amounts.astype(np.int64).reshape(table.num_rows, len(columns)),
+            totals=np.array(meta["totals"], dtype=np.int64).reshape(len(groups), len(columns)),
+        )
+
+
+def update_totals(name, groups, columns, ids, row_groups, amounts):
+    """
+    Bring the totals stored as name up to a new run's rows and store them.
+
+    Args:
+        name (str): State file name under AGGREGATES_DIR.
+        groups (list): Group labels.
+        columns (list): Amount column names.
+        ids (dict): Key column name -> text column, one row per amount row.
+        row_groups (np.ndarray): Group position of each row.
+        amounts (np.ndarray): int64 amounts, one row per row and one column per amount column.
+
+    Returns:
+        pd.DataFrame: Totals per group in paise.
+    """
+    start = time.perf_counter()
+    path = os.path.join(AGGREGATES_DIR, f"{name}.feather")
+    keys = pd.DataFrame(ids)
+    row_groups = np.asarray(row_groups, dtype=np.int16)
+    amounts = np.asarray(amounts, dtype=np.int64).reshape(len(keys), len(columns))
+
+    state = KeyedTotals.load(path, groups, columns, list(ids))
+    mode = "applied"
+    if state is None:
+        state, mode = KeyedTotals.empty(groups, columns, list(ids)), "built"
+    stats = state.apply(keys, row_groups, amounts)
+    try:
+        state.save(path)
+    except OSError as e:
+        print(f"[Aggregates Error] Failed to store {name}: {e}")
+    print(f"[Aggregates] {name}: {mode} {stats['added']} added, {stats['removed']} removed and "
+          f"{stats['changed']} changed of {stats['rows']} rows in {time.perf_counter() - start:.2f}s")
+    return state.frame()
+
+
+def bucket_totals(org, transaction_numbers, bucket_paise):
+    """
+    Aging bucket totals of one org's segregator output, from the kept state.
+
+    Args:
+        org (str): Org name, e.g. "NVB".
+        transaction_numbers (pd.Series): Invoice id of each row.
+        bucket_paise (pd.DataFrame): The age bucket columns in paise, missing as 0.
+
+    Returns:
+        pd.Series: Paise per bucket column.
+    """
+    buckets = list(bucket_paise.columns)
+    values = bucket_paise.to_numpy(dtype=np.int64)
+    # One row per invoice and bucket it has a balance in
+    rows, positions = np.nonzero(values)
+    totals = update_totals(
+        f"aging_{org}", buckets, ["balance"],
+        {"transaction_number": key_text(transaction_numbers)[rows],
+         "bucket": np.asarray(buckets, dtype=object)[positions]},
+        positions, values[rows, positions],
+    )
+    return totals["balance"]
+
+
+def range_totals(customer_names, ranges, range_labels, money_paise):
+    """
+    Money totals per balance range of the consolidated balances, from the kept state.
+
+    Args:
+        customer_names (pd.Series): Customer of each row.
+        ranges (pd.Series): Range label of each row (missing rows are left out).
+        range_labels (list): Every range label.
+        money_paise (pd.DataFrame): Money columns in paise, missing as 0.
+
+    Returns:
+        pd.DataFrame: Paise per range and money column.
+    """
+    positions = pd.Categorical(ranges, categories=range_labels).codes
+    present = positions >= 0
+    return update_totals(
+        "balances", range_labels, [str(col) for col in money_paise.columns],
+        {"customer_name": key_text(customer_names)[present]},
+        positions[present], money_paise.to_numpy(dtype=np.int64)[present],
+    )
@@ -1,6 +1,12 @@
 import pandas as pd
 import xlsxwriter
 
+from functions import aggregates
+from functions.metrics import record_rows
+from functions.schema import (
+    PAISE_PER_RUPEE, WHOLE_NUMBER_FORMAT, set_whole_number_format, to_paise, whole_numbers,
+)
+
 def read_excel_file(file_path):
     try:
         df = pd.read_excel(file_path)
@@ -9,6 +15,21 @@ def read_excel_file(file_path):
         print(f"Error reading the file: {e}")
         return None
 
+# Closing balance ranges: (lower exclusive, upper inclusive, label)
+BALANCE_RANGES = [
+    (float('-inf'), 0, "<0"),
+    (0, 50000, "0-50K"),
+    (50000, 200000, "50K-2L"),
+    (200000, 500000, "2L-5L"),
+    (500000, float('inf'), ">5L"),
+]
+
+def balance_range_labels(balances):
+    """Label each closing balance with its BALANCE_RANGES range (NaN for missing values)."""
+    edges = [BALANCE_RANGES[0][0]] + [upper for _, upper, _ in BALANCE_RANGES]
+    labels = [label for _, _, label in BALANCE_RANGES]
+    return pd.cut(pd.to_numeric(balances, errors='coerce'), bins=edges, labels=labels, right=True)
+
 def generate_sheets_by_balance(dataframe, column_index):
     if column_index < 0 or column_index >= len(dataframe.columns):
         print(f"Invalid column index: {column_index}")
@@ -19,35 +40,43 @@ def generate_sheets_by_balance(dataframe, column_index):
     dataframe = dataframe.dropna(subset=[column_name])
 
     derived_sheets = {}
-    ranges = [
-        (float('-inf'), 0, "<0"),
-        (0, 50000, "0-50K"),
-        (50000, 200000, "50K-2L"),
-        (200000, 500000, "2L-5L"),
-        (500000, float('inf'), ">5L"),
-    ]
-
-    for lower, upper, label in ranges:
+    for lower, upper, label in BALANCE_RANGES:
         filtered_df = dataframe[(dataframe[column_name] > lower) & (dataframe[column_name] <= upper)]
         if not filtered_df.empty:
             derived_sheets[label] = filtered_df
 
     return derived_sheets
 
-def calculate_totals(df):
+TOTAL_KEYS = [
+    'smcs_invoice_balance_sum', 'smcs_available_credits_sum', 'smcs_balance',
+    'nvb_invoice_balance_sum', 'nvb_available_credits_sum', 'nvb_balance',
+    'consolidated_invoice_balance_sum', 'consolidated_available_credits_sum', 'consolidated_cons_bal_os_sum',
+]
+
+RANGE_LABELS = [label for _, _, label in BALANCE_RANGES]
+
+def fill_money(df):
+    # Columns 1-9 hold the money; missing amounts count as 0
     df.iloc[:, 1:10] = df.iloc[:, 1:10].apply(pd.to_numeric, errors='coerce').fillna(0)
-    totals = {
-        'smcs_invoice_balance_sum': df.iloc[:, 1].sum(),
-        'smcs_available_credits_sum': df.iloc[:, 2].sum(),
-        'smcs_balance': df.iloc[:, 3].sum(),
-        'nvb_invoice_balance_sum': df.iloc[:, 4].sum(),
-        'nvb_available_credits_sum': df.iloc[:, 5].sum(),
-        'nvb_balance': df.iloc[:, 6].sum(),
-        'consolidated_invoice_balance_sum': df.iloc[:, 7].sum(),
-        'consolidated_available_credits_sum': df.iloc[:, 8].sum(),
-        'consolidated_cons_bal_os_sum': df.iloc[:, 9].sum(),
-    }
-    return totals
+
+def rupee_totals(paise_sums):
+    return {key: int(total) / PAISE_PER_RUPEE for key, total in zip(TOTAL_KEYS, paise_sums)}
+
+def calculate_totals(df):
+    fill_money(df)
+    # Sum in integer paise so the totals are exact
+    paise_sums = df.iloc[:, 1:10].apply(to_paise).sum().to_numpy()
+    return rupee_totals(paise_sums)
+
+def range_paise_totals(df, column_name):
+    """
+    Money totals in paise per balance range of df's column_name, applied to the
+    kept aggregates (see functions/aggregates.py).
+    """
+    fill_money(df)
+    return aggregates.range_totals(
+        df.iloc[:, 0], balance_range_labels(df[column_name]), RANGE_LABELS, df.iloc[:, 1:10].apply(to_paise),
+    )
 
 def create_summary_sheet(range_totals, ranges, summary_columns, writer):
     summary_data = []
@@ -55,12 +84,14 @@ def create_summary_sheet(range_totals, ranges, summary_columns, writer):
         row = range_totals.get(range_label, [0] * 9)
         summary_data.append(row)
 
-    summary_df = pd.DataFrame(
+    summary_df = whole_numbers(pd.DataFrame(
         summary_data,
         columns=pd.MultiIndex.from_arrays(summary_columns),
         index=ranges
-    )
+    ))
     summary_df.to_excel(writer, sheet_name='Summary', index=True)
+    number_format = writer.book.add_format({'num_format': WHOLE_NUMBER_FORMAT})
+    set_whole_number_format(writer.sheets['Summary'], number_format, summary_df, first_col=1)
 
 def apply_color_formatting(worksheet, num_rows, num_cols, workbook):
     # Define the formats
@@ -84,6 +115,7 @@ def process_file(input_file, output_file):
     consolidated_df = read_excel_file(input_file)
     if consolidated_df is None:
         return
+    record_rows("balance_summary", "all", len(consolidated_df))
 
     # Ensure the correct header is used
     split_column_index = 9
@@ -102,8 +134,9 @@ def process_file(input_file, output_file):
     else:
         print("Consolidated DataFrame is empty.")
 
-    # Calculate totals for the consolidated sheet
-    totals = calculate_totals(consolidated_df)
+    # Totals per range, and for the consolidated sheet, which the ranges cover
+    paise_by_range = range_paise_totals(consolidated_df, column_name)
+    totals = rupee_totals(paise_by_range.sum().to_numpy())
 
     # Create a total row with "Total" in customer_name and sums in numeric columns
     total_row = pd.Series(index=consolidated_df.columns, dtype=object)
@@ -131,6 +164,7 @@ def process_file(input_file, output_file):
 
     with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
         workbook = writer.book
+        number_format = workbook.add_format({'num_format': WHOLE_NUMBER_FORMAT})
 
         # Top headers and subheaders
         top_headers = [
@@ -149,8 +183,10 @@ def process_file(input_file, output_file):
         ]
 
         # Write consolidated sheet (including total row)
+        consolidated_df = whole_numbers(consolidated_df)
         consolidated_df.to_excel(writer, sheet_name='Consolidated', index=False, header=False, startrow=2)
         worksheet = writer.sheets['Consolidated']
+        set_whole_number_format(worksheet, number_format, consolidated_df)
 
         for col_num, header in enumerate(top_headers):
             worksheet.write(0, col_num, header)
@@ -164,12 +200,14 @@ def process_file(input_file, output_file):
             df = df.sort_values(by=df.columns[split_column_index], ascending=False)
             df.reset_index(drop=True, inplace=True)
 
-            totals = calculate_totals(df)
-            range_totals[sheet_name] = list(totals.values())
+            fill_money(df)
+            range_totals[sheet_name] = list(rupee_totals(paise_by_range.loc[sheet_name].to_numpy()).values())
 
             safe_name = sheet_name[:31]
+            df = whole_numbers(df)
             df.to_excel(writer, sheet_name=safe_name, index=False, header=False, startrow=2)
             worksheet = writer.sheets[safe_name]
+            set_whole_number_format(worksheet, number_format, df)
 
             for col_num, header in enumerate(top_headers):
                 worksheet.write(0, col_num, header)
@@ -0,0 +1,67 @@
+"""
+Column width estimation for the Excel writers.
+
+Widths are worked out on the DataFrame with vectorised string lengths and
+set on the worksheet while it is being written, instead of visiting every
+cell after the fact.
+"""
+import os
+
+import pandas as pd
+
+WIDTH_PADDING = 2
+MAX_COLUMN_WIDTH = 50
+# Columns longer than this are estimated from a sample of rows
+WIDTH_SAMPLE_ROWS = int(os.environ.get("WIDTH_SAMPLE_ROWS", "20000"))
+
+
+def _longest_value(values, sample_size):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Only the distinct values matter; no need to touch every row
+        values = pd.Series(values.cat.categories[values.cat.codes[values.cat.codes >= 0].unique()])
+    else:
+        values = values.dropna()
+        if sample_size and len(values) > sample_size:
+            # Keep the head (often the longest header-like rows) and a random spread of the rest
+            values = pd.concat([values.iloc[:sample_size // 2], values.sample(sample_size // 2, random_state=0)])
+    if values.empty:
+        return 0
+    if pd.api.types.is_bool_dtype(values):
+        return 5
+    return int(values.astype(str).str.len().max())
+
+
+def estimate_column_widths(df, sample_size=WIDTH_SAMPLE_ROWS, padding=WIDTH_PADDING,
+                           max_width=MAX_COLUMN_WIDTH, include_header=True):
+    """
+    Estimate Excel column widths for a DataFrame.
+
+    Args:
+        df (pd.DataFrame): Data to be written.
+        sample_size (int): Sample columns with more rows than this; 0 or None reads every row.
+        padding (int): Characters added to the longest value.
+        max_width (int): Upper bound on a width; None for no bound.
+        include_header (bool): Count the column name as a value.
+
+    Returns:
+        list: One width per column, in column order.
+    """
+    widths = []
+    for position in range(df.shape[1]):
+        longest = _longest_value(df.iloc[:, position], sample_size)
+        if include_header:
+            longest = max(longest, len(str(df.columns[position])))
+        width = longest + padding
+        widths.append(min(width, max_width) if max_width else width)
+    return widths
+
+
+def set_column_widths(worksheet, widths, first_col=0):
+    """Apply widths to an xlsxwriter or openpyxl worksheet."""
+    if hasattr(worksheet, "set_column"):
+        for offset, width in enumerate(widths):
+            worksheet.set_column(first_col + offset, first_col + offset, width)
+    else:
+        from openpyxl.utils import get_column_letter
+        for offset, width in enumerate(widths):
+            worksheet.column_dimensions[get_column_letter(first_col + offset + 1)].width = width
@@ -0,0 +1,442 @@
+"""
+Writers for the Combined_Report workbook: every report file as its own
+sheet, with the consolidated invoice balances linked to the aging sheets.
+
+build_combined_report is the pipeline's combined_report stage. By default
+create_combined_excel parses every sheet into pandas and add_hyperlinks then
+loads the whole workbook into openpyxl, so their memory grows with the aging
+reports. In the chunked mode (AGING_CHUNK_ROWS) the same workbook is
+streamed instead by write_combined_report:
+
+- Sheets are read in openpyxl read-only mode, and fetched reports from their
+  memory-mapped sidecars, then written row by row to an xlsxwriter workbook
+  in constant_memory mode with the write-time rounding policy applied.
+- The two input aging sheets are written sorted by customer_name. Only that
+  column is held for the sort; rows are taken from the sidecar in batches.
+- The consolidated sheet's invoice balances link to the customer's first row
+  on the aging sheets, the linked names go into the aging sheets' filters,
+  and the Instructions sheet is added last, as add_hyperlinks does. Links
+  are HYPERLINK formulas, so the cells keep their numbers.
+
+Memory is set by chunk_rows and the number of customers, not by the number
+of invoices.
+"""
+import math
+import os
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pyarrow as pa
+import xlsxwriter
+from openpyxl import load_workbook
+from openpyxl.utils import get_column_letter
+
+from functions.customer_index import CustomerIndex
+from functions.metrics import time_stage
+from functions.report_store import AGING_CHUNK_ROWS, read_frame, sidecar_path, sidecar_table
+from functions.schema import HEADER_FORMAT, whole_numbers
+from functions.workbook_writer import load_report_sheets, report_sheets
+
+AGING_SHEETS = {"SMCS": "input_invoice_aging_smcs", "NVB": "input_invoice_aging_nvb"}
+INSTRUCTIONS = (
+    "How to Use Hyperlinks",
+    "Click a hyperlink to navigate to the aging sheet with a pre-applied filter for the exact company name. "
+    "Use Excel's filter dropdown to adjust or clear the filter manually if needed.",
+)
+
+
+def _whole(value):
+    # The write-time rounding policy for one cell
+    if isinstance(value, float) and math.isfinite(value):
+        return int(value) if value.is_integer() else math.trunc(value)
+    return value
+
+
+def _header_names(header, width):
+    """Column names as pd.read_excel makes them: "Unnamed: i" for blanks, ".1" for repeats."""
+    names, counts = [], {}
+    for position in range(width):
+        name = header[position] if position < len(header) else None
+        name = f"Unnamed: {position}" if name is None else name
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = f"{name}.{count}"
+            count = counts.get(name, 0)
+        counts[name] = count + 1
+        names.append(name)
+    return names
+
+
+class _SheetSource:
+    """One sheet of the combined report and where its rows come from."""
+
+    def __init__(self, name, path, sheet=None, table=None):
+        self.name = name
+        self.path = path
+        self.sheet = sheet
+        self.table = table
+
+    def rows(self, chunk_rows, order=None):
+        """Yield the header, then the data rows (None for a blank row)."""
+        if self.table is not None:
+            yield list(self.table.column_names)
+            batches = (
+                (self.table.take(order[start:start + chunk_rows]) for start in range(0, len(order), chunk_rows))
+                if order is not None else (self.table.slice(start, chunk_rows) for start in range(0, self.table.num_rows, chunk_rows))
+            )
+            for batch in batches:
+                df = whole_numbers(batch.to_pandas())
+                yield from df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+            return
+        wb = load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            worksheet = wb[self.sheet]
+            rows = worksheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            yield _header_names(header, max(worksheet.max_column or 0, len(header)))
+            for row in rows:
+                yield [_whole(value) for value in row] if any(value is not None for value in row) else None
+        finally:
+            wb.close()
+
+
+def _sources(files_to_process):
+    """Sheets in the order create_combined_excel writes them."""
+    sources = []
+    for file_path in files_to_process:
+        if not os.path.exists(file_path):
+            continue
+        base_name = os.path.splitext(os.path.basename(file_path))[0]
+        if os.path.exists(sidecar_path(file_path)):
+            table = sidecar_table(file_path)
+            if table is None:
+                # Not memory-mappable; read whole as create_combined_excel does
+                table = pa.Table.from_pandas(read_frame(file_path), preserve_index=False)
+            sources.append(_SheetSource(base_name[:31], file_path, table=table))
+            continue
+        wb = load_workbook(file_path, read_only=True)
+        sheet_names = wb.sheetnames
+        wb.close()
+        for sheet_name in sheet_names:
+            if len(sheet_names) > 1:
+                safe_sheet_name = f"{base_name[:15]}_{sheet_name[:15]}"[:31]
+            else:
+                safe_sheet_name = base_name[:31]
+            sources.append(_SheetSource(safe_sheet_name, file_path, sheet=sheet_name))
+    return sources
+
+
+def _consolidated_layout(source, chunk_rows):
+    """
+    Invoice Balance columns per org and the customer names of the consolidated sheet.
+
+    Returns:
+        tuple or None: ({org: invoice column}, customer_name column, names by row), or None
+        when a column is missing.
+    """
+    rows = source.rows(chunk_rows)
+    group_header = next(rows, None)
+    sub_header = next(rows, None)
+    if group_header is None or sub_header is None:
+        return None
+    invoice_cols, cust_col = {}, None
+    for col, value in enumerate(sub_header):
+        group = group_header[col] if col < len(group_header) else None
+        if value == 'Invoice Balance' and isinstance(group, str):
+            for org in AGING_SHEETS:
+                if f"{org} Receivables" in group:
+                    invoice_cols[org] = col
+        elif value == 'customer_name':
+            cust_col = col
+    if cust_col is None or len(invoice_cols) < len(AGING_SHEETS):
+        return None
+    names = [row[cust_col] if row is not None and cust_col < len(row) else None for row in rows]
+    return invoice_cols, cust_col, names
+
+
+def _aging_order(source):
+    """Row order sorted by customer_name and the sorted names, or None without a customer_name column."""
+    if source.table is None:
+        # Only sidecar-backed aging reports can be taken from out of order
+        return None
+    if "customer_name" not in source.table.column_names:
+        return None
+    names = source.table.column("customer_name").to_pandas().astype(object).to_numpy()
+    keys = np.array([name if name else '' for name in names], dtype=object)
+    order = np.argsort(keys, kind="stable")
+    return order, names[order]
+
+
+def write_combined_report(output_file, files_to_process, chunk_rows):
+    """Write Combined_Report.xlsx with its hyperlinks, streaming every sheet (see the module docstring)."""
+    sources = _sources(files_to_process)
+    by_name = {source.name: source for source in sources}
+    cons_source = next((source for source in sources if 'consolidated' in source.name.lower()), None)
+
+    # Sort order and link targets, worked out before anything is written
+    orders, links = {}, None
+    aging = {org: by_name.get(name) for org, name in AGING_SHEETS.items()}
+    if cons_source is None:
+        print("[Hyperlink] Consolidated sheet not found")
+    elif not all(aging.values()):
+        print("[Hyperlink] Aging sheets not found")
+    else:
+        orders = {org: _aging_order(source) for org, source in aging.items()}
+        layout = _consolidated_layout(cons_source, chunk_rows)
+        if not all(orders.values()):
+            print("[Hyperlink] customer_name column not found in an aging report sidecar")
+            orders = {}
+        elif layout is None:
+            print("[Hyperlink] Required columns not found in consolidated sheet")
+        else:
+            invoice_cols, cust_col, cons_names = layout
+            customer_index = CustomerIndex.build(cons_names)
+            links = {
+                "invoice_cols": invoice_cols,
+                "cust_col": cust_col,
+                "cons_keys": customer_index.keys_for(cons_names),
+                # Sheet row of each customer's first invoice, below the header
+                "first_rows": {
+                    org: {key: pos + 2 for key, pos in customer_index.first_rows(sorted_names).items()}
+                    for org, (_, sorted_names) in orders.items()
+                },
+                "sorted_names": {org: sorted_names for org, (_, sorted_names) in orders.items()},
+                "filters": {org: {} for org in AGING_SHEETS},
+            }
+
+    workbook = xlsxwriter.Workbook(output_file, {
+        'constant_memory': True, 'strings_to_urls': False, 'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+    })
+    header_format = workbook.add_format(HEADER_FORMAT)
+    link_format = workbook.get_default_url_format()
+    aging_worksheets = {}
+    try:
+        for source in sources:
+            worksheet = workbook.add_worksheet(source.name)
+            org = next((org for org, name in AGING_SHEETS.items() if name == source.name), None)
+            order = orders[org][0] if org in orders else None
+            rows = source.rows(chunk_rows, order)
+            header = next(rows, None)
+            if header is None:
+                continue
+            worksheet.write_row(0, 0, header, header_format)
+            row_idx = 0
+            for row_idx, row in enumerate(rows, 1):
+                if row is None:
+                    continue
+                if links and source is cons_source and row_idx >= 2:
+                    _write_linked_row(worksheet, row_idx, row, links, link_format)
+                else:
+                    worksheet.write_row(row_idx, 0, row)
+            if org in orders:
+                aging_worksheets[org] = (worksheet, row_idx, header)
+
+        for org, (worksheet, last_row, header) in aging_worksheets.items():
+            worksheet.autofilter(0, 0, last_row, len(header) - 1)
+            if links and links["filters"][org]:
+                worksheet.filter_column_list(header.index("customer_name"), list(links["filters"][org]))
+        if links:
+            inst_sheet = workbook.add_worksheet('Instructions')
+            inst_sheet.write(0, 0, INSTRUCTIONS[0])
+            inst_sheet.write(1, 0, INSTRUCTIONS[1])
+    finally:
+        workbook.close()
+    if links:
+        print("[Hyperlink] Hyperlinks, auto-filters, and instructions added successfully")
+
+
+def _write_linked_row(worksheet, row_idx, row, links, link_format):
+    """A consolidated data row; row_idx 1 is the sub-header, so customers start at 2."""
+    key = links["cons_keys"][row_idx - 2]
+    cust_name = row[links["cust_col"]] if links["cust_col"] < len(row) else None
+    linked = {}
+    if cust_name and key != CustomerIndex.MISSING:
+        for org, col in links["invoice_cols"].items():
+            value = row[col] if col < len(row) else None
+            first_row = links["first_rows"][org].get(int(key))
+            if isinstance(value, (int, float)) and value > 0 and first_row:
+                linked[col] = (org, first_row, value)
+    for col, value in enumerate(row):
+        if col in linked:
+            org, first_row, number = linked[col]
+            target = f"#'{AGING_SHEETS[org]}'!A{first_row}"
+            worksheet.write_formula(row_idx, col, f'=HYPERLINK("{target}",{number})', link_format, number)
+            worksheet.write_comment(row_idx, col, f"Filter for: {cust_name}", {"author": "Grok"})
+            # Filter on the aging sheet's own spelling of the customer
+            links["filters"][org].setdefault(links["sorted_names"][org][first_row - 2], None)
+        elif value is not None:
+            worksheet.write(row_idx, col, value)
+
+
+def build_combined_report(output_file: str, files_to_process: list, sheet_bundles: dict = None):
+    """
+    Create the single combined Excel and add hyperlinks to its consolidated sheet.
+    With AGING_CHUNK_ROWS set both are streamed in one pass (write_combined_report).
+    """
+    if AGING_CHUNK_ROWS:
+        with time_stage("write_combined_report"):
+            write_combined_report(output_file, files_to_process, AGING_CHUNK_ROWS)
+        return
+    with time_stage("create_combined_excel"):
+        create_combined_excel(output_file, files_to_process, sheet_bundles, hyperlinks=True)
+
+
+def create_combined_excel(output_file: str, files_to_process: list, sheet_bundles: dict = None,
+                          hyperlinks: bool = False):
+    """
+    Combine multiple Excel files into a single Excel file with separate sheets.
+    Numbers are written whole, per the write-time rounding policy in functions/schema.py.
+    Each file's sheets are read from its bundle in sheet_bundles, parsed beforehand
+    by a stage of its own (see functions/workbook_writer.py); without bundles the
+    files are parsed here. With hyperlinks the links add_hyperlinks would add are
+    added before the workbook is first saved, so it is not loaded back and saved twice.
+    """
+    with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+        for file_path in files_to_process:
+            if sheet_bundles:
+                sheets = load_report_sheets(sheet_bundles[file_path])
+            elif os.path.exists(file_path):
+                sheets = report_sheets(file_path)
+            else:
+                continue
+            for sheet_name, df in sheets:
+                try:
+                    df.to_excel(writer, sheet_name=sheet_name, index=False)
+                except Exception as e:
+                    print(f"[Combine Error] {file_path}: {e}")
+        if hyperlinks:
+            with time_stage("add_hyperlinks"):
+                link_sheets(writer.book)
+
+def add_hyperlinks(file_path: str):
+    wb = openpyxl.load_workbook(file_path)
+    link_sheets(wb)
+    wb.save(file_path)
+
+def link_sheets(wb):
+    """
+    Sort and filter the aging sheets of an openpyxl workbook and link the consolidated
+    sheet's invoice balances to each customer's first row on them.
+    """
+    # Find the consolidated sheet
+    cons_sheet = None
+    for sheet_name in wb.sheetnames:
+        if 'consolidated' in sheet_name.lower():
+            cons_sheet = wb[sheet_name]
+            break
+    
+    if not cons_sheet:
+        print("[Hyperlink] Consolidated sheet not found")
+        return
+    
+    # Assume aging sheet names
+    smcs_aging_name = 'input_invoice_aging_smcs'
+    nvb_aging_name = 'input_invoice_aging_nvb'
+    
+    if smcs_aging_name not in wb.sheetnames or nvb_aging_name not in wb.sheetnames:
+        print("[Hyperlink] Aging sheets not found")
+        return
+    
+    smcs_aging_sheet = wb[smcs_aging_name]
+    nvb_aging_sheet = wb[nvb_aging_name]
+    
+    # Sort aging sheets and add auto-filter
+    def sort_aging_sheet(aging_sheet):
+        cust_col = None
+        for col in range(1, aging_sheet.max_column + 1):
+            if aging_sheet.cell(1, col).value == 'customer_name':
+                cust_col = col
+                break
+        if not cust_col:
+            print(f"[Hyperlink] customer_name column not found in {aging_sheet.title}")
+            return None
+        
+        # max_row and max_column scan every cell, so read them once
+        max_row, max_column = aging_sheet.max_row, aging_sheet.max_column
+        data = []
+        for r in range(2, max_row + 1):
+            row_data = [aging_sheet.cell(r, c).value for c in range(1, max_column + 1)]
+            data.append(row_data)
+        
+        data.sort(key=lambda x: x[cust_col - 1] if x[cust_col - 1] else '')
+        
+        for r in range(2, max_row + 1):
+            for c in range(1, max_column + 1):
+                aging_sheet.cell(r, c).value = None
+        
+        for i, row_data in enumerate(data, 2):
+            for c, val in enumerate(row_data, 1):
+                aging_sheet.cell(i, c).value = val
+        
+        aging_sheet.auto_filter.ref = f"A1:{get_column_letter(max_column)}{max_row}"
+        
+        return cust_col
+    
+    smcs_cust_col = sort_aging_sheet(smcs_aging_sheet)
+    nvb_cust_col = sort_aging_sheet(nvb_aging_sheet)
+    
+    if not smcs_cust_col or not nvb_cust_col:
+        return
+    
+    header_row = 2
+    smcs_inv_col = None
+    nvb_inv_col = None
+    cust_name_col = None
+    for col in range(1, cons_sheet.max_column + 1):
+        cell_value = cons_sheet.cell(header_row, col).value
+        if cell_value == 'Invoice Balance':
+            header_group = cons_sheet.cell(1, col).value
+            if header_group and 'SMCS Receivables' in header_group:
+                smcs_inv_col = col
+            elif header_group and 'NVB Receivables' in header_group:
+                nvb_inv_col = col
+        elif cell_value == 'customer_name':
+            cust_name_col = col
+    
+    if not smcs_inv_col or not nvb_inv_col or not cust_name_col:
+        print("[Hyperlink] Required columns not found in consolidated sheet")
+        return
+    
+    if 'Instructions' not in wb.sheetnames:
+        inst_sheet = wb.create_sheet('Instructions')
+        inst_sheet['A1'].value = "How to Use Hyperlinks"
+        inst_sheet['A2'].value = (
+            "Click a hyperlink to navigate to the aging sheet with a pre-applied filter for the exact company name. "
+            "Use Excel's filter dropdown to adjust or clear the filter manually if needed."
+        )
+    
+    # Key customers by normalised name once; each lookup is then a dict hit on an integer key
+    cons_rows = range(3, cons_sheet.max_row + 1)
+    cons_names = [cons_sheet.cell(row, cust_name_col).value for row in cons_rows]
+    customer_index = CustomerIndex.build(cons_names)
+    cons_keys = customer_index.keys_for(cons_names)
+
+    def first_rows_by_key(aging_sheet, cust_col):
+        aging_names = [aging_sheet.cell(r, cust_col).value for r in range(2, aging_sheet.max_row + 1)]
+        return {key: pos + 2 for key, pos in customer_index.first_rows(aging_names).items()}
+
+    aging_links = [
+        (smcs_inv_col, smcs_aging_sheet, smcs_aging_name, smcs_cust_col, first_rows_by_key(smcs_aging_sheet, smcs_cust_col)),
+        (nvb_inv_col, nvb_aging_sheet, nvb_aging_name, nvb_cust_col, first_rows_by_key(nvb_aging_sheet, nvb_cust_col)),
+    ]
+
+    for row, cust_name, key in zip(cons_rows, cons_names, cons_keys):
+        if not cust_name or key == CustomerIndex.MISSING:
+            continue
+
+        for inv_col, aging_sheet, aging_name, cust_col, first_rows in aging_links:
+            cell = cons_sheet.cell(row, inv_col)
+            if isinstance(cell.value, (int, float)) and cell.value > 0:
+                first_row = first_rows.get(int(key))
+                if first_row:
+                    cell.hyperlink = f"#'{aging_name}'!A{first_row}"
+                    cell.style = 'Hyperlink'
+                    cell.comment = openpyxl.comments.Comment(f"Filter for: {cust_name}", 'Grok')
+                    # Filter on the aging sheet's own spelling of the customer
+                    aging_sheet.auto_filter.add_filter_column(cust_col - 1, [aging_sheet.cell(first_row, cust_col).value])
+    
+    print("[Hyperlink] Hyperlinks, auto-filters, and instructions added successfully")
@@ -1,5 +1,7 @@
 import pandas as pd
 
+from functions.schema import WHOLE_NUMBER_FORMAT, whole_numbers
+
 def combine_sheets(input_file1, input_file2, output_file, gap=5):
     """
     Combines the 'Summary' sheet from the first input file and the first sheet from the second input file.
@@ -14,10 +16,10 @@ def combine_sheets(input_file1, input_file2, output_file, gap=5):
     """
     try:
         # Read the 'Summary' sheet from the first input file
-        df1 = pd.read_excel(input_file1, sheet_name='Summary')
+        df1 = whole_numbers(pd.read_excel(input_file1, sheet_name='Summary'))
 
         # Read the first sheet from the second input file
-        df2 = pd.read_excel(input_file2, sheet_name=0)
+        df2 = whole_numbers(pd.read_excel(input_file2, sheet_name=0))
         
         # Add 'gap' number of empty rows (NaN values) to create space between the sheets
         empty_rows = pd.DataFrame([[None] * len(df1.columns)] * gap, columns=df1.columns)
@@ -40,9 +42,9 @@ def combine_sheets(input_file1, input_file2, output_file, gap=5):
             worksheet = writer.sheets['CombinedSheet']
 
             # Define formats for the color coding
-            green_format = workbook.add_format({'bg_color': '#00FF00'})
-            yellow_format = workbook.add_format({'bg_color': '#FFFF00'})
-            red_format = workbook.add_format({'bg_color': '#FF0000'})
+            green_format = workbook.add_format({'bg_color': '#00FF00', 'num_format': WHOLE_NUMBER_FORMAT})
+            yellow_format = workbook.add_format({'bg_color': '#FFFF00', 'num_format': WHOLE_NUMBER_FORMAT})
+            red_format = workbook.add_format({'bg_color': '#FF0000', 'num_format': WHOLE_NUMBER_FORMAT})
 
             # Apply color coding to the header row (the second row)
             header_row_idx =  1 # Adjust for the gap and header row
@@ -63,7 +65,7 @@ def combine_sheets(input_file1, input_file2, output_file, gap=5):
             worksheet.write(header_row_idx, 9, 'Closing Balance', red_format)
 
             # Apply color formatting to all the data rows below the header until the data ends
-            for row_idx in range(header_row_idx + 1, len(combined_df)  + 2):
+            for row_idx in range(header_row_idx + 1, len(combined_df) + 1):
                 # Apply the green color format for first set of columns (Invoice Balance, Available Credits, Closing Balance)
                 if pd.notnull(combined_df.iloc[row_idx  - 1, 1]):  # Check if cell is not empty
                     worksheet.write(row_idx, 1, combined_df.iloc[row_idx  - 1, 1], green_format)
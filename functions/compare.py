@@ -1,74 +1,298 @@
+"""
+Keyed reconciliation of two report frames.
+
+Rows are paired on their key columns (transaction_number, plus org when both
+sides have it), each row's value columns are hashed with vectorised hashing,
+and only rows whose hashes differ are compared column by column. Row order
+does not matter and the work is linear in the number of rows.
+"""
+from dataclasses import dataclass, field
+
+import numpy as np
 import pandas as pd
 
-# Function to compare two Excel files and extract mismatched rows
-def compare_excel_sheets(file1, file2, output_file):
-    # Read the two Excel sheets into DataFrames
-    try:
-        df1 = pd.read_excel(file1, sheet_name='NVB_ar_aging_details', skiprows=3)  # Skip first 3 rows
-        df2 = pd.read_excel(file2)
-    except Exception as e:
-        print(f"Error reading files: {e}")
-        return
+from functions.schema import as_text
+
+KEY_COLUMNS = ["transaction_number", "org"]
+# Numbers that agree to this many decimals (paise) are equal
+NUMERIC_DECIMALS = 2
+# Pairs rows that share a key, in file order
+_OCCURRENCE = "_occurrence"
+_ROW_HASH = "_row_hash"
+
+
+@dataclass
+class Reconciliation:
+    """
+    Differences between an old and a new frame.
+
+    Args:
+        keys (list): Key columns the rows were paired on.
+        columns (list): Value columns that were compared.
+        added (pd.DataFrame): Rows only in the new frame.
+        removed (pd.DataFrame): Rows only in the old frame.
+        changed_old (pd.DataFrame): Old version of rows whose values changed.
+        changed_new (pd.DataFrame): New version of the same rows, in the same order.
+        deltas (pd.DataFrame): One row per changed cell: keys, column, old, new and
+            delta (new - old where both values are numbers).
+        unchanged (int): Number of rows present and equal on both sides.
+    """
+    keys: list
+    columns: list
+    added: pd.DataFrame
+    removed: pd.DataFrame
+    changed_old: pd.DataFrame
+    changed_new: pd.DataFrame
+    deltas: pd.DataFrame
+    unchanged: int = 0
+    missing_columns: dict = field(default_factory=dict)
+
+    def summary(self):
+        return {
+            "added": len(self.added),
+            "removed": len(self.removed),
+            "changed": len(self.changed_new),
+            "unchanged": self.unchanged,
+            "changed_cells": len(self.deltas),
+        }
+
+
+def _per_distinct(values, func):
+    # Apply func once per distinct value; report columns repeat a lot
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    mapped = func(pd.Series(uniques, dtype=values.dtype if values.dtype != object else object))
+    if len(uniques) == 0:
+        # Entirely missing: nothing to take from
+        return pd.Series(index=values.index, dtype=mapped.dtype)
+    result = mapped.take(np.where(codes >= 0, codes, 0)).reset_index(drop=True)
+    result[codes < 0] = pd.NA if mapped.dtype == "string" else np.nan
+    result.index = values.index
+    return result
+
+
+def _canonical_text(values):
+    # Blank text reads as missing, like an empty cell
+    text = values.astype("string").str.strip()
+    return text.mask(text == "")
+
+
+def _canonical_datetime(values):
+    return values.dt.strftime("%Y-%m-%d %H:%M:%S").str.removesuffix(" 00:00:00").astype("string")
+
+
+def _is_number_column(values):
+    return pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)
+
+
+def _numbers(values):
+    """
+    A column as floats, blanks as NaN.
+
+    Returns:
+        tuple: The floats, and a mask of non-blank values that are not numbers.
+    """
+    if _is_number_column(values):
+        return values.astype(float), np.zeros(len(values), dtype=bool)
+    present = _per_distinct(values, _canonical_text).notna().to_numpy()
+    numbers = _per_distinct(values, lambda v: pd.to_numeric(v, errors="coerce").astype(float))
+    numbers = numbers.where(present)
+    return numbers, present & numbers.isna().to_numpy()
 
-    # Debug: Print column names of both DataFrames
-    print(f"Columns in {file1}: {df1.columns.tolist()}")
-    print(f"Columns in {file2}: {df2.columns.tolist()}")
 
-    # Clean column names by stripping leading/trailing spaces
-    df1.columns = df1.columns.str.strip()
-    df2.columns = df2.columns.str.strip()
+def _number_text(numbers):
+    # Numbers written out at NUMERIC_DECIMALS, so 5 and "5.00" read the same
+    return _per_distinct(
+        numbers.round(NUMERIC_DECIMALS),
+        lambda v: v.map(lambda x: f"{x:.{NUMERIC_DECIMALS}f}".rstrip("0").rstrip(".")).astype("string"),
+    )
 
-    # Ensure that both DataFrames have the same set of columns
-    missing_cols_df1 = [col for col in df2.columns if col not in df1.columns]
-    missing_cols_df2 = [col for col in df1.columns if col not in df2.columns]
 
-    if missing_cols_df1:
-        print(f"Columns missing in {file1}: {missing_cols_df1}")
-    if missing_cols_df2:
-        print(f"Columns missing in {file2}: {missing_cols_df2}")
+def _canonical_pair(old, new):
+    """
+    Comparable forms of one column on both sides, in a single canonical form
+    for the pair: rounded floats when both sides hold numbers (blanks as NaN),
+    stripped text otherwise, with numbers written out the same way on both sides.
+    """
+    if pd.api.types.is_bool_dtype(old) and pd.api.types.is_bool_dtype(new):
+        return old.astype("boolean"), new.astype("boolean")
+    if pd.api.types.is_datetime64_any_dtype(old) and pd.api.types.is_datetime64_any_dtype(new):
+        return _per_distinct(old, _canonical_datetime), _per_distinct(new, _canonical_datetime)
+    if pd.api.types.is_datetime64_any_dtype(old) or pd.api.types.is_datetime64_any_dtype(new):
+        return tuple(
+            _per_distinct(values, _canonical_datetime if pd.api.types.is_datetime64_any_dtype(values) else _canonical_text)
+            for values in (old, new)
+        )
 
-    # If there are missing columns in either DataFrame, print and return early
-    if missing_cols_df1 or missing_cols_df2:
-        print("The two sheets have different columns. Exiting comparison.")
-        return
+    (old_numbers, old_words), (new_numbers, new_words) = _numbers(old), _numbers(new)
+    if not old_words.any() and not new_words.any():
+        return old_numbers.round(NUMERIC_DECIMALS), new_numbers.round(NUMERIC_DECIMALS)
+    if old_words.any() and new_words.any():
+        # Text on both sides
+        return _per_distinct(old, _canonical_text), _per_distinct(new, _canonical_text)
+    # Numbers on one side against text with words on the other
+    return tuple(
+        _number_text(numbers).where(~words, _per_distinct(values, _canonical_text))
+        for values, numbers, words in ((old, old_numbers, old_words), (new, new_numbers, new_words))
+    )
 
-    # Check if 'transaction_number' exists in both DataFrames
-    if 'transaction_number' not in df1.columns or 'transaction_number' not in df2.columns:
-        print("Error: 'transaction_number' column is missing in one or both files.")
-        return
 
-    # Fill NaN values in 'transaction_number' column with a placeholder (e.g., '0')
-    df1['transaction_number'] = df1['transaction_number'].fillna('0')
-    df2['transaction_number'] = df2['transaction_number'].fillna('0')
+def _key_frame(df, keys):
+    frame = pd.DataFrame({
+        key: _canonical_text(as_text(df[key]) if pd.api.types.is_float_dtype(df[key]) else df[key]).fillna("")
+        for key in keys
+    }, index=df.index)
+    frame[_OCCURRENCE] = frame.groupby(keys, sort=False).cumcount()
+    return frame
 
-    # Extract the numeric part of the 'transaction_number' column for sorting
-    df1['transaction_number_numeric'] = df1['transaction_number'].str.extract('(\d+)').astype(int)
-    df2['transaction_number_numeric'] = df2['transaction_number'].str.extract('(\d+)').astype(int)
 
-    # Sort the DataFrames by the numeric part of 'transaction_number'
-    df1 = df1.sort_values(by=['transaction_number_numeric']).reset_index(drop=True)
-    df2 = df2.sort_values(by=['transaction_number_numeric']).reset_index(drop=True)
+def _canonical_frames(old, new, columns):
+    pairs = {col: _canonical_pair(old[col], new[col]) for col in columns}
+    return (
+        pd.DataFrame({col: pair[0] for col, pair in pairs.items()}, index=old.index),
+        pd.DataFrame({col: pair[1] for col, pair in pairs.items()}, index=new.index),
+    )
 
-    # Ensure both DataFrames have the same columns in the same order
-    df1 = df1[df2.columns]  # Reorder df1 columns to match df2's order
 
-    # Compare the two DataFrames to find mismatched rows
-    comparison = df1.compare(df2, keep_shape=True, keep_equal=False)
+def _column_deltas(keys_frame, old_values, new_values, old_raw, new_raw, columns):
+    parts = []
+    for col in columns:
+        before, after = old_values[col], new_values[col]
+        differs = ~((before == after).fillna(False) | (before.isna() & after.isna()))
+        differs = differs.to_numpy(dtype=bool)
+        if not differs.any():
+            continue
+        part = keys_frame.loc[differs].reset_index(drop=True)
+        part["column"] = col
+        part["old"] = old_raw[col].to_numpy()[differs]
+        part["new"] = new_raw[col].to_numpy()[differs]
+        if pd.api.types.is_float_dtype(before) and pd.api.types.is_float_dtype(after):
+            part["delta"] = (after.to_numpy()[differs] - before.to_numpy()[differs]).round(NUMERIC_DECIMALS)
+        else:
+            part["delta"] = np.nan
+        parts.append(part)
+    if not parts:
+        return pd.DataFrame(columns=list(keys_frame.columns) + ["column", "old", "new", "delta"])
+    return pd.concat(parts, ignore_index=True)
 
-    # Extract the rows where there is a mismatch
-    mismatched_rows_df1 = df1.loc[comparison.index]  # Rows from df1 with mismatches
-    mismatched_rows_df2 = df2.loc[comparison.index]  # Rows from df2 with mismatches
 
-    # Combine mismatched rows from both DataFrames
-    mismatched_rows = pd.concat([mismatched_rows_df1, mismatched_rows_df2], ignore_index=True)
+def reconcile_frames(old, new, keys=None, columns=None):
+    """
+    Reconcile two frames by key.
+
+    Args:
+        old (pd.DataFrame): Reference frame, e.g. the Zoho export.
+        new (pd.DataFrame): Frame to check against it, e.g. our output.
+        keys (list): Key columns; defaults to those of KEY_COLUMNS present in both frames.
+        columns (list): Value columns to compare; defaults to every other shared column.
+
+    Returns:
+        Reconciliation: Added, removed and changed rows with column-level deltas.
+
+    Raises:
+        ValueError: If transaction_number (or a requested key) is missing from either frame.
+    """
+    old = old.rename(columns=lambda c: str(c).strip()).reset_index(drop=True)
+    new = new.rename(columns=lambda c: str(c).strip()).reset_index(drop=True)
+
+    if keys is None:
+        keys = [key for key in KEY_COLUMNS if key in old.columns and key in new.columns]
+        if KEY_COLUMNS[0] not in keys:
+            raise ValueError(f"'{KEY_COLUMNS[0]}' column is missing in one or both frames")
+    missing_keys = [key for key in keys if key not in old.columns or key not in new.columns]
+    if missing_keys:
+        raise ValueError(f"Key columns missing in one or both frames: {missing_keys}")
+
+    missing_columns = {
+        "old": [col for col in new.columns if col not in old.columns],
+        "new": [col for col in old.columns if col not in new.columns],
+    }
+    if columns is None:
+        columns = [col for col in old.columns if col in new.columns and col not in keys]
+
+    old_keys, new_keys = _key_frame(old, keys), _key_frame(new, keys)
+    old_values, new_values = _canonical_frames(old, new, columns)
+    old_keys[_ROW_HASH] = pd.util.hash_pandas_object(old_values, index=False).to_numpy()
+    new_keys[_ROW_HASH] = pd.util.hash_pandas_object(new_values, index=False).to_numpy()
+
+    join_on = keys + [_OCCURRENCE]
+    joined = old_keys.reset_index(names="_old_row").merge(
+        new_keys.reset_index(names="_new_row"),
+        on=join_on, how="outer", suffixes=("_old", "_new"), indicator=True, sort=False,
+    )
+    both = joined[joined["_merge"] == "both"]
+    changed = both[both[f"{_ROW_HASH}_old"] != both[f"{_ROW_HASH}_new"]]
+
+    removed_rows = joined.loc[joined["_merge"] == "left_only", "_old_row"].astype(np.int64).to_numpy()
+    added_rows = joined.loc[joined["_merge"] == "right_only", "_new_row"].astype(np.int64).to_numpy()
+    changed_old_rows = changed["_old_row"].astype(np.int64).to_numpy()
+    changed_new_rows = changed["_new_row"].astype(np.int64).to_numpy()
+
+    changed_old = old.iloc[changed_old_rows].reset_index(drop=True)
+    changed_new = new.iloc[changed_new_rows].reset_index(drop=True)
+    deltas = _column_deltas(
+        changed[keys].reset_index(drop=True),
+        old_values.iloc[changed_old_rows].reset_index(drop=True),
+        new_values.iloc[changed_new_rows].reset_index(drop=True),
+        changed_old, changed_new, columns,
+    )
+    return Reconciliation(
+        keys=keys,
+        columns=columns,
+        added=new.iloc[added_rows].reset_index(drop=True),
+        removed=old.iloc[removed_rows].reset_index(drop=True),
+        changed_old=changed_old,
+        changed_new=changed_new,
+        deltas=deltas,
+        unchanged=len(both) - len(changed),
+        missing_columns=missing_columns,
+    )
+
+
+def write_reconciliation(result, output_file):
+    """Write a reconciliation to an Excel file with one sheet per kind of difference."""
+    summary = pd.DataFrame([result.summary()])
+    with pd.ExcelWriter(output_file, engine="xlsxwriter") as writer:
+        summary.to_excel(writer, sheet_name="Summary", index=False)
+        result.added.to_excel(writer, sheet_name="Added", index=False)
+        result.removed.to_excel(writer, sheet_name="Removed", index=False)
+        result.changed_new.to_excel(writer, sheet_name="Changed", index=False)
+        result.deltas.to_excel(writer, sheet_name="Column Deltas", index=False)
+
+
+# Function to compare two Excel files and report the differences between them
+def compare_excel_sheets(file1, file2, output_file, sheet_name1='NVB_ar_aging_details', skiprows1=3, keys=None):
+    """
+    Reconcile a Zoho export (file1) against one of our outputs (file2) and save the differences.
+
+    Returns:
+        Reconciliation or None: The result, or None if the files could not be compared.
+    """
+    try:
+        df1 = pd.read_excel(file1, sheet_name=sheet_name1, skiprows=skiprows1)
+        df2 = pd.read_excel(file2)
+    except Exception as e:
+        print(f"Error reading files: {e}")
+        return None
+
+    try:
+        result = reconcile_frames(df1, df2, keys=keys)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return None
+
+    if result.missing_columns["old"]:
+        print(f"Columns missing in {file1} (not compared): {result.missing_columns['old']}")
+    if result.missing_columns["new"]:
+        print(f"Columns missing in {file2} (not compared): {result.missing_columns['new']}")
+    print(f"Reconciled on {result.keys}: {result.summary()}")
 
-    # Save the mismatched rows to a new Excel file
     try:
-        mismatched_rows.to_excel(output_file, index=False)
-        print(f"Mismatched rows saved to {output_file}")
+        write_reconciliation(result, output_file)
+        print(f"Differences saved to {output_file}")
     except Exception as e:
         print(f"Error saving the file: {e}")
+    return result
 
 # Example usage
 if __name__ == "__main__":
-    compare_excel_sheets('output.xlsx', 'NVB_Age_Range_Columns.xlsx', 'mismatched_rows.xlsx')
\ No newline at end of file
+    compare_excel_sheets('output.xlsx', 'NVB_Age_Range_Columns.xlsx', 'mismatched_rows.xlsx')
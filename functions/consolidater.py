@@ -4,27 +4,53 @@ from openpyxl.styles import PatternFill
 from openpyxl.utils.dataframe import dataframe_to_rows
 from openpyxl.styles import PatternFill, Border, Side
 
-def process_and_merge_files(file1_path, file2_path, output_file_path):
+from functions.metrics import record_rows
+from functions.report_store import read_frame
+from functions.schema import apply_ingest_schema, from_paise
+from functions.customer_index import CustomerIndex
+
+def collapse_by_customer_key(df, money_columns):
+    """Merge rows of one org whose names normalise to the same customer key."""
+    if not df['customer_key'].duplicated().any():
+        return df
+    aggregations = {
+        col: ('sum' if col in money_columns else 'first')
+        for col in df.columns if col != 'customer_key'
+    }
+    return df.groupby('customer_key', sort=False, as_index=False, observed=True).agg(aggregations)
+
+def unified_frame(file1_path, file2_path, rows_stage=None):
+    """
+    Both orgs' customer balances joined on the normalised customer name, with the
+    consolidated columns, in rupees and in unified_file column order.
+    Each org's row count is recorded under rows_stage when one is given.
+    """
     # Assuming file1_path is for NVB (input_customer_balance_nvb), file2_path for SMCS (input_customer_balance_smcs)
-    # Read the Excel files into DataFrames
-    file1 = pd.read_excel(file1_path, dtype=str)  # NVB
-    file2 = pd.read_excel(file2_path, dtype=str)  # SMCS
+    # Read the Excel files into DataFrames (money as int64 paise, client data as categoricals)
+    file1 = apply_ingest_schema(read_frame(file1_path))  # NVB
+    file2 = apply_ingest_schema(read_frame(file2_path))  # SMCS
+    if rows_stage is not None:
+        record_rows(rows_stage, "NVB", len(file1))
+        record_rows(rows_stage, "SMCS", len(file2))
 
     # Drop unnecessary columns (removed client data drops to keep them)
     columns_to_drop = ['customer_id', 'currency_id', 'contact']  # Adjusted to keep client data
     file1.drop(columns=[col for col in columns_to_drop if col in file1.columns], inplace=True)
     file2.drop(columns=[col for col in columns_to_drop if col in file2.columns], inplace=True)
 
-    # Clean currency symbols for financial columns
+    # Financial columns (already numeric paise from the ingest schema)
     currency_columns = ["bcy_invoice_balance", "bcy_available_credits", "closing_balance"]
-    for col in currency_columns:
-        if col in file1.columns:
-            file1[col] = pd.to_numeric(file1[col], errors='coerce')
-        if col in file2.columns:
-            file2[col] = pd.to_numeric(file2[col], errors='coerce')
+
+    # Key customers by normalised name once, then join both orgs on the integer key
+    customer_index = CustomerIndex.build(file2['customer_name'], file1['customer_name'])
+    file1['customer_key'] = customer_index.keys_for(file1['customer_name'])
+    file2['customer_key'] = customer_index.keys_for(file2['customer_name'])
+    file1 = collapse_by_customer_key(file1.drop(columns=['customer_name']), currency_columns)
+    file2 = collapse_by_customer_key(file2.drop(columns=['customer_name']), currency_columns)
 
     # Merge DataFrames
-    unified_file = pd.merge(file2, file1, on="customer_name", how="outer", suffixes=("_file1", "_file2"))  # left=SMCS (_file1), right=NVB (_file2)
+    unified_file = pd.merge(file2, file1, on="customer_key", how="outer", suffixes=("_file1", "_file2"))  # left=SMCS (_file1), right=NVB (_file2)
+    unified_file.insert(0, 'customer_name', customer_index.display_names(unified_file['customer_key']))
 
     # No longer dropping client data columns
     # columns_to_delete = [...]  # Commented out
@@ -59,6 +85,14 @@ def process_and_merge_files(file1_path, file2_path, output_file_path):
     ordered_columns = [col for col in desired_order if col in unified_file.columns]
     unified_file = unified_file[ordered_columns]
 
+    # Back to rupees for the workbook
+    for col in ordered_columns[1:10]:
+        unified_file[col] = from_paise(unified_file[col])
+    return unified_file
+
+def process_and_merge_files(file1_path, file2_path, output_file_path):
+    unified_file = unified_frame(file1_path, file2_path, rows_stage="consolidate")
+
     # Create MultiIndex column headers (top row labels)
     level1 = ["", 
               "SMCS receivables", "SMCS receivables", "SMCS receivables",
@@ -6,11 +6,9 @@ from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_excep
 from ratelimit import limits, sleep_and_retry
 import time
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - [%(client_name)s] - %(message)s'
-)
+from functions import zoho_transport
+from functions.column_widths import estimate_column_widths, set_column_widths
+from functions.metrics import time_zoho_call, record_response, record_rows, retry_hook
 
 class ClientLoggingAdapter(logging.LoggerAdapter):
     def process(self, msg, kwargs):
@@ -46,10 +44,7 @@ PERIOD = 60  # seconds
     stop=stop_after_attempt(5),
     wait=wait_exponential(multiplier=2, min=4, max=60),
     retry=retry_if_exception_type(requests.exceptions.HTTPError),
-    after=lambda retry_state: logger.info(
-        f"Retrying {retry_state.fn.__name__} after attempt {retry_state.attempt_number}",
-        extra={"client_name": retry_state.args[-1]}
-    )
+    before_sleep=retry_hook("token", logger)
 )
 def generate_access_token(client_id: str, client_secret: str, refresh_token: str, client_name: str) -> str:
     """Generate OAuth 2.0 access token with retry logic."""
@@ -60,7 +55,9 @@ def generate_access_token(client_id: str, client_secret: str, refresh_token: str
         "refresh_token": refresh_token,
     }
     try:
-        response = requests.post("https://accounts.zoho.com/oauth/v2/token", data=params)
+        with time_zoho_call("token", client_name) as timed:
+            response = zoho_transport.post("https://accounts.zoho.com/oauth/v2/token", data=params)
+            record_response("token", client_name, response, timed)
         if response.status_code == 429:
             retry_after = int(response.headers.get("Retry-After", 60))
             logger.warning(f"Rate limit hit for access token. Waiting {retry_after} seconds.", 
@@ -79,17 +76,16 @@ def generate_access_token(client_id: str, client_secret: str, refresh_token: str
     stop=stop_after_attempt(5),
     wait=wait_exponential(multiplier=2, min=4, max=60),
     retry=retry_if_exception_type(requests.exceptions.HTTPError),
-    after=lambda retry_state: logger.info(
-        f"Retrying {retry_state.fn.__name__} after attempt {retry_state.attempt_number}",
-        extra={"client_name": retry_state.args[-1]}
-    )
+    before_sleep=retry_hook("comments", logger)
 )
 def fetch_invoice_comments(invoice_id: str, org_id: str, access_token: str, client_name: str) -> list:
     """Fetch comments for a specific invoice based on the provided schema."""
     url = f"https://www.zohoapis.com/books/v3/invoices/{invoice_id}/comments?organization_id={org_id}"
     headers = {"Authorization": f"Zoho-oauthtoken {access_token}"}
     try:
-        response = requests.get(url, headers=headers)
+        with time_zoho_call("comments", client_name) as timed:
+            response = zoho_transport.get(url, headers=headers)
+            record_response("comments", client_name, response, timed)
         if response.status_code == 429:
             retry_after = int(response.headers.get("Retry-After", 60))
             logger.warning(f"Rate limit hit for invoice {invoice_id}. Waiting {retry_after} seconds.", 
@@ -115,10 +111,7 @@ def write_excel(df: pd.DataFrame, file_path: Path, sheet_name: str, client_name:
         file_path.parent.mkdir(parents=True, exist_ok=True)
         with pd.ExcelWriter(file_path, engine="xlsxwriter") as writer:
             df.to_excel(writer, index=False, sheet_name=sheet_name)
-            worksheet = writer.sheets[sheet_name]
-            for idx, col in enumerate(df.columns):
-                max_len = max(df[col].astype(str).map(len).max(), len(str(col))) + 2
-                worksheet.set_column(idx, idx, min(max_len, 50))
+            set_column_widths(writer.sheets[sheet_name], estimate_column_widths(df))
         logger.info(f"Saved Excel to {file_path}", extra={"client_name": client_name})
     except Exception as e:
         logger.error(f"Failed to save Excel to {file_path}: {e}", extra={"client_name": client_name})
@@ -205,6 +198,8 @@ def fetch_comments_for_client(client_data: dict) -> None:
         # Add delay between batches to avoid rate limiting
         time.sleep(1)
 
+    record_rows("comments", client_name, len(df))
+
     # Log invoices with no comments
     no_comments = df[df['Description'] == '']['Invoice ID'].count()
     if no_comments > 0:
@@ -219,4 +214,9 @@ def fetch_comments_step():
         fetch_comments_for_client(client_data)
 
 if __name__ == "__main__":
+    # Configure logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - [%(client_name)s] - %(message)s'
+    )
     fetch_comments_step()
\ No newline at end of file
@@ -1,10 +1,16 @@
 import requests
 import os
+import datetime
+import itertools
 import logging
 import pandas as pd
+import pyarrow as pa
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+from functions import zoho_transport
+from functions import local_aging
+from functions import report_store
+from functions.metrics import time_zoho_call, record_response, record_rows, record_bytes
+from functions.schema import HEADER_FORMAT
 
 # Function to generate the access token
 def generate_access_token(client_id, client_secret, refresh_token):
@@ -15,7 +21,7 @@ def generate_access_token(client_id, client_secret, refresh_token):
         "refresh_token": refresh_token,
     }
     try:
-        response = requests.post("https://accounts.zoho.com/oauth/v2/token", data=params)
+        response = zoho_transport.post("https://accounts.zoho.com/oauth/v2/token", data=params)
         response.raise_for_status()
         return response.json().get("access_token")
     except requests.RequestException as e:
@@ -23,7 +29,7 @@ def generate_access_token(client_id, client_secret, refresh_token):
         return None
 
 # Function to save response content as an Excel file
-def save_excel_from_response(response, report_name, client_name):
+def save_excel_from_response(response, report_name, client_name, date_filter=None):
     output_dir = "csvdata"
     os.makedirs(output_dir, exist_ok=True)
     excel_filename = os.path.join(output_dir, f"input_{report_name}_{client_name}.xlsx")
@@ -31,10 +37,22 @@ def save_excel_from_response(response, report_name, client_name):
     try:
         with open(excel_filename, "wb") as f:
             f.write(response.content)  # Save Excel directly from response
+        record_bytes("fetch", len(response.content))
         logging.info(f"Excel file saved: {excel_filename}")
 
+        if report_store.AGING_CHUNK_ROWS and report_name == "invoice_aging":
+            # Streamed; the report store would need the whole frame, so it is skipped
+            rows = process_excel_file_chunked(excel_filename, report_store.AGING_CHUNK_ROWS)
+            if rows is not None:
+                record_rows(f"fetch_{report_name}", client_name, rows)
+            return
+
         # Process the saved Excel file after saving
-        process_excel_file(excel_filename)
+        df = process_excel_file(excel_filename)
+        if df is not None:
+            record_rows(f"fetch_{report_name}", client_name, len(df))
+            if date_filter is not None:
+                report_store.save_report(df, client_name, report_name, date_filter)
 
     except Exception as e:
         logging.error(f"Error saving the file {excel_filename}: {e}")
@@ -48,6 +66,7 @@ def process_excel_file(filepath):
         # Optional: Drop empty columns or rows if needed
         df.dropna(axis=1, how='all', inplace=True)
         df.dropna(axis=0, how='all', inplace=True)
+        df = report_store.normalize_frame(df)
 
         # Log the shape of the processed data
         logging.info(f"Processed file {filepath}, shape: {df.shape}")
@@ -56,18 +75,139 @@ def process_excel_file(filepath):
         with pd.ExcelWriter(filepath, engine='xlsxwriter') as writer:
             df.to_excel(writer, index=False, sheet_name='Sheet1')
 
+        # Columnar copy so downstream stages can skip the xlsx parse
+        report_store.write_sidecar(df, filepath)
+
         logging.info(f"File {filepath} processed and saved.")
+        return df
 
     except Exception as e:
         logging.error(f"Error processing {filepath}: {e}")
+        return None
+
+def _column_kind(kinds, has_missing):
+    # Arrow type for a column from the Python types seen in it, as pandas would infer it
+    if kinds == {bool}:
+        return pa.bool_()
+    if kinds == {int} and not has_missing:
+        return pa.int64()
+    if kinds and kinds <= {int, float}:
+        return pa.float64()
+    if kinds and all(issubclass(kind, datetime.datetime) for kind in kinds):
+        return pa.timestamp("ns")
+    # Text, and columns that mix types (stored as text, as normalize_frame does)
+    return pa.string()
+
+def _column_values(values, arrow_type):
+    if arrow_type == pa.string():
+        return [value if value is None or isinstance(value, str) else str(value) for value in values]
+    return values
+
+def process_excel_file_chunked(filepath, chunk_rows):
+    """
+    Chunked variant of process_excel_file for AGING_CHUNK_ROWS mode.
+
+    The fetched workbook is read twice in openpyxl read-only mode: the first pass finds
+    the columns that hold any value and their types, the second streams the cleaned rows
+    in batches of chunk_rows to a constant_memory workbook and to the Feather sidecar.
+    Memory is set by chunk_rows, not by the report size.
+
+    Returns:
+        int or None: Rows written, or None on failure.
+    """
+    from openpyxl import load_workbook
+    import xlsxwriter
+
+    def data_rows():
+        wb = load_workbook(filepath, read_only=True, data_only=True)
+        try:
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            next(rows, None)  # Title row; the second row is the header
+            header = next(rows, None) or ()
+            yield header
+            for row in rows:
+                if any(value is not None for value in row):
+                    # Whole floats as int, as pd.read_excel reads them
+                    yield [int(value) if isinstance(value, float) and value.is_integer() else value for value in row]
+        finally:
+            wb.close()
+
+    tmp_path = f"{filepath}.tmp{os.getpid()}.xlsx"
+    tmp_sidecar = f"{report_store.sidecar_path(filepath)}.tmp{os.getpid()}"
+    try:
+        # Pass 1: columns with data, the Python types in each and whether any cell is empty
+        rows = data_rows()
+        header = next(rows)
+        kinds, filled, total = {}, {}, 0
+        for row in rows:
+            total += 1
+            for position, value in enumerate(row):
+                if value is not None:
+                    kinds.setdefault(position, set()).add(type(value))
+                    filled[position] = filled.get(position, 0) + 1
+        keep = sorted(kinds)
+        columns = [
+            str(header[position]) if position < len(header) and header[position] is not None else f"Unnamed: {position}"
+            for position in keep
+        ]
+        schema = pa.schema([
+            (name, _column_kind(kinds[position], filled[position] < total)) for name, position in zip(columns, keep)
+        ])
+
+        # Pass 2: stream the kept columns to the workbook and the sidecar
+        workbook = xlsxwriter.Workbook(tmp_path, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+        worksheet = workbook.add_worksheet('Sheet1')
+        worksheet.write_row(0, 0, columns, workbook.add_format(HEADER_FORMAT))
+        row_idx = 1
+        try:
+            with pa.OSFile(tmp_sidecar, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+                rows = data_rows()
+                next(rows)
+                batch = []
+                for row in itertools.chain(rows, [None]):
+                    if row is not None:
+                        batch.append([row[position] if position < len(row) else None for position in keep])
+                        if len(batch) < chunk_rows:
+                            continue
+                    if not batch:
+                        break
+                    arrays = [
+                        pa.array(_column_values([values[i] for values in batch], field.type), type=field.type)
+                        for i, field in enumerate(schema)
+                    ]
+                    writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+                    for values in zip(*[array.to_pylist() for array in arrays]):
+                        worksheet.write_row(row_idx, 0, values)
+                        row_idx += 1
+                    batch = []
+        finally:
+            workbook.close()
+
+        os.replace(tmp_path, filepath)
+        # Replaced after the workbook so the sidecar stays the newer file
+        os.replace(tmp_sidecar, report_store.sidecar_path(filepath))
+        logging.info(f"File {filepath} processed in chunks of {chunk_rows} rows: {row_idx - 1} rows, {len(columns)} columns")
+        return row_idx - 1
+
+    except Exception as e:
+        logging.error(f"Error processing {filepath} in chunks: {e}")
+        for path in (tmp_path, tmp_sidecar):
+            if os.path.exists(path):
+                os.remove(path)
+        return None
 
 # Function to fetch the report and save it
 def fetch_report(report_name, url_template, client_data, date_filter):
-    access_token = generate_access_token(
-        client_data["CLIENT_ID"], 
-        client_data["CLIENT_SECRET"], 
-        client_data["REFRESH_TOKEN"]
-    )
+    org = client_data["Client"]
+    with time_zoho_call("token", org) as timed:
+        access_token = generate_access_token(
+            client_data["CLIENT_ID"], 
+            client_data["CLIENT_SECRET"], 
+            client_data["REFRESH_TOKEN"]
+        )
+        # generate_access_token logs its own errors and returns None
+        if not access_token:
+            timed.outcome = "error"
     if not access_token:
         logging.error("Failed to obtain access token.")
         return
@@ -76,18 +216,70 @@ def fetch_report(report_name, url_template, client_data, date_filter):
     headers = {"Authorization": f"Zoho-oauthtoken {access_token}"}
     
     try:
-        response = requests.get(url, headers=headers)
+        with time_zoho_call("report", org) as timed:
+            response = zoho_transport.get(url, headers=headers)
+            record_response("report", org, response, timed)
         response.raise_for_status()
 
         # Check if the response content is not empty
         if response.content:
-            save_excel_from_response(response, report_name, client_data["Client"])
+            save_excel_from_response(response, report_name, client_data["Client"], date_filter)
         else:
             logging.warning(f"Empty response for {report_name} from {client_data['Client']}.")
 
     except requests.RequestException as e:
         logging.error(f"Error fetching {report_name}: {e}")
 
+# Function to write a report frame where fetch_report would have saved it
+def write_input_report(df, report_name, client_name):
+    excel_filename = os.path.join("csvdata", f"input_{report_name}_{client_name}.xlsx")
+    os.makedirs("csvdata", exist_ok=True)
+    with pd.ExcelWriter(excel_filename, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False, sheet_name='Sheet1')
+    report_store.write_sidecar(df, excel_filename)
+    return excel_filename
+
+# Function to restore a report from the columnar store instead of fetching it
+def restore_report(report_name, client_name, date_filter):
+    df = report_store.load_report(client_name, report_name, date_filter)
+    if df is None:
+        return False
+
+    excel_filename = write_input_report(df, report_name, client_name)
+    logging.info(f"Restored {report_name} for {client_name} from the report store: {excel_filename}")
+    return True
+
+# Function to age the invoices locally instead of downloading Zoho's aging report
+def build_local_aging(client_data, date_filter, force_fetch=False):
+    client_name = client_data["Client"]
+    try:
+        invoices = local_aging.load_invoices(client_data, force_fetch)
+        if invoices is None:
+            logging.warning(f"No invoices for {client_name}; falling back to the Zoho aging report.")
+            return False
+        df = local_aging.aging_report(invoices, local_aging.as_of_date(date_filter))
+    except Exception as e:
+        logging.error(f"Error computing local aging for {client_name}: {e}")
+        return False
+
+    record_rows("fetch_invoice_aging", client_name, len(df))
+    excel_filename = write_input_report(report_store.normalize_frame(df), "invoice_aging", client_name)
+    logging.info(f"Computed invoice_aging for {client_name} locally ({len(df)} invoices): {excel_filename}")
+    return True
+
+# Function to reconcile the fetched aging report with the locally computed one
+def check_local_aging(client_data, date_filter, force_fetch=False):
+    client_name = client_data["Client"]
+    try:
+        invoices = local_aging.load_invoices(client_data, force_fetch)
+        if invoices is None:
+            return
+        report = report_store.read_frame(os.path.join("csvdata", f"input_invoice_aging_{client_name}.xlsx"))
+        local = local_aging.compute_aging(invoices, local_aging.as_of_date(date_filter))
+        local_aging.log_check(client_name, date_filter, local_aging.check_against_report(report, local))
+    except Exception as e:
+        logging.error(f"Error checking local aging for {client_name}: {e}")
+
 # Function to get the appropriate URL based on client
 def get_customer_balance_url(client_name):
     if client_name.lower() == "nvb":
@@ -97,8 +289,8 @@ def get_customer_balance_url(client_name):
         # URL for SMCS customer (existing URL)
         return """https://www.zohoapis.com/books/v3/reports/customerbalancesummary?accept=xlsx&page=1&per_page=20000&sort_order=A&filter_by=TransactionDate.{value}&select_columns=%5B%7B%22field%22%3A%22customer_name%22%2C%22group%22%3A%22report%22%7D%2C%7B%22field%22%3A%22bcy_invoice_balance%22%2C%22group%22%3A%22report%22%7D%2C%7B%22field%22%3A%22bcy_available_credits%22%2C%22group%22%3A%22report%22%7D%2C%7B%22field%22%3A%22closing_balance%22%2C%22group%22%3A%22report%22%7D%2C%7B%22field%22%3A%22last_name%22%2C%22group%22%3A%22contact%22%7D%2C%7B%22field%22%3A%22mobile_phone%22%2C%22group%22%3A%22contact%22%7D%2C%7B%22field%22%3A%22email%22%2C%22group%22%3A%22contact%22%7D%2C%7B%22field%22%3A%22custom_field_544542000001383001%22%2C%22group%22%3A%22contact%22%7D%2C%7B%22field%22%3A%22custom_field_544542000011019221%22%2C%22group%22%3A%22contact%22%7D%2C%7B%22field%22%3A%22custom_field_544542000010260003%22%2C%22group%22%3A%22contact%22%7D%5D&is_for_date_range=false&usestate=false&group_by=%5B%7B%22field%22%3A%22none%22%2C%22group%22%3A%22report%22%7D%5D&sort_column=customer_name&can_ignore_zero_cb=false&response_option=1&x-zb-source=zbclient&formatneeded=true&paper_size=A4&orientation=portrait&font_family_for_body=opensans&margin_top=0.7&margin_bottom=0.7&margin_left=0.55&margin_right=0.2&table_size=classic&show_generated_date=false&show_generated_time=false&show_page_number=false&show_report_basis=true&show_generated_by=false&can_fit_to_page=true&watermark_opacity=50&show_org_logo_in_header=false&show_org_logo_as_watermark=false&watermark_position=center+center&watermark_zoom=50&file_name=Customer+Balance+Summary&organization_id={ORG_ID}&frameorigin=https%3A%2F%2Fbooks.zoho.com"""
 
-# Function to fetch all reports for different clients
-def fetch_all_reports(date_filter):
+# Function to fetch all reports for different clients; force_fetch skips the report store
+def fetch_all_reports(date_filter, force_fetch=False):
     CREDENTIALS = [
         {
             "CLIENT_ID": "1000.MAV029IW7FDMD5XO3BIVN83KDSP8LC",
@@ -127,12 +319,21 @@ def fetch_all_reports(date_filter):
     for client_data in CREDENTIALS:
         # Fetch common reports (invoice_aging) for all clients
         for report_name, report_data in COMMON_REPORTS.items():
-            fetch_report(report_name, report_data["url"], client_data, date_filter)
+            if report_name == "invoice_aging" and local_aging.AGING_SOURCE == "local":
+                if build_local_aging(client_data, date_filter, force_fetch):
+                    continue
+            if force_fetch or not restore_report(report_name, client_data["Client"], date_filter):
+                fetch_report(report_name, report_data["url"], client_data, date_filter)
+            if report_name == "invoice_aging" and local_aging.AGING_SOURCE == "check":
+                check_local_aging(client_data, date_filter, force_fetch)
         
         # Fetch customer balance summary with client-specific URL
-        customer_balance_url = get_customer_balance_url(client_data["Client"])
-        fetch_report("customer_balance", customer_balance_url, client_data, date_filter)
+        if force_fetch or not restore_report("customer_balance", client_data["Client"], date_filter):
+            customer_balance_url = get_customer_balance_url(client_data["Client"])
+            fetch_report("customer_balance", customer_balance_url, client_data, date_filter)
 
 
 if __name__ == "__main__":
+    # Configure logging
+    logging.basicConfig(level=logging.INFO)
     fetch_all_reports("")
\ No newline at end of file
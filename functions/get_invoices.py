@@ -6,11 +6,9 @@ import json
 from concurrent.futures import ThreadPoolExecutor
 from tenacity import retry, stop_after_attempt, wait_exponential
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - [%(client_name)s] - %(message)s'
-)
+from functions import zoho_transport
+from functions.column_widths import estimate_column_widths, set_column_widths
+from functions.metrics import time_zoho_call, record_response, record_rows, retry_hook
 
 class ClientLoggingAdapter(logging.LoggerAdapter):
     def process(self, msg, kwargs):
@@ -41,7 +39,7 @@ INVOICES_URL = (
     "&filter_by=Status.All&sort_column=created_time&sort_order=D"
     "&requiredfields=created_time%2Clast_modified_time%2Cdate%2Cinvoice_number"
     "%2Creference_number%2Ccustomer_name%2Cstatus%2Cdue_date%2Ctotal%2Cbalance"
-    "%2Clocation_name%2Cinvoice_id%2Ccustomer_id%2Ctype%2Cdue_days%2Cis_emailed"
+    "%2Clocation_name%2Cinvoice_id%2Ccustomer_id%2Ccurrency_code%2Ctype%2Cdue_days%2Cis_emailed"
     "%2Cis_viewed_by_client%2Cis_viewed_in_mail%2Cschedule_time"
     "%2Cunprocessed_payment_amount%2Cis_peppol_supported%2Cbbps"
     "%2Cis_square_transaction%2Cis_digitally_signed%2Ctax_source%2Cis_pre_gst"
@@ -66,15 +64,16 @@ def write_excel(df: pd.DataFrame, file_path: Path, sheet_name: str, client_name:
         file_path.parent.mkdir(parents=True, exist_ok=True)
         with pd.ExcelWriter(file_path, engine="xlsxwriter") as writer:
             df.to_excel(writer, index=False, sheet_name=sheet_name)
-            worksheet = writer.sheets[sheet_name]
-            for idx, col in enumerate(df.columns):
-                max_len = max(df[col].astype(str).map(len).max(), len(str(col))) + 2
-                worksheet.set_column(idx, idx, min(max_len, 50))
+            set_column_widths(writer.sheets[sheet_name], estimate_column_widths(df))
         logger.info(f"Saved Excel to {file_path}", extra={"client_name": client_name})
     except Exception as e:
         logger.error(f"Failed to save Excel to {file_path}: {e}", extra={"client_name": client_name})
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, min=4, max=10),
+    before_sleep=retry_hook("token", logger)
+)
 def generate_access_token(client_id: str, client_secret: str, refresh_token: str, client_name: str) -> str:
     """Generate OAuth 2.0 access token with retry logic."""
     params = {
@@ -84,28 +83,34 @@ def generate_access_token(client_id: str, client_secret: str, refresh_token: str
         "refresh_token": refresh_token,
     }
     try:
-        response = requests.post("https://accounts.zoho.com/oauth/v2/token", data=params)
+        with time_zoho_call("token", client_name) as timed:
+            response = zoho_transport.post("https://accounts.zoho.com/oauth/v2/token", data=params)
+            record_response("token", client_name, response, timed)
         response.raise_for_status()
         return response.json().get("access_token")
     except requests.RequestException as e:
         logger.error(f"Failed to generate access token: {e}", extra={"client_name": client_name})
         raise
 
-def fetch_and_merge_invoices_for_client(client_data: dict) -> None:
-    """Fetch invoices and merge Invoice ID into aging details directly from JSON."""
+def fetch_invoices(client_data: dict) -> list | None:
+    """
+    Fetch every invoice of one org from the Books invoices API, 200 per page.
+
+    Returns:
+        list or None: None when any page failed, so a partial list is never used as the full ledger.
+    """
     client_name = client_data["Client"]
     logger.extra["client_name"] = client_name
 
     if not all(client_data.get(key) for key in ["CLIENT_ID", "CLIENT_SECRET", "REFRESH_TOKEN", "ORG_ID"]):
         logger.error("Missing credentials", extra={"client_name": client_name})
-        return
+        return None
 
-    # Fetch invoices
     access_token = generate_access_token(
         client_data["CLIENT_ID"], client_data["CLIENT_SECRET"], client_data["REFRESH_TOKEN"], client_name
     )
     if not access_token:
-        return
+        return None
 
     all_invoices = []
     page = 1
@@ -113,7 +118,9 @@ def fetch_and_merge_invoices_for_client(client_data: dict) -> None:
         url = INVOICES_URL.format(page=page, ORG_ID=client_data["ORG_ID"])
         headers = {"Authorization": f"Zoho-oauthtoken {access_token}"}
         try:
-            response = requests.get(url, headers=headers)
+            with time_zoho_call("invoice_page", client_name) as timed:
+                response = zoho_transport.get(url, headers=headers)
+                record_response("invoice_page", client_name, response, timed)
             response.raise_for_status()
             json_data = response.json()
             if "invoices" in json_data and json_data["invoices"]:
@@ -125,13 +132,20 @@ def fetch_and_merge_invoices_for_client(client_data: dict) -> None:
                 logger.warning(f"No invoices found on page {page}", extra={"client_name": client_name})
                 break
         except requests.RequestException as e:
-            logger.error(f"Failed to fetch invoices: {e}", extra={"client_name": client_name})
-            break
+            logger.error(f"Failed to fetch invoices on page {page}: {e}", extra={"client_name": client_name})
+            return None
+    return all_invoices
 
+def fetch_and_merge_invoices_for_client(client_data: dict) -> None:
+    """Fetch invoices and merge Invoice ID into aging details directly from JSON."""
+    client_name = client_data["Client"]
+    all_invoices = fetch_invoices(client_data)
     if not all_invoices:
         logger.warning("No invoices to process", extra={"client_name": client_name})
         return
 
+    record_rows("invoices", client_name, len(all_invoices))
+
     # Save JSON for reference (optional)
     json_path = Path(f"csvdata/invoices_details_{client_name}.json")
     save_json({"invoices": all_invoices}, json_path, client_name)
@@ -199,4 +213,9 @@ def invoice_step():
         executor.map(fetch_and_merge_invoices_for_client, CREDENTIALS)
 
 if __name__ == "__main__":
+    # Configure logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - [%(client_name)s] - %(message)s'
+    )
     invoice_step()
\ No newline at end of file
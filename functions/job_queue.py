@@ -0,0 +1,174 @@
+"""
+Bounded executor for the blocking report pipeline.
+
+The Zoho fetch and the pandas/openpyxl stages are blocking, so the endpoints
+run them here instead of on the event loop. A request first takes a slot:
+PIPELINE_WORKERS slots run at once, up to PIPELINE_QUEUE_DEPTH more wait for
+one, and anything beyond that is turned away at once with QueueFull (a 429
+in main.py) rather than piling up. Inside its slot a request hands each
+blocking step to the executor with run().
+
+SingleFlight coalesces identical requests: while a build for a key is in
+flight, later callers await the same task instead of starting their own.
+
+Runs share the csvdata/ and output/ folders, so two at once would overwrite
+each other's files: PIPELINE_WORKERS is clamped to one, and a request keeps
+its slot across fetch, pipeline and cache update. In process
+mode the stage metrics are recorded in the worker process and do not show
+up on /metrics.
+"""
+import asyncio
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from functions.metrics import (
+    COALESCED_REQUESTS, PIPELINE_QUEUE_REJECTED, PIPELINE_QUEUE_RUNNING, PIPELINE_QUEUE_WAIT, PIPELINE_QUEUE_WAITING,
+)
+
+# "thread" or "process"; a process keeps pandas off the server's GIL
+PIPELINE_EXECUTOR = os.environ.get("PIPELINE_EXECUTOR", "thread")
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", "1"))
+PIPELINE_QUEUE_DEPTH = int(os.environ.get("PIPELINE_QUEUE_DEPTH", "4"))
+# Retry-After before any build has finished, in seconds
+PIPELINE_RETRY_AFTER_SECONDS = int(os.environ.get("PIPELINE_RETRY_AFTER_SECONDS", "60"))
+
+
+class QueueFull(Exception):
+    """No slot is free and the wait queue is full."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Pipeline queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class PipelineExecutor:
+    """
+    Thread or process pool with a bounded wait queue in front of it.
+
+    Args:
+        kind (str): "thread" or "process".
+        workers (int): Slots that run at once (and pool workers); clamped to 1.
+        queue_depth (int): Requests allowed to wait for a slot.
+    """
+
+    def __init__(self, kind=PIPELINE_EXECUTOR, workers=PIPELINE_WORKERS, queue_depth=PIPELINE_QUEUE_DEPTH):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind!r}")
+        self.kind = kind
+        if workers > 1:
+            print(f"[Pipeline Queue] {workers} workers would share csvdata/ and output/; running one at a time")
+        self.workers = 1
+        self.queue_depth = max(0, queue_depth)
+        self.waiting = 0
+        self.running = 0
+        # Smoothed seconds a request holds its slot, for Retry-After
+        self.average_seconds = None
+        self._slots = None
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            if self.kind == "process":
+                # spawn: forking a process that runs threads is not safe
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="pipeline")
+        return self._executor
+
+    def retry_after(self):
+        """Seconds until a slot is likely to free up for a new request."""
+        if self.average_seconds is None:
+            return PIPELINE_RETRY_AFTER_SECONDS
+        return max(1, math.ceil(self.average_seconds * (self.waiting + 1) / self.workers))
+
+    def idle(self):
+        """True when no request holds or waits for a slot."""
+        return self.running == 0 and self.waiting == 0
+
+    def stats(self):
+        return {
+            "executor": self.kind,
+            "workers": self.workers,
+            "running": self.running,
+            "waiting": self.waiting,
+            "queue_depth": self.queue_depth,
+            "average_seconds": self.average_seconds,
+        }
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Hold a pipeline slot for the duration of the block.
+
+        Raises:
+            QueueFull: If all slots are busy and queue_depth requests already wait.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        if self.running >= self.workers and self.waiting >= self.queue_depth:
+            PIPELINE_QUEUE_REJECTED.inc()
+            raise QueueFull(self.retry_after())
+
+        self.waiting += 1
+        PIPELINE_QUEUE_WAITING.inc()
+        queued_at = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+            PIPELINE_QUEUE_WAITING.dec()
+        PIPELINE_QUEUE_WAIT.observe(time.perf_counter() - queued_at)
+
+        self.running += 1
+        PIPELINE_QUEUE_RUNNING.inc()
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            self.average_seconds = elapsed if self.average_seconds is None else 0.7 * self.average_seconds + 0.3 * elapsed
+            self.running -= 1
+            PIPELINE_QUEUE_RUNNING.dec()
+            self._slots.release()
+
+    async def run(self, func, *args):
+        """Run func(*args) on the pool; in process mode func and args must be picklable."""
+        return await asyncio.get_running_loop().run_in_executor(self._pool(), func, *args)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class SingleFlight:
+    """Share one in-flight call between concurrent callers with the same key."""
+
+    def __init__(self):
+        self._calls = {}
+
+    def in_flight(self):
+        return list(self._calls)
+
+    async def do(self, key, func, *args):
+        """
+        Await func(*args) once per key at a time.
+
+        Returns:
+            tuple: The call's result and whether this caller started it; every
+            caller gets the same result or exception.
+        """
+        task = self._calls.get(key)
+        leader = task is None
+        if leader:
+            task = asyncio.ensure_future(func(*args))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            COALESCED_REQUESTS.inc()
+        # A caller that disconnects must not cancel the call for the others
+        return await asyncio.shield(task), leader
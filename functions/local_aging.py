@@ -0,0 +1,165 @@
+"""
+Local aging engine: age and bucket open invoices for any as-of date.
+
+Zoho's aragingdetails export is aged on the server, one download per
+date_filter. The invoices API already returns date, due_date, balance and
+customer_name for every invoice, so the same report can be computed here:
+age is the days from the due date to the as-of date (the end of the
+filter's period, as in the Zoho export), bucketed with schema.AGE_BUCKETS.
+Every open invoice issued by the as-of date is listed; like the export,
+invoices that are not yet MIN_AGE_DAYS past due have no age.
+
+The invoice list does not depend on the date filter. It is stored once per
+org in the report store and reused for every filter and as-of date within
+REPORT_STORE_TTL_SECONDS, unless the fetch is forced.
+
+AGING_SOURCE picks where fetch_all_reports gets the aging report from:
+"zoho" (the export), "local" (this engine, falling back to the export when
+the invoices cannot be fetched) or "check" (the export, reconciled against
+this engine with compare.reconcile_frames and the differences logged).
+
+Balances are the invoices' current balances. For an as-of date in the past,
+payments made after it are not added back, so only the age and bucket
+follow the as-of date.
+"""
+import os
+
+import pandas as pd
+
+from functions import report_store
+from functions.compare import reconcile_frames
+from functions.schema import assign_age_buckets
+
+AGING_SOURCE = os.environ.get("AGING_SOURCE", "zoho")
+# The Zoho export leaves the age empty until an invoice is a day past due
+MIN_AGE_DAYS = 1
+# Statuses that never appear on the aging report
+CLOSED_STATUSES = {"draft", "void", "paid"}
+# Columns of the Zoho aging export that the invoices API can fill, in export order
+REPORT_COLUMNS = [
+    "date", "status", "entity_id", "entity", "age", "transaction_number",
+    "customer_id", "customer_name", "currency_code", "balance", "amount",
+]
+# Compared against the Zoho export in "check" mode
+CHECK_COLUMNS = ["age", "bucket", "balance", "amount", "customer_name"]
+
+# Zoho date_filter values -> end of the period they age to
+_PERIOD_ENDS = {
+    "Today": lambda today: today,
+    "Yesterday": lambda today: today - pd.Timedelta(days=1),
+    "ThisWeek": lambda today: today + pd.offsets.Week(weekday=5, n=0),
+    "ThisMonth": lambda today: today + pd.offsets.MonthEnd(0),
+    "ThisQuarter": lambda today: today + pd.offsets.QuarterEnd(0, startingMonth=3),
+    "ThisYear": lambda today: today + pd.offsets.YearEnd(0),
+    "PreviousWeek": lambda today: today + pd.offsets.Week(weekday=5, n=0) - pd.Timedelta(days=7),
+    "PreviousMonth": lambda today: today.replace(day=1) - pd.Timedelta(days=1),
+    "PreviousQuarter": lambda today: today + pd.offsets.QuarterEnd(0, startingMonth=3) - pd.offsets.QuarterEnd(1, startingMonth=3),
+    "PreviousYear": lambda today: pd.Timestamp(year=today.year - 1, month=12, day=31),
+}
+
+
+def as_of_date(date_filter, today=None):
+    """
+    As-of date for a Zoho date_filter value ("ThisMonth" ages to the end of
+    the month) or an ISO date such as "2025-08-31". An empty filter is today.
+
+    Raises:
+        ValueError: If date_filter is neither a known period nor a date.
+    """
+    today = pd.Timestamp(today if today is not None else pd.Timestamp.now()).normalize()
+    if not date_filter:
+        return today
+    if date_filter in _PERIOD_ENDS:
+        return _PERIOD_ENDS[date_filter](today).normalize()
+    try:
+        return pd.Timestamp(date_filter).normalize()
+    except ValueError:
+        raise ValueError(f"Unknown date filter for local aging: {date_filter!r}") from None
+
+
+def invoice_frame(invoices):
+    """Invoices API records as a frame with the aging export's column names."""
+    df = pd.json_normalize(invoices) if isinstance(invoices, list) else invoices.copy()
+    df = df.rename(columns={"invoice_number": "transaction_number", "invoice_id": "entity_id", "total": "amount"})
+    df["entity"] = "invoice"
+    for col in ("balance", "amount"):
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+    return df
+
+
+def compute_aging(invoices, as_of):
+    """
+    Age open invoices as of a date.
+
+    Args:
+        invoices (pd.DataFrame): Frame from invoice_frame.
+        as_of: Date to age to.
+
+    Returns:
+        pd.DataFrame: Open invoices issued by as_of, with age in whole days past due
+        (missing when not yet due) and bucket from AGE_BUCKETS, ordered by date as
+        Zoho sorts them.
+    """
+    as_of = pd.Timestamp(as_of).normalize()
+    issued = pd.to_datetime(invoices["date"], errors="coerce")
+    due = pd.to_datetime(invoices["due_date"], errors="coerce").fillna(issued)
+    age = (as_of - due).dt.days
+    status = invoices["status"].astype(str).str.lower()
+    is_open = ~status.isin(CLOSED_STATUSES) & invoices["balance"].fillna(0).ne(0)
+    keep = is_open & (issued <= as_of)
+
+    aged = invoices[keep].copy()
+    aged["age"] = age[keep].where(age[keep] >= MIN_AGE_DAYS).astype(float)
+    aged["bucket"] = assign_age_buckets(aged["age"])
+    return aged.sort_values("date", kind="stable").reset_index(drop=True)
+
+
+def aging_report(invoices, as_of):
+    """compute_aging in the column layout of the Zoho aging export."""
+    aged = compute_aging(invoices, as_of)
+    return aged[[col for col in REPORT_COLUMNS if col in aged.columns]]
+
+
+def load_invoices(client_data, force_fetch=False):
+    """
+    An org's invoices from the report store, fetching them when missing or expired
+    (or always with force_fetch).
+
+    Returns:
+        pd.DataFrame or None: None when the invoices could not be fetched.
+    """
+    from functions.get_invoices import fetch_invoices
+
+    org = client_data["Client"]
+    df = None if force_fetch else report_store.load_report(org, "invoices", "")
+    if df is not None:
+        return df
+    invoices = fetch_invoices(client_data)
+    if not invoices:
+        return None
+    df = invoice_frame(invoices)
+    report_store.save_report(df, org, "invoices", "")
+    return df
+
+
+def check_against_report(report, local):
+    """
+    Reconcile the Zoho aging export against the locally computed one on
+    transaction_number, including the bucket each side puts an invoice in.
+
+    Returns:
+        Reconciliation: Invoices only on one side and per-column differences.
+    """
+    report = report.copy()
+    local = local.copy()
+    for df in (report, local):
+        df["bucket"] = assign_age_buckets(df["age"]).astype(str)
+    columns = [col for col in CHECK_COLUMNS if col in report.columns and col in local.columns]
+    return reconcile_frames(report, local, keys=["transaction_number"], columns=columns)
+
+
+def log_check(org, date_filter, result):
+    print(f"[Local Aging] {org} {date_filter!r} vs Zoho export: {result.summary()}")
+    if len(result.deltas):
+        counts = result.deltas["column"].value_counts().to_dict()
+        print(f"[Local Aging] {org} {date_filter!r} differing cells per column: {counts}")
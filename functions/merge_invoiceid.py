@@ -3,6 +3,8 @@ import os
 import logging
 import uuid
 
+from functions.column_widths import estimate_column_widths, set_column_widths
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -62,10 +64,7 @@ def merge_invoice(client_name):
 
         with pd.ExcelWriter(output_file, engine="xlsxwriter") as writer:
             merged_df.to_excel(writer, index=False, sheet_name="Aging_Details")
-            worksheet = writer.sheets["Aging_Details"]
-            for idx, col in enumerate(merged_df.columns):
-                max_len = max(merged_df[col].astype(str).map(len).max(), len(str(col))) + 2
-                worksheet.set_column(idx, idx, min(max_len, 50))
+            set_column_widths(writer.sheets["Aging_Details"], estimate_column_widths(merged_df))
         logging.info(f"Overwrote aging file: {output_file}")
 
     except FileNotFoundError as e:
@@ -0,0 +1,200 @@
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# Stages run from seconds up to several minutes on large date ranges
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+STAGE_DURATION = Histogram(
+    "pipeline_stage_duration_seconds",
+    "Time spent in each pipeline stage",
+    ["stage", "outcome"],
+    buckets=DURATION_BUCKETS,
+)
+ZOHO_CALL_DURATION = Histogram(
+    "zoho_call_duration_seconds",
+    "Time spent in Zoho API calls, by call type and org",
+    ["call", "org", "outcome"],
+    buckets=DURATION_BUCKETS,
+)
+ZOHO_RATE_LIMITED = Counter(
+    "zoho_rate_limited_total",
+    "Zoho responses with HTTP 429",
+    ["call", "org"],
+)
+ZOHO_RETRIES = Counter(
+    "zoho_retries_total",
+    "Retried Zoho API calls",
+    ["call", "org"],
+)
+ROWS_PROCESSED = Counter(
+    "pipeline_rows_processed_total",
+    "Data rows processed by pipeline stages",
+    ["stage", "org"],
+)
+BYTES_WRITTEN = Counter(
+    "pipeline_bytes_written_total",
+    "Bytes written to reports and artifacts",
+    ["stage"],
+)
+RESULT_CACHE_REQUESTS = Counter(
+    "result_cache_requests_total",
+    "Report requests by result cache outcome",
+    ["outcome"],
+)
+
+PIPELINE_RUN_DURATION = Histogram(
+    "pipeline_run_duration_seconds",
+    "Transform pipeline runs: wall time, critical path and summed stage time",
+    ["measure"],
+    buckets=DURATION_BUCKETS,
+)
+
+PIPELINE_QUEUE_WAITING = Gauge(
+    "pipeline_queue_waiting",
+    "Report builds waiting for a pipeline worker",
+)
+PIPELINE_QUEUE_RUNNING = Gauge(
+    "pipeline_queue_running",
+    "Report builds holding a pipeline worker",
+)
+PIPELINE_QUEUE_WAIT = Histogram(
+    "pipeline_queue_wait_seconds",
+    "Time report builds waited for a pipeline worker",
+    buckets=DURATION_BUCKETS,
+)
+COALESCED_REQUESTS = Counter(
+    "pipeline_coalesced_requests_total",
+    "Report requests served by joining an identical in-flight build",
+)
+PRECOMPUTE_RUNS = Counter(
+    "precompute_runs_total",
+    "Scheduled report rebuilds, by date filter and outcome",
+    ["date_filter", "outcome"],
+)
+PIPELINE_QUEUE_REJECTED = Counter(
+    "pipeline_queue_rejected_total",
+    "Report builds turned away with 429 because the queue was full",
+)
+
+# Pipeline metrics that pool workers send back to the parent, by kind
+DEFERRABLE = {
+    "stage_duration": (STAGE_DURATION, "observe"),
+    "rows": (ROWS_PROCESSED, "inc"),
+    "bytes": (BYTES_WRITTEN, "inc"),
+}
+
+# Observations queued instead of recorded while deferred_metrics is active
+_deferred = None
+
+
+def _record(kind, labels, value):
+    if _deferred is not None:
+        _deferred.append((kind, labels, value))
+        return
+    metric, method = DEFERRABLE[kind]
+    getattr(metric.labels(**labels), method)(value)
+
+
+@contextmanager
+def deferred_metrics():
+    """
+    Queue the pipeline metrics recorded in the block instead of recording them.
+
+    A pool worker's registry is never scraped, so the worker returns the queued
+    list with its result and the parent passes it to replay_metrics.
+    """
+    global _deferred
+    previous, _deferred = _deferred, []
+    try:
+        yield _deferred
+    finally:
+        _deferred = previous
+
+
+def replay_metrics(recorded):
+    """Record observations queued by deferred_metrics in another process."""
+    for kind, labels, value in recorded:
+        _record(kind, labels, value)
+
+
+def record_stage(stage, outcome, seconds):
+    _record("stage_duration", {"stage": stage, "outcome": outcome}, seconds)
+
+
+@contextmanager
+def time_stage(stage):
+    """Record the duration of a block as a pipeline stage."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ran"
+    finally:
+        record_stage(stage, outcome, time.perf_counter() - start)
+
+
+@contextmanager
+def time_zoho_call(call, org):
+    """
+    Record the duration of a Zoho API call.
+
+    The block gets the call's state: its outcome is "error" if the block raises,
+    and the block sets it for failures that do not raise (record_response does
+    so for an error response).
+
+    Args:
+        call (str): Call type, one of "token", "report", "invoice_page" or "comments".
+        org (str): Client/org name the call is made for.
+    """
+    start = time.perf_counter()
+    timed = SimpleNamespace(outcome="ok")
+    try:
+        yield timed
+    except BaseException:
+        timed.outcome = "error"
+        raise
+    finally:
+        ZOHO_CALL_DURATION.labels(call=call, org=org, outcome=timed.outcome).observe(time.perf_counter() - start)
+
+
+def record_response(call, org, response, timed=None):
+    """Count rate-limited responses for a Zoho call, and fail the timed call on an error status."""
+    if response is None:
+        return
+    if response.status_code == 429:
+        ZOHO_RATE_LIMITED.labels(call=call, org=org).inc()
+    if timed is not None and response.status_code >= 400:
+        timed.outcome = "error"
+
+
+def retry_hook(call, logger=None):
+    """
+    Build a tenacity `before_sleep` hook that counts (and logs) retries of a Zoho call.
+    It runs only when another attempt follows, so a final failed attempt is not counted.
+    The org is the retried function's last argument.
+    """
+    def before_sleep(retry_state):
+        org = retry_state.args[-1]
+        ZOHO_RETRIES.labels(call=call, org=org).inc()
+        if logger is not None:
+            logger.info(
+                f"Retrying {retry_state.fn.__name__} after attempt {retry_state.attempt_number}",
+                extra={"client_name": org}
+            )
+    return before_sleep
+
+
+def record_rows(stage, org, rows):
+    _record("rows", {"stage": stage, "org": org}, rows)
+
+
+def record_bytes(stage, num_bytes):
+    _record("bytes", {"stage": stage}, num_bytes)
+
+
+def render_metrics():
+    """Return the metrics payload and its content type in Prometheus text format."""
+    return generate_latest(), CONTENT_TYPE_LATEST
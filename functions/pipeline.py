@@ -0,0 +1,449 @@
+import functools
+import hashlib
+import importlib
+import importlib.util
+import inspect
+import multiprocessing
+import multiprocessing.util
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Union
+
+from functions.metrics import PIPELINE_RUN_DURATION, deferred_metrics, record_bytes, record_stage, replay_metrics
+from functions.result_cache import content_digest
+
+# Stage cache configuration
+STAGE_CACHE_DIR = os.environ.get("STAGE_CACHE_DIR", "cache/stages")
+STAGE_CACHE_ENABLED = os.environ.get("STAGE_CACHE_ENABLED", "1") != "0"
+# Entries kept per stage; older ones are pruned after each store
+STAGE_CACHE_MAX_ENTRIES = int(os.environ.get("STAGE_CACHE_MAX_ENTRIES", "8"))
+# Bump to invalidate every cached stage result
+STAGE_CACHE_VERSION = "1"
+# Environment switches that change what the stages write; part of every stage key
+STAGE_CACHE_ENV = ["AGING_SOURCE", "AGING_CHUNK_ROWS", "WIDTH_SAMPLE_ROWS"]
+# Memory a stage worker may use, in MB; the default pool size fits the instance's memory
+STAGE_WORKER_MEMORY_MB = int(os.environ.get("STAGE_WORKER_MEMORY_MB", "512"))
+
+
+def memory_limit_mb():
+    """The container's memory limit (cgroup v2, then v1), else the machine's physical memory, in MB."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # "max" or a near-2**63 value means no limit
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value) // (1024 * 1024)
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_stage_workers():
+    # One STAGE_WORKER_MEMORY_MB share is left for the process that starts the pool
+    workers = min(4, os.cpu_count() or 1)
+    memory_mb = memory_limit_mb()
+    if memory_mb:
+        workers = min(workers, memory_mb // STAGE_WORKER_MEMORY_MB - 1)
+    return max(1, workers)
+
+
+# Processes that run independent stages at once, by default as many as fit in
+# memory; 1 runs every stage in this process
+PIPELINE_STAGE_WORKERS = int(os.environ.get("PIPELINE_STAGE_WORKERS", str(default_stage_workers())))
+
+# Shared by every run_stage_graph call; started on first use
+_stage_pool = None
+
+
+@dataclass
+class Stage:
+    """
+    A pipeline step with explicit file inputs and outputs.
+
+    Args:
+        name (str): Unique stage name, also used as its cache namespace.
+        func (Callable or str): Function that produces the outputs, or a
+            "module:function" reference imported on first run.
+        args (tuple): Positional arguments passed to func; part of the cache key.
+        inputs (list): Files read by the stage; their content is part of the cache key.
+        outputs (list): Files written by the stage; these are what gets cached.
+    """
+    name: str
+    func: Union[Callable, str]
+    args: tuple = ()
+    inputs: list = field(default_factory=list)
+    outputs: list = field(default_factory=list)
+
+
+def resolve_func(func):
+    """Import a "module:function" reference; callables are returned as they are."""
+    if not isinstance(func, str):
+        return func
+    module_name, _, attr = func.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def _source_digest(func):
+    # Cached results go stale when the code that produced them changes
+    if isinstance(func, str):
+        # Locate the module without importing it, so a cache hit never pays for the import
+        spec = importlib.util.find_spec(func.partition(":")[0])
+        source_file = spec.origin if spec else None
+    else:
+        try:
+            source_file = inspect.getsourcefile(func)
+        except TypeError:
+            source_file = None
+    if source_file and os.path.exists(source_file):
+        return content_digest(source_file)
+    return getattr(func, "__qualname__", repr(func))
+
+
+@functools.lru_cache(maxsize=None)
+def _package_digest():
+    # Stages depend on helpers all over functions/ (schema, column widths, writers),
+    # so any change to the package invalidates every stage; computed once per process
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for filename in sorted(os.listdir(package_dir)):
+        if filename.endswith(".py"):
+            digest.update(filename.encode())
+            digest.update(content_digest(os.path.join(package_dir, filename)).encode())
+    return digest.hexdigest()
+
+
+def stage_key(stage):
+    """
+    Hash of the stage's code, the functions package source, the STAGE_CACHE_ENV
+    switches, the stage's parameters and its input file contents.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{STAGE_CACHE_VERSION}\0{stage.name}\0{repr(stage.args)}".encode())
+    digest.update(_source_digest(stage.func).encode())
+    digest.update(_package_digest().encode())
+    for name in STAGE_CACHE_ENV:
+        digest.update(f"{name}={os.environ.get(name, '')}\0".encode())
+    for input_path in stage.inputs:
+        digest.update(input_path.encode())
+        if os.path.exists(input_path):
+            digest.update(content_digest(input_path).encode())
+        else:
+            digest.update(b"missing")
+    return digest.hexdigest()
+
+
+def _cached_output_path(entry_dir, index, output_path):
+    return os.path.join(entry_dir, f"{index}_{os.path.basename(output_path)}")
+
+
+def _restore_stage(stage, entry_dir):
+    cached = [_cached_output_path(entry_dir, i, o) for i, o in enumerate(stage.outputs)]
+    if not all(os.path.exists(path) for path in cached):
+        return False
+    for cached_path, output_path in zip(cached, stage.outputs):
+        output_dir = os.path.dirname(output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        shutil.copyfile(cached_path, output_path)
+    return True
+
+
+def _store_stage(stage, stage_dir, entry_dir):
+    missing = [o for o in stage.outputs if not os.path.exists(o)]
+    if missing:
+        print(f"[Pipeline] {stage.name} did not produce {missing}; result not cached")
+        return
+
+    tmp_dir = f"{entry_dir}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for i, output_path in enumerate(stage.outputs):
+        shutil.copyfile(output_path, _cached_output_path(tmp_dir, i, output_path))
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.rename(tmp_dir, entry_dir)
+
+    # Keep only the most recent entries for this stage
+    entries = [os.path.join(stage_dir, d) for d in os.listdir(stage_dir) if ".tmp" not in d]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for old_entry in entries[STAGE_CACHE_MAX_ENTRIES:]:
+        shutil.rmtree(old_entry, ignore_errors=True)
+
+
+def _execute_stage(stage, start):
+    try:
+        resolve_func(stage.func)(*stage.args)
+    except Exception:
+        record_stage(stage.name, "error", time.perf_counter() - start)
+        raise
+    elapsed = time.perf_counter() - start
+    record_stage(stage.name, "ran", elapsed)
+    record_bytes(stage.name, sum(os.path.getsize(o) for o in stage.outputs if os.path.exists(o)))
+    print(f"[Pipeline] {stage.name}: ran in {elapsed:.2f}s")
+
+
+def run_stage(stage, cache_dir=STAGE_CACHE_DIR):
+    """
+    Run a stage unless a result for the same inputs and parameters is cached.
+
+    Returns:
+        bool: True if the stage ran, False if its outputs came from the cache.
+    """
+    start = time.perf_counter()
+    if not STAGE_CACHE_ENABLED:
+        _execute_stage(stage, start)
+        return True
+
+    stage_dir = os.path.join(cache_dir, stage.name)
+    entry_dir = os.path.join(stage_dir, stage_key(stage))
+    if _restore_stage(stage, entry_dir):
+        os.utime(entry_dir)
+        record_stage(stage.name, "cached", time.perf_counter() - start)
+        print(f"[Pipeline] {stage.name}: inputs unchanged, restored cached outputs")
+        return False
+
+    _execute_stage(stage, start)
+
+    os.makedirs(stage_dir, exist_ok=True)
+    try:
+        _store_stage(stage, stage_dir, entry_dir)
+    except OSError as e:
+        print(f"[Pipeline Error] Failed to cache {stage.name}: {e}")
+    return True
+
+
+def run_stages(stages, cache_dir=STAGE_CACHE_DIR, on_stage=None):
+    """
+    Run stages in the order given (each stage must come after the ones it reads from).
+
+    Args:
+        on_stage (callable): Progress callback, called as on_stage(name, done, total, outcome)
+            with outcome "running" before each stage and "ran" or "cached" after it.
+
+    Returns:
+        dict: Stage name -> "ran" or "cached".
+    """
+    results = {}
+    for done, stage in enumerate(stages):
+        if on_stage:
+            on_stage(stage.name, done, len(stages), "running")
+        ran = run_stage(stage, cache_dir)
+        results[stage.name] = "ran" if ran else "cached"
+        if on_stage:
+            on_stage(stage.name, done + 1, len(stages), results[stage.name])
+    return results
+
+
+def stage_dependencies(stages):
+    """
+    Stage name -> names of the stages whose outputs it reads.
+
+    Raises:
+        ValueError: If two stages write the same file or the stages depend on each other in a cycle.
+    """
+    producers = {}
+    for stage in stages:
+        for output_path in stage.outputs:
+            if output_path in producers:
+                raise ValueError(f"{output_path} is written by both {producers[output_path]} and {stage.name}")
+            producers[output_path] = stage.name
+    deps = {
+        stage.name: {producers[path] for path in stage.inputs if path in producers and producers[path] != stage.name}
+        for stage in stages
+    }
+    _topological_order(deps)
+    return deps
+
+
+def _topological_order(deps):
+    order, done = [], set()
+    remaining = list(deps)
+    while remaining:
+        ready = [name for name in remaining if deps[name] <= done]
+        if not ready:
+            raise ValueError(f"Stages depend on each other in a cycle: {remaining}")
+        order.extend(ready)
+        done.update(ready)
+        remaining = [name for name in remaining if name not in done]
+    return order
+
+
+def stage_pool(workers=PIPELINE_STAGE_WORKERS):
+    """The process pool stages run on, started on first use and kept for later runs."""
+    global _stage_pool
+    if _stage_pool is None:
+        # spawn: the pipeline may run on a thread of the server process
+        _stage_pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        # A pool started inside a worker process must be shut down before that worker
+        # exits, ahead of multiprocessing's queue finalizers (priority 10), or the exit
+        # blocks joining the pool's processes
+        multiprocessing.util.Finalize(None, shutdown_stage_pool, kwargs={"wait": True}, exitpriority=100)
+    return _stage_pool
+
+
+def shutdown_stage_pool(wait=False):
+    global _stage_pool
+    if _stage_pool is not None:
+        _stage_pool.shutdown(wait=wait, cancel_futures=True)
+        _stage_pool = None
+
+
+def _timed_stage(stage, cache_dir):
+    """
+    Run a stage in a pool worker. A worker's metrics never reach /metrics, so the
+    stage's durations, rows and bytes are queued and returned for the parent to
+    record, along with a failure instead of raising it. Times are wall-clock so
+    runs in different processes line up.
+
+    Returns:
+        tuple: Outcome ("ran", "cached" or "error"), start, end, queued metrics and
+        the exception on error (else None).
+    """
+    start = time.time()
+    with deferred_metrics() as recorded:
+        try:
+            outcome = "ran" if run_stage(stage, cache_dir) else "cached"
+            error = None
+        except Exception as e:
+            outcome, error = "error", e
+    return outcome, start, time.time(), recorded, error
+
+
+def critical_path(deps, timings):
+    """
+    Longest chain of dependent stages by measured duration.
+
+    Args:
+        deps (dict): Stage name -> names of the stages it depends on.
+        timings (dict): Stage name -> (start, end) wall-clock seconds.
+
+    Returns:
+        tuple: Stage names on the critical path in run order, and for every stage
+        its slack: how much longer it could have taken without delaying the run.
+    """
+    order = _topological_order(deps)
+    seconds = {name: end - start for name, (start, end) in timings.items()}
+    # Longest chain ending at / starting from each stage
+    to_end, best_dep = {}, {}
+    for name in order:
+        best_dep[name] = max(deps[name], key=lambda d: to_end[d], default=None)
+        to_end[name] = seconds[name] + (to_end[best_dep[name]] if best_dep[name] else 0)
+    dependents = {name: [other for other in order if name in deps[other]] for name in order}
+    from_start = {}
+    for name in reversed(order):
+        from_start[name] = seconds[name] + max((from_start[d] for d in dependents[name]), default=0)
+
+    path_seconds = max(to_end.values(), default=0)
+    name = max(to_end, key=to_end.get, default=None)
+    path = []
+    while name is not None:
+        path.append(name)
+        name = best_dep[name]
+    slack = {name: path_seconds - (to_end[name] + from_start[name] - seconds[name]) for name in order}
+    return list(reversed(path)), slack
+
+
+def run_report(deps, timings, outcomes, run_start, run_end):
+    """
+    Per-run timing report: wall time against the critical path and the summed
+    stage time, and each stage's start offset, duration, outcome and slack.
+    """
+    path, slack = critical_path(deps, timings)
+    seconds = {name: end - start for name, (start, end) in timings.items()}
+    return {
+        "wall_seconds": round(run_end - run_start, 3),
+        "critical_path": path,
+        "critical_path_seconds": round(sum(seconds[name] for name in path), 3),
+        "stage_seconds": round(sum(seconds.values()), 3),
+        "stages": {
+            name: {
+                "outcome": outcomes[name],
+                "started_at": round(timings[name][0] - run_start, 3),
+                "seconds": round(seconds[name], 3),
+                "slack": round(slack[name], 3),
+                "after": sorted(deps[name]),
+            }
+            for name in timings
+        },
+    }
+
+
+def run_stage_graph(stages, cache_dir=STAGE_CACHE_DIR, workers=PIPELINE_STAGE_WORKERS, on_stage=None):
+    """
+    Run stages as a dependency graph: a stage starts once every stage whose
+    outputs it reads has finished, and independent stages run at the same time
+    on the stage pool, so a run takes about as long as its critical path.
+
+    Stage funcs and args are sent to the pool workers, so they must be picklable
+    ("module:function" references are). With workers <= 1 the stages run one
+    after another in this process.
+
+    Args:
+        on_stage (callable): Progress callback as for run_stages.
+
+    Returns:
+        dict: The run_report of this run.
+
+    Raises:
+        Exception: The first stage failure, once the stages already running have finished.
+    """
+    deps = stage_dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    timings, outcomes = {}, {}
+    run_start = time.time()
+
+    def finished(name, outcome, start, end, recorded, error):
+        replay_metrics(recorded)
+        if error is not None:
+            raise error
+        timings[name] = (start, end)
+        outcomes[name] = outcome
+        if on_stage:
+            on_stage(name, len(timings), len(stages), outcomes[name])
+
+    if workers <= 1:
+        for name in _topological_order(deps):
+            if on_stage:
+                on_stage(name, len(timings), len(stages), "running")
+            finished(name, *_timed_stage(by_name[name], cache_dir))
+    else:
+        pool = stage_pool(workers)
+        pending = [stage.name for stage in stages]
+        running = {}
+        error = None
+        while pending or running:
+            if error is None:
+                for name in [name for name in pending if deps[name] <= outcomes.keys()]:
+                    pending.remove(name)
+                    if on_stage:
+                        on_stage(name, len(timings), len(stages), "running")
+                    running[pool.submit(_timed_stage, by_name[name], cache_dir)] = name
+            if not running:
+                break
+            completed, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in completed:
+                name = running.pop(future)
+                try:
+                    finished(name, *future.result())
+                except Exception as e:
+                    print(f"[Pipeline Error] {name} failed: {e}")
+                    error = error or e
+        if error is not None:
+            raise error
+
+    report = run_report(deps, timings, outcomes, run_start, time.time())
+    PIPELINE_RUN_DURATION.labels(measure="wall").observe(report["wall_seconds"])
+    PIPELINE_RUN_DURATION.labels(measure="critical_path").observe(report["critical_path_seconds"])
+    PIPELINE_RUN_DURATION.labels(measure="stages_total").observe(report["stage_seconds"])
+    print(
+        f"[Pipeline] Critical path {' -> '.join(report['critical_path'])}: "
+        f"{report['critical_path_seconds']:.2f}s of {report['wall_seconds']:.2f}s wall, "
+        f"{report['stage_seconds']:.2f}s of stage time"
+    )
+    return report
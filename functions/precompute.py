@@ -0,0 +1,127 @@
+"""
+Scheduled precomputation of the common date filters.
+
+PRECOMPUTE_FILTERS lists the filters to keep warm, each with an optional
+interval in seconds ("Today=300,ThisMonth,ThisQuarter=3600"; the default is
+PRECOMPUTE_INTERVAL_SECONDS). The scheduler rebuilds a filter shortly
+before its result is older than its interval, so the report is in the
+result cache before anyone asks for it.
+
+It runs below interactive requests: a rebuild only starts while the
+pipeline executor is idle, and it checks again before every filter. A
+rebuild that has started runs to completion; interactive requests for the
+same filter join it.
+"""
+import asyncio
+import os
+import time
+
+from functions.metrics import PRECOMPUTE_RUNS
+
+PRECOMPUTE_INTERVAL_SECONDS = int(os.environ.get("PRECOMPUTE_INTERVAL_SECONDS", "900"))
+# Empty disables the scheduler
+PRECOMPUTE_FILTERS = os.environ.get("PRECOMPUTE_FILTERS", "")
+# How often the scheduler looks for due filters
+PRECOMPUTE_POLL_SECONDS = float(os.environ.get("PRECOMPUTE_POLL_SECONDS", "5"))
+# Rebuild at this fraction of the interval, so requests do not hit a stale gap
+PRECOMPUTE_REFRESH_AT = 0.8
+# Wait before trying a filter again after a failed rebuild
+PRECOMPUTE_RETRY_SECONDS = int(os.environ.get("PRECOMPUTE_RETRY_SECONDS", "120"))
+
+
+def parse_filters(spec, default_interval=PRECOMPUTE_INTERVAL_SECONDS):
+    """
+    Parse "Today=300,ThisMonth" into {"Today": 300, "ThisMonth": default_interval}.
+
+    Raises:
+        ValueError: If an interval is not a positive whole number of seconds.
+    """
+    intervals = {}
+    for item in spec.split(","):
+        name, _, seconds = item.strip().partition("=")
+        if not name:
+            continue
+        interval = int(seconds) if seconds.strip() else default_interval
+        if interval <= 0:
+            raise ValueError(f"Interval for {name!r} must be positive, got {interval}")
+        intervals[name.strip()] = interval
+    return intervals
+
+
+class PrecomputeScheduler:
+    """
+    Keep the results of a few date filters fresh in the background.
+
+    Args:
+        intervals (dict): date_filter -> seconds a result stays fresh.
+        build (coroutine function): build(date_filter) rebuilds and caches one report.
+        is_idle (callable): True when no interactive build is running or waiting.
+        is_fresh (callable): is_fresh(date_filter, seconds) is True when the cached
+            result is younger than seconds, e.g. after an interactive request built it.
+    """
+
+    def __init__(self, intervals, build, is_idle, is_fresh, poll_seconds=PRECOMPUTE_POLL_SECONDS):
+        self.intervals = intervals
+        self.build = build
+        self.is_idle = is_idle
+        self.is_fresh = is_fresh
+        self.poll_seconds = poll_seconds
+        self.last_built = {}
+        self.next_attempt = {}
+        self._task = None
+
+    def interval(self, date_filter):
+        """Freshness interval of a scheduled filter, or None for other filters."""
+        return self.intervals.get(date_filter)
+
+    def due(self):
+        """Scheduled filters whose result is stale, in configured order."""
+        now = time.monotonic()
+        return [
+            name for name, interval in self.intervals.items()
+            if now >= self.next_attempt.get(name, 0) and not self.is_fresh(name, interval * PRECOMPUTE_REFRESH_AT)
+        ]
+
+    async def run_due(self):
+        """Rebuild the due filters one at a time while the executor stays idle."""
+        for date_filter in self.due():
+            if not self.is_idle():
+                return
+            start = time.monotonic()
+            try:
+                await self.build(date_filter)
+            except Exception as e:
+                print(f"[Precompute Error] {date_filter!r}: {e}")
+                PRECOMPUTE_RUNS.labels(date_filter=date_filter, outcome="error").inc()
+                self.next_attempt[date_filter] = time.monotonic() + PRECOMPUTE_RETRY_SECONDS
+                continue
+            self.last_built[date_filter] = time.time()
+            PRECOMPUTE_RUNS.labels(date_filter=date_filter, outcome="ok").inc()
+            print(f"[Precompute] {date_filter!r} ready in {time.monotonic() - start:.1f}s")
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_due()
+            except Exception as e:
+                print(f"[Precompute Error] {e}")
+            await asyncio.sleep(self.poll_seconds)
+
+    def start(self):
+        if self.intervals and self._task is None:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            name: {"interval": interval, "last_built": self.last_built.get(name)}
+            for name, interval in self.intervals.items()
+        }
@@ -0,0 +1,213 @@
+"""
+Columnar store for fetched Zoho reports.
+
+Reports are kept as uncompressed Feather (Arrow IPC) files so they can be
+memory-mapped instead of parsed from xlsx:
+
+- cache/reports/{org}/{report_name}/{date_filter}.feather outlives
+  cleanup_folders and lets fetch_all_reports skip Zoho within the TTL
+  (unless called with force_fetch).
+- A sidecar next to each csvdata/ workbook (same name, .feather) lets the
+  stages that read the fetched reports skip the xlsx parse.
+
+iter_frames reads a report in fixed-size batches for the chunked aging mode
+(AGING_CHUNK_ROWS), so memory is bounded by the batch size.
+"""
+import os
+import time
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from functions.result_cache import RESULT_CACHE_FRESH_SECONDS
+from functions.schema import as_text
+
+REPORT_STORE_DIR = os.environ.get("REPORT_STORE_DIR", "cache/reports")
+# Capped at the result cache's fresh window: once a fetch stops being fresh,
+# the next fetch must reach Zoho rather than restore the same data
+REPORT_STORE_TTL_SECONDS = min(
+    int(os.environ.get("REPORT_STORE_TTL_SECONDS", str(RESULT_CACHE_FRESH_SECONDS))), RESULT_CACHE_FRESH_SECONDS
+)
+# Rows per batch for the chunked aging mode; 0 reads reports whole
+AGING_CHUNK_ROWS = int(os.environ.get("AGING_CHUNK_ROWS", "0"))
+
+
+def normalize_frame(df):
+    """
+    Make a report frame storable in Arrow: string column names, a plain index,
+    and object columns that mix types (e.g. phone numbers) stored as text.
+    """
+    df = df.reset_index(drop=True)
+    df.columns = [str(col) for col in df.columns]
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) not in ("string", "empty"):
+            df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+
+def _write_feather(df, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    feather.write_feather(normalize_frame(df), tmp_path, compression="uncompressed")
+    os.replace(tmp_path, path)
+
+
+def _read_feather(path):
+    return feather.read_table(path, memory_map=True).to_pandas()
+
+
+def report_path(org, report_name, date_filter):
+    """Location of a stored report in the columnar cache."""
+    filter_name = quote(date_filter or "_all", safe="")
+    return os.path.join(REPORT_STORE_DIR, org, report_name, f"{filter_name}.feather")
+
+
+def save_report(df, org, report_name, date_filter):
+    """Store a fetched report keyed by org, report type and date_filter."""
+    path = report_path(org, report_name, date_filter)
+    try:
+        _write_feather(df, path)
+        print(f"[Report Store] Stored {report_name} for {org} ({date_filter!r})")
+    except (OSError, pa.ArrowException) as e:
+        print(f"[Report Store Error] Failed to store {path}: {e}")
+
+
+def load_report(org, report_name, date_filter, ttl_seconds=None):
+    """
+    Load a stored report if it is younger than the TTL.
+
+    Returns:
+        pd.DataFrame or None: The report, or None when missing or expired.
+    """
+    ttl_seconds = REPORT_STORE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+    path = report_path(org, report_name, date_filter)
+    if not os.path.exists(path):
+        return None
+    if time.time() - os.path.getmtime(path) > ttl_seconds:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    try:
+        return _read_feather(path)
+    except (OSError, pa.ArrowException) as e:
+        print(f"[Report Store Error] Failed to read {path}: {e}")
+        return None
+
+
+def sidecar_path(xlsx_path):
+    return os.path.splitext(xlsx_path)[0] + ".feather"
+
+
+def write_sidecar(df, xlsx_path):
+    """Write the columnar copy of a workbook's first sheet next to it."""
+    try:
+        _write_feather(df, sidecar_path(xlsx_path))
+    except (OSError, pa.ArrowException) as e:
+        print(f"[Report Store Error] Failed to write sidecar for {xlsx_path}: {e}")
+
+
+def read_frame(xlsx_path, dtype=None):
+    """
+    Read a fetched report, memory-mapping its sidecar when it is up to date
+    and falling back to parsing the workbook otherwise.
+
+    Args:
+        xlsx_path (str): Path of the workbook in csvdata/.
+        dtype: Pass str to get every value as text, as pd.read_excel(dtype=str) does.
+    """
+    sidecar = sidecar_path(xlsx_path)
+    if _sidecar_is_fresh(xlsx_path):
+        try:
+            df = _read_feather(sidecar)
+            if dtype is str:
+                df = df.apply(as_text)
+            return df
+        except (OSError, pa.ArrowException) as e:
+            print(f"[Report Store Error] Failed to read {sidecar}, parsing workbook: {e}")
+    return pd.read_excel(xlsx_path, dtype=dtype)
+
+
+def sidecar_table(xlsx_path):
+    """
+    The report's sidecar as a memory-mapped Arrow table, or None when there is no
+    up-to-date sidecar. Taking rows from it pages in only the rows taken.
+    """
+    if not _sidecar_is_fresh(xlsx_path):
+        return None
+    try:
+        return feather.read_table(sidecar_path(xlsx_path), memory_map=True)
+    except (OSError, pa.ArrowException) as e:
+        print(f"[Report Store Error] Failed to read {sidecar_path(xlsx_path)}: {e}")
+        return None
+
+
+def _sidecar_is_fresh(xlsx_path):
+    sidecar = sidecar_path(xlsx_path)
+    return os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(xlsx_path)
+
+
+def _iter_sidecar(source, chunk_rows):
+    try:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            for offset in range(0, batch.num_rows, chunk_rows):
+                yield batch.slice(offset, chunk_rows).to_pandas()
+    finally:
+        source.close()
+
+
+def _workbook_frame(rows, columns):
+    df = pd.DataFrame(rows, columns=columns)
+    # Empty cells as NaN, as pd.read_excel gives them
+    return df.where(df.notna(), np.nan)
+
+
+def _iter_workbook(xlsx_path, chunk_rows):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(xlsx_path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(name) if name is not None else f"Unnamed: {i}" for i, name in enumerate(header)]
+        batch = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            batch.append(row)
+            if len(batch) == chunk_rows:
+                yield _workbook_frame(batch, columns)
+                batch = []
+        if batch:
+            yield _workbook_frame(batch, columns)
+    finally:
+        wb.close()
+
+
+def iter_frames(xlsx_path, chunk_rows=None):
+    """
+    Read a report's first sheet in DataFrames of at most chunk_rows rows.
+
+    Batches come from the memory-mapped sidecar when it is up to date, and
+    otherwise from the workbook in openpyxl read-only mode; neither loads the
+    whole report.
+    """
+    chunk_rows = chunk_rows or AGING_CHUNK_ROWS or 50000
+    if _sidecar_is_fresh(xlsx_path):
+        sidecar = sidecar_path(xlsx_path)
+        try:
+            source = pa.memory_map(sidecar)
+        except (OSError, pa.ArrowException) as e:
+            print(f"[Report Store Error] Failed to read {sidecar}, parsing workbook: {e}")
+        else:
+            yield from _iter_sidecar(source, chunk_rows)
+            return
+    yield from _iter_workbook(xlsx_path, chunk_rows)
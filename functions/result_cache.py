@@ -0,0 +1,262 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+
+# Cache configuration (override through the environment on Cloud Run)
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "cache/results")
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "16"))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# How long a source fingerprint is trusted before Zoho is asked again
+RESULT_CACHE_FRESH_SECONDS = int(os.environ.get("RESULT_CACHE_FRESH_SECONDS", "300"))
+
+# Suffixes of cached results: Combined_Report workbooks and table exports
+RESULT_SUFFIXES = (".xlsx", ".zip", ".json")
+# Suffix of the file next to each result holding its ETag, so a restart does not rehash the results
+ETAG_SUFFIX = ".etag"
+
+# Parts of an xlsx package that change on every save even when the data does not
+VOLATILE_XLSX_PARTS = {"docProps/core.xml", "docProps/app.xml"}
+
+
+def content_digest(file_path):
+    """
+    Hash the content of a file. Workbooks are hashed member by member, skipping the
+    document properties so that re-saving identical data gives the same digest.
+    """
+    digest = hashlib.sha256()
+    if zipfile.is_zipfile(file_path):
+        with zipfile.ZipFile(file_path) as zf:
+            for name in sorted(zf.namelist()):
+                if name in VOLATILE_XLSX_PARTS:
+                    continue
+                digest.update(name.encode())
+                digest.update(zf.read(name))
+    else:
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint_reports(file_paths):
+    """
+    Build a single fingerprint for the fetched source reports.
+
+    Args:
+        file_paths (list): Paths of the reports saved by fetch_all_reports.
+
+    Returns:
+        str: Hex digest that changes whenever any report's data changes.
+    """
+    digest = hashlib.sha256()
+    for file_path in sorted(file_paths):
+        digest.update(os.path.basename(file_path).encode())
+        if os.path.exists(file_path):
+            digest.update(content_digest(file_path).encode())
+        else:
+            digest.update(b"missing")
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    LRU cache of generated Combined_Report workbooks and table exports, keyed by
+    date_filter, the fingerprint of the source reports they were built from and
+    the output format. Entries are kept on disk under cache_dir and evicted by
+    entry count and total size.
+
+    A response streaming an entry's file holds it (hold/release); an evicted
+    entry that is still held is deleted when its last holder releases it.
+    """
+
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, max_entries=RESULT_CACHE_MAX_ENTRIES,
+                 max_bytes=RESULT_CACHE_MAX_BYTES, fresh_seconds=RESULT_CACHE_FRESH_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.fresh_seconds = fresh_seconds
+        self._entries = OrderedDict()
+        self._fingerprints = {}
+        # Entry path -> responses still streaming it, and evicted paths waiting for them
+        self._holders = {}
+        self._evicted = set()
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_existing()
+
+    @staticmethod
+    def make_key(date_filter, fingerprint, output_format="xlsx"):
+        # Workbooks keep the key they had before other formats were cached
+        suffix = "" if output_format == "xlsx" else f"\0{output_format}"
+        return hashlib.sha256(f"{date_filter}\0{fingerprint}{suffix}".encode()).hexdigest()
+
+    @staticmethod
+    def _write_etag(path, etag):
+        tmp_path = f"{path}{ETAG_SUFFIX}.tmp{threading.get_ident()}"
+        with open(tmp_path, "w") as f:
+            f.write(etag)
+        os.replace(tmp_path, path + ETAG_SUFFIX)
+
+    @classmethod
+    def _read_etag(cls, path):
+        """The stored ETag of a cached result; hashed (and stored) only when the file is missing or stale."""
+        try:
+            if os.path.getmtime(path + ETAG_SUFFIX) >= os.path.getmtime(path):
+                with open(path + ETAG_SUFFIX) as f:
+                    etag = f.read().strip()
+                if etag:
+                    return etag
+        except OSError:
+            pass
+        etag = f'"{content_digest(path)}"'
+        try:
+            cls._write_etag(path, etag)
+        except OSError as e:
+            print(f"[Cache Error] Failed to store the ETag of {path}: {e}")
+        return etag
+
+    def _load_existing(self):
+        # Pick up entries left by a previous process, oldest first
+        files = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(RESULT_SUFFIXES):
+                path = os.path.join(self.cache_dir, filename)
+                files.append((os.path.getmtime(path), filename, path))
+        for _, filename, path in sorted(files):
+            key = os.path.splitext(filename)[0]
+            self._entries[key] = {
+                "path": path,
+                "etag": self._read_etag(path),
+                "size": os.path.getsize(path),
+            }
+        self._evict()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"[Cache Error] Failed to evict {path}: {e}")
+        try:
+            os.remove(path + ETAG_SUFFIX)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[Cache Error] Failed to evict {path + ETAG_SUFFIX}: {e}")
+
+    def _evict(self, keep=None):
+        """Drop the oldest entries until within limits, never the entry keep (the one being stored)."""
+        total = sum(entry["size"] for entry in self._entries.values())
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_entries and total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = self._entries.pop(key)
+            total -= entry["size"]
+            if self._holders.get(entry["path"]):
+                self._evicted.add(entry["path"])
+            else:
+                self._remove(entry["path"])
+            print(f"[Cache] Evicted result: {key}")
+
+    def get(self, date_filter, fingerprint, output_format="xlsx"):
+        """Return the cached entry for date_filter/fingerprint/output_format, or None."""
+        key = self.make_key(date_filter, fingerprint, output_format)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not os.path.exists(entry["path"]):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, date_filter, fingerprint, file_path, output_format="xlsx"):
+        """Copy a generated report into the cache and return its entry."""
+        key = self.make_key(date_filter, fingerprint, output_format)
+        cached_path = os.path.join(self.cache_dir, key + os.path.splitext(file_path)[1])
+        # Replace rather than overwrite, so a response streaming the old file keeps reading it
+        tmp_path = f"{cached_path}.tmp{threading.get_ident()}"
+        shutil.copyfile(file_path, tmp_path)
+        etag = f'"{content_digest(tmp_path)}"'
+        os.replace(tmp_path, cached_path)
+        self._write_etag(cached_path, etag)
+        entry = {
+            "path": cached_path,
+            "etag": etag,
+            "size": os.path.getsize(cached_path),
+        }
+        if entry["size"] > self.max_bytes:
+            # Kept until the next result is stored, so this one can still be served
+            print(f"[Cache] {output_format} result for date_filter={date_filter!r} exceeds the cache size limit")
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evicted.discard(cached_path)
+            self._evict(keep=key)
+        print(f"[Cache] Stored {output_format} result for date_filter={date_filter!r}")
+        return entry
+
+    def hold(self, entry):
+        """
+        Keep entry's file on disk while a response streams it; pair with release.
+
+        Returns:
+            bool: False when the entry was already evicted and its file removed.
+        """
+        path = entry["path"]
+        with self._lock:
+            if path in self._evicted or not os.path.exists(path):
+                return False
+            self._holders[path] = self._holders.get(path, 0) + 1
+            return True
+
+    def release(self, entry):
+        path = entry["path"]
+        with self._lock:
+            count = self._holders.pop(path, 0) - 1
+            if count > 0:
+                self._holders[path] = count
+            elif path in self._evicted:
+                self._evicted.discard(path)
+                self._remove(path)
+
+    def remember_fingerprint(self, date_filter, fingerprint):
+        with self._lock:
+            self._fingerprints[date_filter] = (fingerprint, time.monotonic())
+
+    def fresh_fingerprint(self, date_filter, fresh_seconds=None):
+        """
+        Return the last fingerprint seen for date_filter if it is still fresh,
+        i.e. seen within fresh_seconds (default: the cache's fresh_seconds).
+        """
+        with self._lock:
+            seen = self._fingerprints.get(date_filter)
+        if seen is None:
+            return None
+        fingerprint, checked_at = seen
+        if fresh_seconds is None:
+            fresh_seconds = self.fresh_seconds
+        if time.monotonic() - checked_at > fresh_seconds:
+            return None
+        return fingerprint
+
+
+def etag_matches(if_none_match, etag):
+    """Check an If-None-Match header value against an entity tag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
@@ -0,0 +1,161 @@
+"""
+In-memory index of the latest pipeline results for the JSON read endpoints.
+
+Built once from the last run's outputs (segregator aging files, the age
+summary and the consolidated balances that balance_summary reads); main.py
+swaps the new index in as a whole, so readers always see one consistent run. Customers
+are looked up by normalised name through a dict of row positions, and
+balances are pre-sorted and grouped by range.
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from functions.balance_summary import BALANCE_RANGES, balance_range_labels
+from functions.customer_index import normalize_names
+from functions.schema import AGE_BUCKET_LABELS, assign_age_buckets
+
+# Columns of unified_file.xlsx (read with header=1) served by /balances
+BALANCE_COLUMNS = {
+    "customer_name": "customer_name",
+    "bcy_invoice_balance_file1": "smcs_invoice_balance",
+    "bcy_available_credits_file1": "smcs_available_credits",
+    "closing_balance_file1": "smcs_closing_balance",
+    "bcy_invoice_balance_file2": "nvb_invoice_balance",
+    "bcy_available_credits_file2": "nvb_available_credits",
+    "closing_balance_file2": "nvb_closing_balance",
+    "Consolidated invoiced_amount": "consolidated_invoice_balance",
+    "Consolidated amount_received": "consolidated_available_credits",
+    "Consolidated closing_balance": "consolidated_closing_balance",
+}
+INVOICE_COLUMNS = ["transaction_number", "date", "status", "age", "amount", "balance"]
+
+
+def records(df):
+    """JSON-ready records: missing values as None, numpy scalars as Python values."""
+    return df.astype(object).where(df.notna(), None).to_dict(orient="records")
+
+
+class ResultIndex:
+    """Indexed copy of one pipeline run's results."""
+
+    def __init__(self, date_filter, aging, age_summary, balances):
+        self.date_filter = date_filter
+        self.built_at = time.time()
+        self.aging = aging.reset_index(drop=True)
+        self.age_summary = age_summary
+        self.balances = balances.reset_index(drop=True)
+        # Normalised customer name -> row positions
+        self.aging_rows = {key: rows for key, rows in self.aging.groupby("customer_key", sort=False).indices.items()}
+        self.balance_rows = {key: rows for key, rows in self.balances.groupby("customer_key", sort=False).indices.items()}
+        self.range_rows = {
+            label: rows for label, rows in self.balances.groupby("balance_range", sort=False, observed=True).indices.items()
+        }
+
+    @classmethod
+    def from_outputs(cls, date_filter, aging_files, age_summary_file, unified_file):
+        """
+        Build the index from a run's output workbooks.
+
+        Args:
+            aging_files (dict): org -> segregator output path.
+            age_summary_file (str): Age_summary.xlsx path.
+            unified_file (str): unified_file.xlsx path.
+        """
+        aging_frames = []
+        for org, path in aging_files.items():
+            df = pd.read_excel(path)
+            df.insert(0, "org", org)
+            aging_frames.append(df)
+        aging = pd.concat(aging_frames, ignore_index=True)
+        aging["customer_key"] = normalize_names(aging["customer_name"]).to_numpy()
+        aging["bucket"] = assign_age_buckets(aging["age"]).astype(str)
+
+        age_summary = pd.read_excel(age_summary_file, sheet_name="Summary")
+
+        balances = pd.read_excel(unified_file, header=1)
+        balances = balances[[col for col in BALANCE_COLUMNS if col in balances.columns]].rename(columns=BALANCE_COLUMNS)
+        balances = balances[balances["customer_name"].notna()]
+        balances["customer_key"] = normalize_names(balances["customer_name"]).to_numpy()
+        balances["balance_range"] = balance_range_labels(balances["consolidated_closing_balance"])
+        balances = balances.sort_values("consolidated_closing_balance", ascending=False)
+        return cls(date_filter, aging, age_summary, balances)
+
+    def customer_aging(self, name, org=None):
+        """
+        Aging for one customer: bucket totals per org, the open invoices and
+        the customer's consolidated balances.
+
+        Returns:
+            dict or None: None when the customer is not in the latest run.
+        """
+        key = normalize_names([name]).iloc[0]
+        rows = self.aging_rows.get(key)
+        if rows is None:
+            return None
+        df = self.aging.iloc[rows]
+        if org:
+            df = df[df["org"].str.casefold() == org.casefold()]
+        buckets = df.groupby("org")[AGE_BUCKET_LABELS].sum()
+        buckets["Unpaid Invoices"] = buckets.sum(axis=1)
+        return {
+            "customer_name": str(df["customer_name"].iloc[0]) if len(df) else name,
+            "date_filter": self.date_filter,
+            "buckets": {org_name: {k: float(v) for k, v in row.items()} for org_name, row in buckets.iterrows()},
+            "balances": records(self.balances.iloc[self.balance_rows.get(key, [])][list(BALANCE_COLUMNS.values())]),
+            "invoices": records(df[["org", "bucket"] + [c for c in INVOICE_COLUMNS if c in df.columns]]),
+        }
+
+    def balances_in_range(self, balance_range=None):
+        """
+        Consolidated balances, largest first, optionally limited to one range
+        label of BALANCE_RANGES (e.g. "2L-5L").
+
+        Raises:
+            KeyError: If balance_range is not a known range label.
+        """
+        columns = list(BALANCE_COLUMNS.values()) + ["balance_range"]
+        if balance_range is None:
+            return records(self.balances[columns])
+        if balance_range not in [label for _, _, label in BALANCE_RANGES]:
+            raise KeyError(balance_range)
+        rows = self.range_rows.get(balance_range, np.array([], dtype=np.int64))
+        return records(self.balances.iloc[rows][columns])
+
+    def summary(self):
+        """Age summary rows plus customer counts and totals per balance range."""
+        money = [col for col in BALANCE_COLUMNS.values() if col != "customer_name"]
+        by_range = self.balances.groupby("balance_range", observed=False)
+        ranges = by_range[money].sum()
+        ranges.insert(0, "customers", by_range.size())
+        ranges = ranges.reindex([label for _, _, label in reversed(BALANCE_RANGES)]).reset_index()
+        return {
+            "date_filter": self.date_filter,
+            "built_at": self.built_at,
+            "aging": records(self.age_summary),
+            "balance_ranges": records(ranges),
+        }
+
+
+def build_index(date_filter, aging_files, age_summary_file, unified_file):
+    """
+    Build the index from a run's outputs.
+
+    Returns:
+        ResultIndex or None: None when outputs are missing or the build fails.
+    """
+    paths = list(aging_files.values()) + [age_summary_file, unified_file]
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        print(f"[Result Index] Not built, missing outputs: {missing}")
+        return None
+    try:
+        start = time.perf_counter()
+        index = ResultIndex.from_outputs(date_filter, aging_files, age_summary_file, unified_file)
+    except Exception as e:
+        print(f"[Result Index Error] Failed to build index for {date_filter!r}: {e}")
+        return None
+    print(f"[Result Index] Built for {date_filter!r} in {time.perf_counter() - start:.2f}s")
+    return index
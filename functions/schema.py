@@ -0,0 +1,178 @@
+"""
+Ingest schema shared by the pipeline stages.
+
+Money is held as int64 paise (nullable Int64 where Zoho leaves a cell empty)
+so that sums are exact integer additions, and repeated free-text columns are
+categoricals. Frames are converted back to rupees only when they are written.
+
+Reports are written in whole numbers: numeric columns are truncated toward
+zero (as int() does) on the DataFrame just before it is written, and given
+the WHOLE_NUMBER_FORMAT number format where the writer supports it.
+"""
+import numpy as np
+import pandas as pd
+
+PAISE_PER_RUPEE = 100
+
+# Money columns in the aging and customer balance reports
+MONEY_COLUMNS = [
+    "balance", "amount",
+    "bcy_invoice_balance", "bcy_available_credits", "closing_balance",
+]
+
+# Free-text columns with few distinct values per report
+CATEGORICAL_COLUMNS = [
+    "customer_name", "status", "entity", "currency_code",
+    "last_name", "email", "mobile_phone",
+    "contact.CF.Client Coordinator", "contact.CF.Leadership",
+    "contact.CF.Is Customer part of the Group of Companies",
+]
+
+# Aging buckets in report order: (label, lower bound in days inclusive, upper bound exclusive)
+AGE_BUCKETS = [
+    ("3Yrs>=", 1095, np.inf),
+    ("3Yr<=2Yr", 730, 1095),
+    ("2Yr<=1Yr", 365, 730),
+    ("1Yr<=180days", 180, 365),
+    ("180<=90days", 90, 180),
+    ("90<=60days", 60, 90),
+    ("60<=30days", 30, 60),
+    (">=30days", -np.inf, 30),
+]
+AGE_NOT_PROVIDED = "Age_Not_Provided"
+AGE_BUCKET_LABELS = [label for label, _, _ in AGE_BUCKETS] + [AGE_NOT_PROVIDED]
+AGE_BUCKET_DTYPE = pd.CategoricalDtype(AGE_BUCKET_LABELS, ordered=True)
+
+# Excel number format for whole-number columns
+WHOLE_NUMBER_FORMAT = "0"
+# Header cell style pandas uses in to_excel, for sheets written with xlsxwriter directly
+HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+
+
+def to_paise(values):
+    """Convert rupee amounts (numbers or numeric strings) to nullable int64 paise."""
+    rupees = pd.to_numeric(values, errors="coerce")
+    return (rupees * PAISE_PER_RUPEE).round().astype("Int64")
+
+
+def from_paise(paise):
+    """Convert paise back to float rupees for writing."""
+    return paise.astype("Float64").div(PAISE_PER_RUPEE).astype(float)
+
+
+def whole_rupees(paise_total):
+    """Whole rupees in a paise amount, truncated toward zero like int() on rupees."""
+    paise_total = int(paise_total)
+    rupees = abs(paise_total) // PAISE_PER_RUPEE
+    return rupees if paise_total >= 0 else -rupees
+
+
+def as_text(series):
+    # Like pd.read_excel(dtype=str): whole floats lose their ".0", missing stays missing
+    if pd.api.types.is_float_dtype(series):
+        present = series.dropna()
+        if (present == present.round()).all():
+            return series.map(lambda v: v if pd.isna(v) else str(int(v)))
+    return series.map(lambda v: v if pd.isna(v) else str(v))
+
+
+def text_column(series):
+    """Free text as a string categorical."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+    return as_text(series).astype("category")
+
+
+def apply_ingest_schema(df, money_columns=MONEY_COLUMNS):
+    """
+    Apply the ingest schema to a report frame in place of ad-hoc conversions.
+
+    Args:
+        df (pd.DataFrame): Frame as read from a report.
+        money_columns (list): Columns to convert to paise (those missing are skipped).
+
+    Returns:
+        pd.DataFrame: Frame with money in Int64 paise and text columns as categoricals.
+    """
+    df = df.copy()
+    for col in money_columns:
+        if col in df.columns:
+            df[col] = to_paise(df[col])
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = text_column(df[col])
+    return df
+
+
+def money_to_rupees(df, money_columns=MONEY_COLUMNS):
+    """Return a copy of df with its paise columns converted back to rupees."""
+    df = df.copy()
+    for col in money_columns:
+        if col in df.columns and pd.api.types.is_integer_dtype(df[col]):
+            df[col] = from_paise(df[col])
+    return df
+
+
+def assign_age_buckets(age):
+    """
+    Bucket ages in days into AGE_BUCKET_LABELS.
+
+    Returns:
+        pd.Series: Ordered categorical with AGE_NOT_PROVIDED for missing ages.
+    """
+    age = pd.to_numeric(age, errors="coerce")
+    edges = sorted({bound for _, lower, upper in AGE_BUCKETS for bound in (lower, upper)})
+    labels = [label for label, _, _ in sorted(AGE_BUCKETS, key=lambda b: b[1])]
+    buckets = pd.cut(age, bins=edges, labels=labels, right=False)
+    return buckets.cat.add_categories([AGE_NOT_PROVIDED]).fillna(AGE_NOT_PROVIDED).astype(AGE_BUCKET_DTYPE)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_)) and not pd.isna(value)
+
+
+def _is_numeric_column(values):
+    if pd.api.types.is_bool_dtype(values):
+        return False
+    if values.dtype == object:
+        # e.g. a float column after a total row was appended as objects
+        return pd.api.types.infer_dtype(values, skipna=True) in ("floating", "integer", "mixed-integer-float")
+    return pd.api.types.is_numeric_dtype(values)
+
+
+def numeric_positions(df):
+    """Positions of the numeric (non-boolean) columns of df."""
+    return [position for position in range(df.shape[1]) if _is_numeric_column(df.iloc[:, position])]
+
+
+def whole_numbers(df):
+    """
+    Apply the write-time rounding policy to a frame.
+
+    Returns:
+        pd.DataFrame: Copy of df with non-integer numeric columns truncated
+        toward zero to nullable Int64 (missing values stay missing), and the
+        numbers in text columns that mix numbers and text (e.g. sheets with
+        a second header row) truncated in place.
+    """
+    df = df.copy()
+    numeric = set(numeric_positions(df))
+    for position in range(df.shape[1]):
+        values = df.iloc[:, position]
+        if position in numeric:
+            if not pd.api.types.is_integer_dtype(values):
+                truncated = np.trunc(pd.to_numeric(values).to_numpy(dtype=float, na_value=np.nan))
+                df.isetitem(position, pd.Series(truncated, index=df.index).astype("Int64"))
+        elif values.dtype == object and pd.api.types.infer_dtype(values, skipna=True).startswith("mixed"):
+            is_number = values.map(_is_number).to_numpy(dtype=bool)
+            if is_number.any():
+                values = values.copy()
+                values[is_number] = np.trunc(values[is_number].to_numpy(dtype=float)).astype(np.int64)
+                df.isetitem(position, values)
+    return df
+
+
+def set_whole_number_format(worksheet, number_format, df, first_col=0):
+    """Give the numeric columns of df an xlsxwriter number format on the worksheet."""
+    for position in numeric_positions(df):
+        worksheet.set_column(first_col + position, first_col + position, None, number_format)
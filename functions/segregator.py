@@ -1,44 +1,78 @@
 import pandas as pd
 import os
+import xlsxwriter
+
+from functions.metrics import record_rows
+from functions.report_store import AGING_CHUNK_ROWS, iter_frames, read_frame
+from functions.schema import (
+    AGE_BUCKET_LABELS, HEADER_FORMAT, MONEY_COLUMNS, apply_ingest_schema, assign_age_buckets, money_to_rupees
+)
+
+def add_age_range_columns(df):
+    """
+    Add one balance column per age bucket to an aging frame read with the
+    ingest schema, and convert its money back to rupees for writing.
+    """
+    # Extract numeric value from the 'Age' column
+    df['age'] = pd.to_numeric(df['age'], errors='coerce')
+
+    # Create new columns for the age ranges
+    buckets = assign_age_buckets(df['age'])
+    for label in AGE_BUCKET_LABELS:
+        df[label] = df['balance'].where(buckets == label, 0)
+    return money_to_rupees(df, MONEY_COLUMNS + AGE_BUCKET_LABELS)
+
+def process_file_chunked(input_file, output_file, org="", chunk_rows=None):
+    """
+    Chunked variant of process_file: reads the report in batches of chunk_rows
+    and streams each batch to the workbook, so memory does not grow with the report.
+    """
+    workbook = xlsxwriter.Workbook(output_file, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+    worksheet = workbook.add_worksheet('Sheet1')
+    header_format = workbook.add_format(HEADER_FORMAT)
+    columns = None
+    row_idx = 1
+    try:
+        for chunk in iter_frames(input_file, chunk_rows):
+            df = add_age_range_columns(apply_ingest_schema(chunk))
+            record_rows("segregate", org, len(df))
+            if columns is None:
+                columns = list(df.columns)
+                worksheet.write_row(0, 0, columns, header_format)
+            df = df.reindex(columns=columns).astype(object)
+            for values in df.where(df.notna(), None).itertuples(index=False, name=None):
+                worksheet.write_row(row_idx, 0, values)
+                row_idx += 1
+    finally:
+        workbook.close()
+    print(f"Processed file saved to {output_file} ({row_idx - 1} rows in chunks of {chunk_rows or AGING_CHUNK_ROWS})")
 
 # Function to process each file and add new columns for age ranges
-def process_file(input_file, output_file):
+def process_file(input_file, output_file, org=""):
     # Ensure the output directory exists
     output_dir = os.path.dirname(output_file)
     if output_dir and not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # Read the file
+    if AGING_CHUNK_ROWS:
+        try:
+            process_file_chunked(input_file, output_file, org)
+        except Exception as e:
+            print(f"Error processing {input_file} in chunks: {e}")
+        return
+
+    # Read the file; money is held in paise until the file is written
     try:
-        df = pd.read_excel(input_file)
+        df = apply_ingest_schema(read_frame(input_file))
     except Exception as e:
         print(f"Error reading {input_file}: {e}")
         return
 
-    # Extract numeric value from the 'Age' column
-    df['age'] = pd.to_numeric(df['age'], errors='coerce')
-
-    # Create new columns for the age ranges
-    df['3Yrs>='] = df['balance'].where(df['age'] >= 1095, 0)
-    df['3Yr<=2Yr'] = df['balance'].where((df['age'] >= 730) & (df['age'] < 1095), 0)
-    df['2Yr<=1Yr'] = df['balance'].where((df['age'] >= 365) & (df['age'] < 730), 0)
-    df['1Yr<=180days'] = df['balance'].where((df['age'] >= 180) & (df['age'] < 365), 0)
-    df['180<=90days'] = df['balance'].where((df['age'] >= 90) & (df['age'] < 180), 0)
-    df['90<=60days'] = df['balance'].where((df['age'] >= 60) & (df['age'] < 90), 0)
-    df['60<=30days'] = df['balance'].where((df['age'] >= 30) & (df['age'] < 60), 0)
-    df['>=30days'] = df['balance'].where(df['age'] < 30, 0)
-    df['Age_Not_Provided'] = df['balance'].where(df['age'].isna(), 0)
-
-    # Calculate totals
-    age_totals = df[['3Yrs>=', '3Yr<=2Yr', '2Yr<=1Yr', '1Yr<=180days', '180<=90days', '90<=60days', '60<=30days', '>=30days', 'Age_Not_Provided']].sum()
-    total_balance = df['balance'].sum()
-    age_counts = df[['3Yrs>=', '3Yr<=2Yr', '2Yr<=1Yr', '1Yr<=180days', '180<=90days', '90<=60days', '60<=30days', '>=30days', 'Age_Not_Provided']].astype(bool).sum()
-    balance_count = df['balance'].notna().sum()
-
- 
+    record_rows("segregate", org, len(df))
 
     # Save to file
     try:
+        df = add_age_range_columns(df)
         df.to_excel(output_file, index=False)
         print(f"Processed file saved to {output_file}")
     except Exception as e:
@@ -46,5 +80,5 @@ def process_file(input_file, output_file):
 
 # Function to process both files
 def process_multiple_files(file1, file2):
-    process_file(file1, 'output/NVB_Age_Range_Columns.xlsx')
-    process_file(file2, 'output/SMCS_Age_Range_Columns.xlsx')
+    process_file(file1, 'output/NVB_Age_Range_Columns.xlsx', org='NVB')
+    process_file(file2, 'output/SMCS_Age_Range_Columns.xlsx', org='SMCS')
@@ -0,0 +1,296 @@
+"""
+Historical snapshots of pipeline results in a local SQLite database.
+
+Every pipeline run appends its consolidated balances and invoice-level aging
+to the store, partitioned by run date: one partition per (run_date,
+date_filter), replaced when the same filter runs again on the same day.
+Rows are indexed on (customer_key, org, run_date) and (org, run_date), so
+trend and month-over-month views come from a local query instead of
+re-exporting history from Zoho.
+
+Money is stored as integer paise, as in functions/schema.py. customer_key is
+the normalised customer name, which is stable across runs.
+"""
+import os
+import sqlite3
+import time
+from datetime import date
+
+import pandas as pd
+
+from functions.customer_index import normalize_names
+from functions.schema import AGE_BUCKET_LABELS, assign_age_buckets, from_paise, to_paise
+
+SNAPSHOT_DB_PATH = os.environ.get("SNAPSHOT_DB_PATH", "cache/snapshots.sqlite3")
+SNAPSHOTS_ENABLED = os.environ.get("SNAPSHOTS_ENABLED", "1") != "0"
+
+# unified_file column suffix for each org (see consolidater.process_and_merge_files)
+UNIFIED_ORG_SUFFIXES = {"SMCS": "_file1", "NVB": "_file2"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_date TEXT NOT NULL,
+    date_filter TEXT NOT NULL,
+    fingerprint TEXT,
+    created_at REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS runs_by_date ON runs (run_date, date_filter);
+
+CREATE TABLE IF NOT EXISTS balances (
+    run_id INTEGER NOT NULL,
+    run_date TEXT NOT NULL,
+    org TEXT NOT NULL,
+    customer_key TEXT NOT NULL,
+    customer_name TEXT,
+    invoice_balance INTEGER NOT NULL,
+    available_credits INTEGER NOT NULL,
+    closing_balance INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS balances_by_customer ON balances (customer_key, org, run_date);
+CREATE INDEX IF NOT EXISTS balances_by_org ON balances (org, run_date);
+CREATE INDEX IF NOT EXISTS balances_by_run ON balances (run_id);
+
+CREATE TABLE IF NOT EXISTS aging (
+    run_id INTEGER NOT NULL,
+    run_date TEXT NOT NULL,
+    org TEXT NOT NULL,
+    customer_key TEXT NOT NULL,
+    customer_name TEXT,
+    transaction_number TEXT,
+    invoice_date TEXT,
+    age REAL,
+    bucket TEXT NOT NULL,
+    balance INTEGER NOT NULL,
+    amount INTEGER
+);
+CREATE INDEX IF NOT EXISTS aging_by_customer ON aging (customer_key, org, run_date);
+CREATE INDEX IF NOT EXISTS aging_by_org ON aging (org, run_date, bucket);
+CREATE INDEX IF NOT EXISTS aging_by_run ON aging (run_id);
+"""
+
+
+def connect(db_path=None):
+    """Open the snapshot database, creating its tables and indexes if needed."""
+    db_path = db_path or SNAPSHOT_DB_PATH
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def balance_rows(unified_df):
+    """
+    Long-form balance rows (one per customer and org) from the unified_file frame.
+
+    Args:
+        unified_df (pd.DataFrame): unified_file.xlsx read with header=1.
+    """
+    names = unified_df["customer_name"]
+    keys = normalize_names(names)
+    frames = []
+    for org, suffix in UNIFIED_ORG_SUFFIXES.items():
+        columns = [f"bcy_invoice_balance{suffix}", f"bcy_available_credits{suffix}", f"closing_balance{suffix}"]
+        if not all(col in unified_df.columns for col in columns):
+            continue
+        frames.append(pd.DataFrame({
+            "org": org,
+            "customer_key": keys,
+            "customer_name": names,
+            "invoice_balance": to_paise(unified_df[columns[0]]).fillna(0),
+            "available_credits": to_paise(unified_df[columns[1]]).fillna(0),
+            "closing_balance": to_paise(unified_df[columns[2]]).fillna(0),
+        }))
+    if not frames:
+        return pd.DataFrame()
+    rows = pd.concat(frames, ignore_index=True)
+    return rows[rows["customer_key"].notna()]
+
+
+def aging_rows(org, aging_df):
+    """Invoice-level aging rows for one org from a segregator output frame."""
+    names = aging_df["customer_name"]
+    rows = pd.DataFrame({
+        "org": org,
+        "customer_key": normalize_names(names),
+        "customer_name": names,
+        "transaction_number": aging_df.get("transaction_number"),
+        "invoice_date": aging_df["date"].astype(str) if "date" in aging_df.columns else None,
+        "age": pd.to_numeric(aging_df["age"], errors="coerce"),
+        "bucket": assign_age_buckets(aging_df["age"]).astype(str),
+        "balance": to_paise(aging_df["balance"]).fillna(0),
+        "amount": to_paise(aging_df["amount"]) if "amount" in aging_df.columns else None,
+    })
+    return rows[rows["customer_key"].notna()]
+
+
+def _insert(conn, table, run_id, run_date, rows):
+    if rows.empty:
+        return
+    rows = rows.astype(object).where(rows.notna(), None)
+    columns = ["run_id", "run_date"] + list(rows.columns)
+    placeholders = ", ".join("?" * len(columns))
+    conn.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+        ((run_id, run_date, *values) for values in rows.itertuples(index=False, name=None)),
+    )
+
+
+def record_snapshot(date_filter, fingerprint, unified_df, aging_frames, run_date=None, db_path=None):
+    """
+    Store one run's results as the (run_date, date_filter) partition.
+
+    Args:
+        date_filter (str): Zoho date filter of the run.
+        fingerprint (str): Source fingerprint of the run.
+        unified_df (pd.DataFrame): Consolidated balances (unified_file, header=1).
+        aging_frames (dict): org -> segregator output frame.
+        run_date (str): ISO date of the partition; defaults to today.
+
+    Returns:
+        int: run_id of the stored snapshot.
+    """
+    run_date = run_date or date.today().isoformat()
+    balances = balance_rows(unified_df)
+    aging = pd.concat([aging_rows(org, df) for org, df in aging_frames.items()], ignore_index=True)
+
+    conn = connect(db_path)
+    try:
+        with conn:
+            # Same day and filter again: the newer run replaces the partition
+            for (old_run_id,) in conn.execute(
+                "SELECT run_id FROM runs WHERE run_date = ? AND date_filter = ?", (run_date, date_filter)
+            ).fetchall():
+                conn.execute("DELETE FROM balances WHERE run_id = ?", (old_run_id,))
+                conn.execute("DELETE FROM aging WHERE run_id = ?", (old_run_id,))
+                conn.execute("DELETE FROM runs WHERE run_id = ?", (old_run_id,))
+            run_id = conn.execute(
+                "INSERT INTO runs (run_date, date_filter, fingerprint, created_at) VALUES (?, ?, ?, ?)",
+                (run_date, date_filter, fingerprint, time.time()),
+            ).lastrowid
+            _insert(conn, "balances", run_id, run_date, balances)
+            _insert(conn, "aging", run_id, run_date, aging)
+    finally:
+        conn.close()
+    print(f"[Snapshot] Stored {len(balances)} balance and {len(aging)} aging rows for {run_date} ({date_filter!r})")
+    return run_id
+
+
+def snapshot_outputs(date_filter, fingerprint, unified_file, aging_files, run_date=None, db_path=None):
+    """
+    Snapshot a run from its output workbooks. Failures are logged, not raised,
+    so a snapshot problem never fails the run itself.
+
+    Args:
+        unified_file (str): Path of output/unified_file.xlsx.
+        aging_files (dict): org -> path of the segregator output.
+    """
+    if not SNAPSHOTS_ENABLED:
+        return None
+    try:
+        unified_df = pd.read_excel(unified_file, header=1)
+        aging_frames = {org: pd.read_excel(path) for org, path in aging_files.items() if os.path.exists(path)}
+        return record_snapshot(date_filter, fingerprint, unified_df, aging_frames, run_date, db_path)
+    except Exception as e:
+        print(f"[Snapshot Error] Failed to store snapshot for {date_filter!r}: {e}")
+        return None
+
+
+def _to_rupees(df, columns):
+    for col in columns:
+        if col in df.columns:
+            df[col] = from_paise(df[col].astype("Int64"))
+    return df
+
+
+def customer_trend(customer_name, org=None, date_filter=None, db_path=None):
+    """
+    Balances of one customer across snapshots.
+
+    Returns:
+        pd.DataFrame: run_date, date_filter, org, invoice_balance, available_credits
+        and closing_balance (rupees), oldest first.
+    """
+    key = normalize_names([customer_name]).iloc[0]
+    query = (
+        "SELECT b.run_date, r.date_filter, b.org, b.invoice_balance, b.available_credits, b.closing_balance "
+        "FROM balances b JOIN runs r ON r.run_id = b.run_id WHERE b.customer_key = ?"
+    )
+    params = [key]
+    if org:
+        query += " AND b.org = ?"
+        params.append(org)
+    if date_filter is not None:
+        query += " AND r.date_filter = ?"
+        params.append(date_filter)
+    query += " ORDER BY b.run_date, b.org"
+    conn = connect(db_path)
+    try:
+        df = pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+    return _to_rupees(df, ["invoice_balance", "available_credits", "closing_balance"])
+
+
+def month_over_month(date_filter, org=None, db_path=None):
+    """
+    Month-end totals per org, from the last snapshot of each month, with the
+    change in closing balance against the previous month.
+
+    Returns:
+        pd.DataFrame: month, org, run_date, customers, invoice_balance,
+        available_credits, closing_balance and closing_balance_change (rupees).
+    """
+    query = """
+        WITH month_end AS (
+            SELECT substr(run_date, 1, 7) AS month, MAX(run_date) AS run_date
+            FROM runs WHERE date_filter = ? GROUP BY month
+        )
+        SELECT m.month, b.org, b.run_date, COUNT(*) AS customers,
+               SUM(b.invoice_balance) AS invoice_balance,
+               SUM(b.available_credits) AS available_credits,
+               SUM(b.closing_balance) AS closing_balance
+        FROM month_end m
+        JOIN runs r ON r.run_date = m.run_date AND r.date_filter = ?
+        JOIN balances b ON b.run_id = r.run_id
+    """
+    params = [date_filter, date_filter]
+    if org:
+        query += " WHERE b.org = ?"
+        params.append(org)
+    query += " GROUP BY m.month, b.org ORDER BY b.org, m.month"
+    conn = connect(db_path)
+    try:
+        df = pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+    df["closing_balance_change"] = df.groupby("org")["closing_balance"].diff()
+    return _to_rupees(df, ["invoice_balance", "available_credits", "closing_balance", "closing_balance_change"])
+
+
+def aging_trend(date_filter, org=None, db_path=None):
+    """
+    Outstanding balance per aging bucket for every snapshot.
+
+    Returns:
+        pd.DataFrame: One row per run_date (and org), one column per bucket (rupees).
+    """
+    query = (
+        "SELECT a.run_date, a.org, a.bucket, SUM(a.balance) AS balance "
+        "FROM aging a JOIN runs r ON r.run_id = a.run_id WHERE r.date_filter = ?"
+    )
+    params = [date_filter]
+    if org:
+        query += " AND a.org = ?"
+        params.append(org)
+    query += " GROUP BY a.run_date, a.org, a.bucket"
+    conn = connect(db_path)
+    try:
+        df = pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+    table = df.pivot_table(index=["run_date", "org"], columns="bucket", values="balance", aggfunc="sum", fill_value=0)
+    table = table.reindex(columns=AGE_BUCKET_LABELS, fill_value=0).reset_index()
+    table.columns.name = None
+    return _to_rupees(table, AGE_BUCKET_LABELS)
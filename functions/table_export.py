@@ -0,0 +1,162 @@
+"""
+Plain-table exports of a report for machine consumers.
+
+/process_and_download?format=csv|parquet|json returns these tables instead
+of the Combined_Report workbook. They are built straight from the fetched
+source reports (read through their columnar sidecars) with the same ingest
+schema, bucket and range rules as the pipeline stages. No workbook is
+written, styled, hyperlinked or sized along the way:
+
+- consolidated: one row per customer with both orgs' balances, the
+  consolidated balances and the customer's balance range, largest first.
+- aging: both orgs' aging rows with their org, age bucket and the balance
+  split into one column per bucket, as in the segregator outputs.
+- aging_buckets: balance per org and age bucket plus the Total row, as on
+  the Summary sheet of Age_summary.xlsx.
+- balance_ranges: customers and balance totals per consolidated balance
+  range, as on the Summary sheet of balances_summary.xlsx.
+
+Numbers follow the write-time rounding policy in functions/schema.py, so
+they match the workbook. csv and parquet hold one file per table in a zip,
+since neither format has more than one table per file; json is one object
+keyed by table name.
+"""
+import os
+import zipfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from functions.age_summary import summary_frame
+from functions.balance_summary import BALANCE_RANGES, balance_range_labels
+from functions.consolidater import unified_frame
+from functions.report_store import read_frame
+from functions.schema import AGE_BUCKET_LABELS, apply_ingest_schema, assign_age_buckets, to_paise, whole_numbers, whole_rupees
+from functions.segregator import add_age_range_columns
+
+# Format -> file extension of the export
+EXPORT_FORMATS = {"csv": "zip", "parquet": "zip", "json": "json"}
+# Ranges in the order of the balances_summary Summary sheet, largest first
+RANGE_ORDER = [label for _, _, label in reversed(BALANCE_RANGES)]
+# Balance columns of unified_file.xlsx summed per range
+BALANCE_TOTAL_COLUMNS = [
+    "bcy_invoice_balance_file1", "bcy_available_credits_file1", "closing_balance_file1",
+    "bcy_invoice_balance_file2", "bcy_available_credits_file2", "closing_balance_file2",
+    "Consolidated invoiced_amount", "Consolidated amount_received", "Consolidated closing_balance",
+]
+
+
+def consolidated_table(balance_files):
+    """
+    Args:
+        balance_files (tuple): NVB and SMCS customer balance report paths.
+    """
+    df = unified_frame(*balance_files)
+    df["balance_range"] = balance_range_labels(df["Consolidated closing_balance"])
+    return df.sort_values("Consolidated closing_balance", ascending=False, kind="stable").reset_index(drop=True)
+
+
+def aging_table(aging_files):
+    """
+    Args:
+        aging_files (dict): org -> aging report path.
+    """
+    frames = []
+    for org, path in aging_files.items():
+        df = add_age_range_columns(apply_ingest_schema(read_frame(path)))
+        df.insert(0, "org", org)
+        df.insert(1, "bucket", assign_age_buckets(df["age"]))
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def aging_bucket_table(aging):
+    """Balance per org and age bucket, totalled in paise like age_summary.generate_summary."""
+    paise = aging[AGE_BUCKET_LABELS].apply(to_paise).fillna(0)
+    summary_data = []
+    for org, org_paise in paise.groupby(aging["org"], sort=False):
+        row_data = {"Ageing bucket": org}
+        for col, total in org_paise.sum().items():
+            row_data[col] = whole_rupees(total)
+        row_data["Unpaid Invoices"] = whole_rupees(org_paise.to_numpy().sum())
+        summary_data.append(row_data)
+    return summary_frame(summary_data)
+
+
+def balance_range_table(consolidated):
+    """Customers and balance totals per balance range, totalled in paise like balance_summary.calculate_totals."""
+    paise = consolidated[BALANCE_TOTAL_COLUMNS].apply(to_paise).fillna(0)
+    by_range = paise.groupby(consolidated["balance_range"], observed=False)
+    table = by_range.sum().map(whole_rupees).reindex(RANGE_ORDER, fill_value=0)
+    table.insert(0, "customers", by_range.size().reindex(RANGE_ORDER, fill_value=0))
+    return table.rename_axis("balance_range").reset_index()
+
+
+def build_tables(aging_files, balance_files):
+    """
+    Build the export tables from the fetched source reports.
+
+    Returns:
+        dict: Table name -> frame, in the order described in the module docstring.
+    """
+    consolidated = consolidated_table(balance_files)
+    aging = aging_table(aging_files)
+    return {
+        "consolidated": consolidated,
+        "aging": aging,
+        "aging_buckets": aging_bucket_table(aging),
+        "balance_ranges": balance_range_table(consolidated),
+    }
+
+
+def _parquet_bytes(df):
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowException, TypeError, ValueError):
+        # Text columns that also hold numbers, e.g. phone numbers read as both
+        mixed = [col for col in df.columns if df[col].dtype == object]
+        df = df.astype({col: "string" for col in mixed})
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink)
+    return sink.getvalue().to_pybytes()
+
+
+def write_tables(tables, output_format, output_path):
+    """
+    Write the tables in one of EXPORT_FORMATS.
+
+    Args:
+        output_path (str): Path without extension; the format's extension is added.
+
+    Returns:
+        str: Path of the written file.
+
+    Raises:
+        ValueError: If output_format is not in EXPORT_FORMATS.
+    """
+    if output_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {output_format!r}")
+    path = f"{output_path}.{EXPORT_FORMATS[output_format]}"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tables = {name: whole_numbers(df) for name, df in tables.items()}
+
+    if output_format == "json":
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("{")
+            for position, (name, df) in enumerate(tables.items()):
+                f.write(f'{"," if position else ""}"{name}":')
+                f.write(df.to_json(orient="records", date_format="iso", force_ascii=False))
+            f.write("}")
+        return path
+
+    # Parquet is compressed already
+    compression = zipfile.ZIP_DEFLATED if output_format == "csv" else zipfile.ZIP_STORED
+    with zipfile.ZipFile(path, "w", compression) as zipf:
+        for name, df in tables.items():
+            if output_format == "csv":
+                zipf.writestr(f"{name}.csv", df.to_csv(index=False))
+            else:
+                zipf.writestr(f"{name}.parquet", _parquet_bytes(df))
+    return path
@@ -0,0 +1,113 @@
+"""
+Sheet bundles that hand parsed report files to the combined report.
+
+xlsxwriter and openpyxl are pure Python, so producing or parsing a workbook
+is CPU-bound and one process handles one workbook at a time. The pipeline
+therefore gives every independent workbook its own stage, and the stage
+graph runs them side by side on the stage pool (see functions/pipeline.py).
+That includes the parse and clean-up that prepares each report file for
+Combined_Report: a sheets_* stage per file writes a sheet bundle, and the
+combined_report stage only writes the bundles' sheets out.
+
+A bundle is an uncompressed zip with one uncompressed Feather (Arrow IPC)
+member per sheet and a manifest of the sheet names, so frames move between
+processes as Arrow data rather than pickles sent through the pool's pipe.
+Some frames Arrow cannot hold as they are, such as columns that mix numbers
+and text below a two-row header; those are small summary sheets and are
+stored as pickles instead. Member timestamps are fixed, so a bundle's
+content, and with it the combined_report stage key, only changes with its
+sheets.
+"""
+import io
+import json
+import os
+import zipfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from functions.report_store import read_frame, sidecar_path
+from functions.schema import whole_numbers
+
+MANIFEST = "sheets.json"
+# Fixed member timestamp, the earliest a zip can hold
+_BUNDLE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def report_sheets(file_path):
+    """
+    Parse one file for the combined report and apply the write-time rounding policy.
+    Fetched reports have a columnar sidecar, so their xlsx is not parsed.
+
+    Returns:
+        list: (sheet_name, frame) pairs in sheet order.
+    """
+    sheets = []
+    try:
+        base_name = os.path.splitext(os.path.basename(file_path))[0]
+        if os.path.exists(sidecar_path(file_path)):
+            sheets.append((base_name[:31], whole_numbers(read_frame(file_path))))
+            return sheets
+        excel_file = pd.ExcelFile(file_path)
+        for sheet_name in excel_file.sheet_names:
+            df = whole_numbers(excel_file.parse(sheet_name))
+            # Build safe sheet name
+            if len(excel_file.sheet_names) > 1:
+                # For multi-sheet files, use shortened names if needed
+                safe_sheet_name = f"{base_name[:15]}_{sheet_name[:15]}"[:31]
+            else:
+                safe_sheet_name = base_name[:31]
+            sheets.append((safe_sheet_name, df))
+    except Exception as e:
+        print(f"[Combine Error] {file_path}: {e}")
+    return sheets
+
+
+def _frame_member(df):
+    # Feather when Arrow can hold the frame, else a pickle
+    try:
+        sink = pa.BufferOutputStream()
+        feather.write_feather(df, sink, compression="uncompressed")
+        return "feather", sink.getvalue().to_pybytes()
+    except (pa.ArrowException, TypeError, ValueError):
+        buffer = io.BytesIO()
+        df.to_pickle(buffer, compression=None)
+        return "pkl", buffer.getvalue()
+
+
+def stash_report_sheets(file_path, bundle_path):
+    """Write file_path's report_sheets to a bundle; a missing file gives an empty bundle."""
+    sheets = report_sheets(file_path) if os.path.exists(file_path) else []
+    bundle_dir = os.path.dirname(bundle_path)
+    if bundle_dir:
+        os.makedirs(bundle_dir, exist_ok=True)
+    tmp_path = f"{bundle_path}.tmp{os.getpid()}"
+    manifest = []
+    with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_STORED) as bundle:
+        for position, (sheet_name, df) in enumerate(sheets):
+            kind, data = _frame_member(df)
+            member = f"{position}.{kind}"
+            bundle.writestr(zipfile.ZipInfo(member, _BUNDLE_DATE_TIME), data)
+            manifest.append([sheet_name, member])
+        bundle.writestr(zipfile.ZipInfo(MANIFEST, _BUNDLE_DATE_TIME), json.dumps(manifest))
+    os.replace(tmp_path, bundle_path)
+
+
+def load_report_sheets(bundle_path):
+    """
+    Read a bundle written by stash_report_sheets.
+
+    Returns:
+        list: (sheet_name, frame) pairs in sheet order.
+    """
+    sheets = []
+    with zipfile.ZipFile(bundle_path) as bundle:
+        for sheet_name, member in json.loads(bundle.read(MANIFEST)):
+            data = bundle.read(member)
+            if member.endswith(".pkl"):
+                df = pd.read_pickle(io.BytesIO(data), compression=None)
+            else:
+                df = feather.read_table(pa.BufferReader(data)).to_pandas()
+            sheets.append((sheet_name, df))
+    return sheets
@@ -0,0 +1,162 @@
+"""
+HTTP transport for Zoho API calls with record and replay modes.
+
+    live    call Zoho (default)
+    record  call Zoho and store every response under ZOHO_RECORDINGS_DIR
+    replay  serve stored responses only; no network access
+
+Recordings are keyed by method, URL and form body with OAuth secrets removed,
+and tokens in recorded response bodies are redacted, so the recordings
+directory can be shared without leaking credentials.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+ZOHO_TRANSPORT_MODE = os.environ.get("ZOHO_TRANSPORT_MODE", "live")
+ZOHO_RECORDINGS_DIR = os.environ.get("ZOHO_RECORDINGS_DIR", "cache/zoho_recordings")
+# Simulated per-call latency in replay mode, to keep fetch timings realistic in benchmarks
+ZOHO_REPLAY_LATENCY_MS = float(os.environ.get("ZOHO_REPLAY_LATENCY_MS", "0"))
+
+MODES = ("live", "record", "replay")
+SECRET_FIELDS = {"client_id", "client_secret", "refresh_token", "access_token", "id_token", "code"}
+SECRET_HEADERS = {"authorization", "set-cookie", "cookie"}
+REDACTED = "REDACTED"
+
+_settings = {
+    "mode": ZOHO_TRANSPORT_MODE,
+    "recordings_dir": ZOHO_RECORDINGS_DIR,
+    "latency_ms": ZOHO_REPLAY_LATENCY_MS,
+}
+_write_lock = threading.Lock()
+
+
+def configure(mode=None, recordings_dir=None, latency_ms=None):
+    """Change the transport mode at runtime (e.g. from a benchmark or a debugging session)."""
+    if mode is not None:
+        if mode not in MODES:
+            raise ValueError(f"Unknown Zoho transport mode {mode!r}; expected one of {MODES}")
+        _settings["mode"] = mode
+    if recordings_dir is not None:
+        _settings["recordings_dir"] = recordings_dir
+    if latency_ms is not None:
+        _settings["latency_ms"] = float(latency_ms)
+
+
+def _without_secrets(pairs):
+    return sorted((k, v) for k, v in pairs if k.lower() not in SECRET_FIELDS)
+
+
+def sanitize_url(url):
+    """Drop secret query parameters from a URL."""
+    parts = urlsplit(url)
+    query = urlencode(_without_secrets(parse_qsl(parts.query, keep_blank_values=True)))
+    return parts._replace(query=query).geturl()
+
+
+def request_key(method, url, data=None):
+    """Stable key for a request, independent of credentials and parameter order."""
+    body = _without_secrets((data or {}).items()) if isinstance(data, dict) else []
+    material = json.dumps([method.upper(), sanitize_url(url), body])
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+def _redact_json(value):
+    if isinstance(value, dict):
+        return {k: REDACTED if k.lower() in SECRET_FIELDS else _redact_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact_json(v) for v in value]
+    return value
+
+
+def _redact_body(response):
+    content_type = response.headers.get("Content-Type", "")
+    if "json" not in content_type:
+        return response.content
+    try:
+        return json.dumps(_redact_json(response.json())).encode()
+    except ValueError:
+        return response.content
+
+
+def _recording_paths(key):
+    base = os.path.join(_settings["recordings_dir"], key)
+    return f"{base}.json", f"{base}.body"
+
+
+def _record(key, method, url, response):
+    meta_path, body_path = _recording_paths(key)
+    meta = {
+        "method": method.upper(),
+        "url": sanitize_url(url),
+        "status_code": response.status_code,
+        "reason": response.reason,
+        "encoding": response.encoding,
+        "headers": {k: v for k, v in response.headers.items() if k.lower() not in SECRET_HEADERS},
+        "recorded_at": time.time(),
+    }
+    with _write_lock:
+        os.makedirs(_settings["recordings_dir"], exist_ok=True)
+        with open(f"{body_path}.tmp", "wb") as f:
+            f.write(_redact_body(response))
+        os.replace(f"{body_path}.tmp", body_path)
+        with open(f"{meta_path}.tmp", "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+
+def _replay(key, method, url):
+    meta_path, body_path = _recording_paths(key)
+    if not os.path.exists(meta_path) or not os.path.exists(body_path):
+        raise requests.ConnectionError(f"No recorded Zoho response for {method.upper()} {sanitize_url(url)}")
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+    with open(body_path, "rb") as f:
+        body = f.read()
+
+    if _settings["latency_ms"] > 0:
+        time.sleep(_settings["latency_ms"] / 1000)
+
+    response = requests.Response()
+    response.status_code = meta["status_code"]
+    response.reason = meta.get("reason")
+    response.encoding = meta.get("encoding")
+    response.headers = CaseInsensitiveDict(meta.get("headers", {}))
+    response.url = meta["url"]
+    response._content = body
+    return response
+
+
+def request(method, url, **kwargs):
+    """
+    Send a request to Zoho through the configured transport.
+
+    Accepts the same keyword arguments as requests.request.
+    """
+    key = request_key(method, url, kwargs.get("data"))
+    mode = _settings["mode"]
+    if mode == "replay":
+        return _replay(key, method, url)
+
+    response = requests.request(method, url, **kwargs)
+    if mode == "record":
+        try:
+            _record(key, method, url, response)
+        except OSError as e:
+            print(f"[Zoho Transport Error] Failed to record {sanitize_url(url)}: {e}")
+    return response
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
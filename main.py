@@ -1,25 +1,70 @@
 import shutil
 import os
-import pandas as pd
-from fastapi import FastAPI, Query, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
+import asyncio
+import importlib
+import json
+import logging
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Query, HTTPException, BackgroundTasks, Request
+from fastapi.responses import FileResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import zipfile
-import openpyxl
-from openpyxl.utils import get_column_letter
-from openpyxl.worksheet.hyperlink import Hyperlink
-
-from functions.remove_decimals import remove_decimals_from_excel
-from functions.segregator import process_multiple_files
-from functions.consolidater import process_and_merge_files
-from functions.balance_summary import process_file
-from functions.age_summary import generate_summary
-from functions.combiner import combine_sheets
-from functions.get_details import fetch_all_reports
-from functions.get_invoices import invoice_step
-from functions.adjust_column_cells import process_output_folder, move_xlsx_to_output
-
-app = FastAPI()
+
+# Heavy modules (pandas, openpyxl, the pipeline stages) are imported on first
+# use or by the startup warm-up, so the app can answer before they are loaded.
+from functions.result_cache import ResultCache, fingerprint_reports, etag_matches
+from functions.pipeline import Stage, run_stage_graph, shutdown_stage_pool
+from functions.job_queue import PipelineExecutor, QueueFull, SingleFlight
+from functions.precompute import PRECOMPUTE_FILTERS, PrecomputeScheduler, parse_filters
+from functions.metrics import time_stage, record_bytes, render_metrics, RESULT_CACHE_REQUESTS
+
+logging.basicConfig(level=logging.INFO)
+
+# Preload pandas and the Excel engines in a background thread at startup (set to 0 to disable)
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "1") != "0"
+WARMUP_MODULES = [
+    "pandas", "openpyxl", "xlsxwriter", "pyarrow.feather",
+    "functions.get_details", "functions.segregator", "functions.age_summary",
+    "functions.consolidater", "functions.balance_summary", "functions.combiner",
+    "functions.result_index", "functions.snapshot_store", "functions.table_export",
+]
+warmup_done = threading.Event()
+
+def warm_up():
+    """
+    Import the heavy modules and write and read a tiny workbook with each Excel engine.
+    """
+    start = time.perf_counter()
+    try:
+        for module in WARMUP_MODULES:
+            importlib.import_module(module)
+        import io
+        import pandas as pd
+        for engine in ("xlsxwriter", "openpyxl"):
+            buffer = io.BytesIO()
+            pd.DataFrame({"warmup": [1]}).to_excel(buffer, engine=engine, index=False)
+            buffer.seek(0)
+            pd.read_excel(buffer)
+        print(f"[Warmup] Ready in {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        print(f"[Warmup Error] {e}")
+    finally:
+        warmup_done.set()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARMUP_ON_STARTUP:
+        threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+    precompute.start()
+    yield
+    await precompute.stop()
+    pipeline_executor.shutdown()
+    shutdown_stage_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS
 app.add_middleware(
@@ -78,162 +123,6 @@ def cleanup_folders(folders: list = ["csvdata", "output"], extra_files: list = [
     except Exception as e:
         return {"status": "error", "message": f"Cleanup failed: {str(e)}"}
 
-def create_combined_excel(output_file: str, files_to_process: list):
-    """
-    Combine multiple Excel files into a single Excel file with separate sheets.
-    """
-    with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-        for file_path in files_to_process:
-            if os.path.exists(file_path):
-                try:
-                    excel_file = pd.ExcelFile(file_path)
-                    for sheet_name in excel_file.sheet_names:
-                        df = excel_file.parse(sheet_name)
-                        # Build safe sheet name
-                        base_name = os.path.splitext(os.path.basename(file_path))[0]
-                        if len(excel_file.sheet_names) > 1:
-                            # For multi-sheet files, use shortened names if needed
-                            safe_sheet_name = f"{base_name[:15]}_{sheet_name[:15]}"[:31]
-                        else:
-                            safe_sheet_name = base_name[:31]
-                        df.to_excel(writer, sheet_name=safe_sheet_name, index=False)
-                except Exception as e:
-                    print(f"[Combine Error] {file_path}: {e}")
-
-
-import openpyxl
-from openpyxl.utils import get_column_letter
-
-def add_hyperlinks(file_path: str):
-    wb = openpyxl.load_workbook(file_path)
-    
-    # Find the consolidated sheet
-    cons_sheet = None
-    for sheet_name in wb.sheetnames:
-        if 'consolidated' in sheet_name.lower():
-            cons_sheet = wb[sheet_name]
-            break
-    
-    if not cons_sheet:
-        print("[Hyperlink] Consolidated sheet not found")
-        wb.save(file_path)
-        return
-    
-    # Assume aging sheet names
-    smcs_aging_name = 'input_invoice_aging_smcs'
-    nvb_aging_name = 'input_invoice_aging_nvb'
-    
-    if smcs_aging_name not in wb.sheetnames or nvb_aging_name not in wb.sheetnames:
-        print("[Hyperlink] Aging sheets not found")
-        wb.save(file_path)
-        return
-    
-    smcs_aging_sheet = wb[smcs_aging_name]
-    nvb_aging_sheet = wb[nvb_aging_name]
-    
-    # Sort aging sheets and add auto-filter
-    def sort_aging_sheet(aging_sheet):
-        cust_col = None
-        for col in range(1, aging_sheet.max_column + 1):
-            if aging_sheet.cell(1, col).value == 'customer_name':
-                cust_col = col
-                break
-        if not cust_col:
-            print(f"[Hyperlink] customer_name column not found in {aging_sheet.title}")
-            return None
-        
-        data = []
-        for r in range(2, aging_sheet.max_row + 1):
-            row_data = [aging_sheet.cell(r, c).value for c in range(1, aging_sheet.max_column + 1)]
-            data.append(row_data)
-        
-        data.sort(key=lambda x: x[cust_col - 1] if x[cust_col - 1] else '')
-        
-        for r in range(2, aging_sheet.max_row + 1):
-            for c in range(1, aging_sheet.max_column + 1):
-                aging_sheet.cell(r, c).value = None
-        
-        for i, row_data in enumerate(data, 2):
-            for c, val in enumerate(row_data, 1):
-                aging_sheet.cell(i, c).value = val
-        
-        aging_sheet.auto_filter.ref = f"A1:{get_column_letter(aging_sheet.max_column)}{aging_sheet.max_row}"
-        
-        return cust_col
-    
-    smcs_cust_col = sort_aging_sheet(smcs_aging_sheet)
-    nvb_cust_col = sort_aging_sheet(nvb_aging_sheet)
-    
-    if not smcs_cust_col or not nvb_cust_col:
-        wb.save(file_path)
-        return
-    
-    header_row = 2
-    smcs_inv_col = None
-    nvb_inv_col = None
-    cust_name_col = None
-    for col in range(1, cons_sheet.max_column + 1):
-        cell_value = cons_sheet.cell(header_row, col).value
-        if cell_value == 'Invoice Balance':
-            header_group = cons_sheet.cell(1, col).value
-            if header_group and 'SMCS Receivables' in header_group:
-                smcs_inv_col = col
-            elif header_group and 'NVB Receivables' in header_group:
-                nvb_inv_col = col
-        elif cell_value == 'customer_name':
-            cust_name_col = col
-    
-    if not smcs_inv_col or not nvb_inv_col or not cust_name_col:
-        print("[Hyperlink] Required columns not found in consolidated sheet")
-        wb.save(file_path)
-        return
-    
-    if 'Instructions' not in wb.sheetnames:
-        inst_sheet = wb.create_sheet('Instructions')
-        inst_sheet['A1'].value = "How to Use Hyperlinks"
-        inst_sheet['A2'].value = (
-            "Click a hyperlink to navigate to the aging sheet with a pre-applied filter for the exact company name. "
-            "Use Excel's filter dropdown to adjust or clear the filter manually if needed."
-        )
-    
-    for row in range(3, cons_sheet.max_row + 1):
-        cust_name = cons_sheet.cell(row, cust_name_col).value
-        if not cust_name:
-            continue
-        
-        smcs_cell = cons_sheet.cell(row, smcs_inv_col)
-        if isinstance(smcs_cell.value, (int, float)) and smcs_cell.value > 0:
-            first_row = None
-            for r in range(2, smcs_aging_sheet.max_row + 1):
-                sheet_cust_name = smcs_aging_sheet.cell(r, smcs_cust_col).value
-                if sheet_cust_name == cust_name:  # Exact match
-                    first_row = r
-                    break
-            if first_row:
-                smcs_cell.hyperlink = f"#'{smcs_aging_name}'!A{first_row}"
-                smcs_cell.style = 'Hyperlink'
-                smcs_cell.comment = openpyxl.comments.Comment(f"Filter for: {cust_name}", 'Grok')
-                # Apply auto-filter for exact match
-                smcs_aging_sheet.auto_filter.add_filter_column(smcs_cust_col - 1, [cust_name])
-        
-        nvb_cell = cons_sheet.cell(row, nvb_inv_col)
-        if isinstance(nvb_cell.value, (int, float)) and nvb_cell.value > 0:
-            first_row = None
-            for r in range(2, nvb_aging_sheet.max_row + 1):
-                sheet_cust_name = nvb_aging_sheet.cell(r, nvb_cust_col).value
-                if sheet_cust_name == cust_name:  # Exact match
-                    first_row = r
-                    break
-            if first_row:
-                nvb_cell.hyperlink = f"#'{nvb_aging_name}'!A{first_row}"
-                nvb_cell.style = 'Hyperlink'
-                nvb_cell.comment = openpyxl.comments.Comment(f"Filter for: {cust_name}", 'Grok')
-                # Apply auto-filter for exact match
-                nvb_aging_sheet.auto_filter.add_filter_column(nvb_cust_col - 1, [cust_name])
-    
-    wb.save(file_path)
-    print("[Hyperlink] Hyperlinks, auto-filters, and instructions added successfully")
-
 # Example usage
 # Example usage
 
@@ -259,80 +148,458 @@ def create_zip_archive(files_to_zip: list, zip_path: str):
         print(f"[Zip Error] Failed to create zip archive: {str(e)}")
         raise
 
-@app.post("/process_and_download")
-async def process_and_download(
-    background_tasks: BackgroundTasks,
-    date_filter: str = Query(..., description="Date filter for fetching reports")
-):
-    try:
-        
-        
-        #step 0: Cleanup previous files
+# Reports saved by fetch_all_reports; their content is the result cache fingerprint
+SOURCE_REPORTS = [
+    'csvdata/input_invoice_aging_nvb.xlsx',
+    'csvdata/input_invoice_aging_smcs.xlsx',
+    'csvdata/input_customer_balance_nvb.xlsx',
+    'csvdata/input_customer_balance_smcs.xlsx',
+]
+
+result_cache = ResultCache()
+# Runs fetches and pipeline builds off the event loop (see functions/job_queue.py)
+pipeline_executor = PipelineExecutor()
+# Concurrent requests for the same date_filter share one build
+report_builds = SingleFlight()
+
+def build_key(date_filter: str, output_format: str = "xlsx", force_fetch: bool = False) -> str:
+    """
+    report_builds key of a build. A forced fetch gets its own key, so it never
+    joins a build that may reuse the report store's copies.
+    """
+    key = date_filter if output_format == "xlsx" else f"{date_filter} ({output_format})"
+    return f"{key} (forced)" if force_fetch else key
+
+def fetch_reports(date_filter: str, force_fetch: bool = False, clean_outputs: bool = True) -> str:
+    """
+    Fetch fresh source reports from Zoho and return their fingerprint. Reports still
+    in the report store are restored from it unless force_fetch is set.
+    Without clean_outputs only csvdata/ is cleared, and the outputs of the last
+    pipeline run in output/ are left in place.
+    """
+    from functions.get_details import fetch_all_reports
+
+    if clean_outputs:
         cleanup_folders()
-        
-        # Step 1: Run processing pipeline
-        
-        fetch_all_reports(date_filter)
-        process_multiple_files(
-            'csvdata/input_invoice_aging_nvb.xlsx',
-            'csvdata/input_invoice_aging_smcs.xlsx'
-        )
-        generate_summary(
+    else:
+        cleanup_folders(["csvdata"], extra_files=[])
+    with time_stage("fetch"):
+        fetch_all_reports(date_filter, force_fetch)
+    return fingerprint_reports(SOURCE_REPORTS)
+
+# Files collected into the combined report and the zip archive (inputs + outputs)
+REPORT_FILES = [
+    'csvdata/input_invoice_aging_nvb.xlsx',
+    'csvdata/input_invoice_aging_smcs.xlsx',
+    'output/balances_summary.xlsx',
+    'csvdata/input_customer_balance_nvb.xlsx',
+    'csvdata/input_customer_balance_smcs.xlsx',
+    'output/SMCS_Age_Range_Columns.xlsx',
+    'output/NVB_Age_Range_Columns.xlsx',
+    'output/Age_summary.xlsx',
+    'output/unified_file.xlsx',
+    'output/Final.xlsx'
+]
+COMBINED_REPORT = "output/Combined_Report.xlsx"
+# Outputs kept in the historical snapshot store and the query index after each run
+UNIFIED_OUTPUT = 'output/unified_file.xlsx'
+AGE_SUMMARY_OUTPUT = 'output/Age_summary.xlsx'
+AGING_OUTPUTS = {
+    'NVB': 'output/NVB_Age_Range_Columns.xlsx',
+    'SMCS': 'output/SMCS_Age_Range_Columns.xlsx',
+}
+
+# Sources of the table exports (see functions/table_export.py)
+AGING_SOURCES = {
+    'SMCS': 'csvdata/input_invoice_aging_smcs.xlsx',
+    'NVB': 'csvdata/input_invoice_aging_nvb.xlsx',
+}
+BALANCE_SOURCES = ('csvdata/input_customer_balance_nvb.xlsx', 'csvdata/input_customer_balance_smcs.xlsx')
+EXPORT_OUTPUT = 'output/report_tables'
+# /process_and_download formats -> download filename and media type
+REPORT_FORMATS = {
+    "xlsx": ("Combined_Report.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("report_tables_csv.zip", "application/zip"),
+    "parquet": ("report_tables_parquet.zip", "application/zip"),
+    "json": ("report_tables.json", "application/json"),
+}
+
+# Index of the last pipeline run for the JSON read endpoints (see functions/result_index.py)
+latest_index = None
+
+def refresh_latest_index(date_filter: str):
+    """
+    Rebuild the query index from this run's outputs; a failed build keeps the previous index.
+    """
+    global latest_index
+    from functions.result_index import build_index
+
+    index = build_index(date_filter, AGING_OUTPUTS, AGE_SUMMARY_OUTPUT, UNIFIED_OUTPUT)
+    if index is not None:
+        latest_index = index
+
+def store_result(date_filter: str, fingerprint: str, combined_file: str):
+    """
+    Cache a freshly built report and index its results.
+
+    Returns:
+        tuple: The cache entry, and a folder with a copy of the outputs the snapshot reads;
+        the next queued run clears output/ as soon as this one releases its slot.
+    """
+    entry = result_cache.put(date_filter, fingerprint, combined_file)
+    refresh_latest_index(date_filter)
+    snapshot_dir = tempfile.mkdtemp(prefix="snapshot_")
+    for path in [UNIFIED_OUTPUT, *AGING_OUTPUTS.values()]:
+        if os.path.exists(path):
+            shutil.copy(path, snapshot_dir)
+    return entry, snapshot_dir
+
+def snapshot_results(date_filter: str, fingerprint: str, snapshot_dir: str):
+    """
+    Append this run's outputs (copied to snapshot_dir by store_result) to the historical snapshot store.
+    """
+    from functions.snapshot_store import snapshot_outputs
+
+    try:
+        aging_files = {org: os.path.join(snapshot_dir, os.path.basename(path)) for org, path in AGING_OUTPUTS.items()}
+        snapshot_outputs(date_filter, fingerprint, os.path.join(snapshot_dir, os.path.basename(UNIFIED_OUTPUT)), aging_files)
+    finally:
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+# Transform stages with their declared inputs and outputs. run_stage_graph orders
+# them by which outputs each reads: the aging branch (one segregate stage per org,
+# then age_summary) and the balance branch (consolidate, balance_summary) run side
+# by side and only meet at the "combine" stage. Each stage writes one workbook.
+PIPELINE_STAGES = [
+    Stage(
+        name="segregate_nvb",
+        func="functions.segregator:process_file",
+        args=('csvdata/input_invoice_aging_nvb.xlsx', 'output/NVB_Age_Range_Columns.xlsx', 'NVB'),
+        inputs=['csvdata/input_invoice_aging_nvb.xlsx'],
+        outputs=['output/NVB_Age_Range_Columns.xlsx'],
+    ),
+    Stage(
+        name="segregate_smcs",
+        func="functions.segregator:process_file",
+        args=('csvdata/input_invoice_aging_smcs.xlsx', 'output/SMCS_Age_Range_Columns.xlsx', 'SMCS'),
+        inputs=['csvdata/input_invoice_aging_smcs.xlsx'],
+        outputs=['output/SMCS_Age_Range_Columns.xlsx'],
+    ),
+    Stage(
+        name="age_summary",
+        func="functions.age_summary:generate_summary",
+        args=(
             {
                 'SMCS': 'output/SMCS_Age_Range_Columns.xlsx',
                 'NVB': 'output/NVB_Age_Range_Columns.xlsx'
             },
             'output/Age_summary.xlsx'
-        )
-        process_and_merge_files(
+        ),
+        inputs=['output/SMCS_Age_Range_Columns.xlsx', 'output/NVB_Age_Range_Columns.xlsx'],
+        outputs=['output/Age_summary.xlsx'],
+    ),
+    Stage(
+        name="consolidate",
+        func="functions.consolidater:process_and_merge_files",
+        args=(
             'csvdata/input_customer_balance_nvb.xlsx',
             'csvdata/input_customer_balance_smcs.xlsx',
             'output/unified_file.csv'
+        ),
+        inputs=['csvdata/input_customer_balance_nvb.xlsx', 'csvdata/input_customer_balance_smcs.xlsx'],
+        outputs=['output/unified_file.xlsx'],
+    ),
+    Stage(
+        name="balance_summary",
+        func="functions.balance_summary:process_file",
+        args=('output/unified_file.xlsx', 'output/balances_summary.xlsx'),
+        inputs=['output/unified_file.xlsx'],
+        outputs=['output/balances_summary.xlsx'],
+    ),
+    Stage(
+        name="combine",
+        func="functions.combiner:combine_sheets",
+        args=('output/balances_summary.xlsx', 'output/Age_summary.xlsx', 'output/Final.xlsx'),
+        inputs=['output/balances_summary.xlsx', 'output/Age_summary.xlsx'],
+        outputs=['output/Final.xlsx'],
+    ),
+]
+
+# Sheet bundle of each report file for the combined report (see functions/workbook_writer.py)
+REPORT_SHEET_BUNDLES = {
+    path: f"output/sheets/{os.path.splitext(os.path.basename(path))[0]}.zip" for path in REPORT_FILES
+}
+
+def pipeline_stages() -> list:
+    """
+    PIPELINE_STAGES plus the stages that build Combined_Report. Every report file
+    is parsed into its sheet bundle on a stage of its own, so the files are parsed
+    side by side and combined_report only writes the sheets out. In the chunked
+    mode (AGING_CHUNK_ROWS) combined_report streams the files itself instead.
+    """
+    from functions.report_store import AGING_CHUNK_ROWS
+
+    if AGING_CHUNK_ROWS:
+        return PIPELINE_STAGES + [Stage(
+            name="combined_report",
+            func="functions.combined_report:build_combined_report",
+            args=(COMBINED_REPORT, REPORT_FILES),
+            inputs=REPORT_FILES,
+            outputs=[COMBINED_REPORT],
+        )]
+    sheet_stages = [
+        Stage(
+            name=f"sheets_{os.path.splitext(os.path.basename(path))[0]}",
+            func="functions.workbook_writer:stash_report_sheets",
+            args=(path, bundle),
+            inputs=[path],
+            outputs=[bundle],
         )
-        process_file('output/unified_file.xlsx', 'output/balances_summary.xlsx')
-        combine_sheets('output/balances_summary.xlsx', 'output/Age_summary.xlsx', 'output/Final.xlsx')
-       
-        # Step 2: Collect all files (inputs + outputs)
-        files_to_process = [
-            'csvdata/input_invoice_aging_nvb.xlsx',
-            'csvdata/input_invoice_aging_smcs.xlsx',
-             'output/balances_summary.xlsx',
-            'csvdata/input_customer_balance_nvb.xlsx',
-            'csvdata/input_customer_balance_smcs.xlsx',
-            'output/SMCS_Age_Range_Columns.xlsx',
-            'output/NVB_Age_Range_Columns.xlsx',
-            'output/Age_summary.xlsx',
-            'output/unified_file.xlsx',
-           
-            'output/Final.xlsx'
-        ]
-
-        # Step 3: Remove decimals from each file
-        # (Assuming this function processes in place or outputs to same path)
-
-        # Step 4: Create a single combined Excel
-        combined_file = "output/Combined_Report.xlsx"
-        create_combined_excel(combined_file, files_to_process)
-        
-        # Step 5: Add hyperlinks to the consolidated sheet
-        add_hyperlinks(combined_file)
-        
-        files_to_process.append(combined_file)  # Add combined file to zip
-
-        # Step 6: Create zip archive
-        zip_path = "output.zip"
-        create_zip_archive(files_to_process, zip_path)
-
-        # Step 7: Return the combined Excel file as response
-        return FileResponse(
-            combined_file,
-            filename="Combined_Report.xlsx",
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        for path, bundle in REPORT_SHEET_BUNDLES.items()
+    ]
+    return PIPELINE_STAGES + sheet_stages + [Stage(
+        name="combined_report",
+        func="functions.combined_report:build_combined_report",
+        args=(COMBINED_REPORT, REPORT_FILES, REPORT_SHEET_BUNDLES),
+        inputs=list(REPORT_SHEET_BUNDLES.values()),
+        outputs=[COMBINED_REPORT],
+    )]
+
+# Timing and critical path of the last pipeline run, served by /pipeline/last_run
+PIPELINE_RUN_REPORT = os.environ.get("PIPELINE_RUN_REPORT", "cache/pipeline_run.json")
+
+def save_run_report(report: dict):
+    """
+    Write a run's critical-path report; it is a file so that runs on the process executor show up too.
+    """
+    try:
+        os.makedirs(os.path.dirname(PIPELINE_RUN_REPORT) or ".", exist_ok=True)
+        tmp_path = f"{PIPELINE_RUN_REPORT}.tmp{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(dict(report, finished_at=time.time()), f, indent=2)
+        os.replace(tmp_path, PIPELINE_RUN_REPORT)
+    except OSError as e:
+        print(f"[Pipeline Error] Failed to save run report: {e}")
+
+def run_pipeline(on_stage=None) -> str:
+    """
+    Run the transform pipeline over the fetched reports in csvdata/.
+    Independent stages run in parallel on the stage pool, and stages whose inputs
+    are unchanged since a previous run are restored from the stage cache.
+
+    Args:
+        on_stage (callable): Per-stage progress callback, see functions.pipeline.run_stages.
+
+    Returns:
+        str: Path of the generated Combined_Report workbook.
+    """
+    save_run_report(run_stage_graph(pipeline_stages(), on_stage=on_stage))
+
+    # Create zip archive of all files plus the combined report
+    zip_path = "output.zip"
+    create_zip_archive(REPORT_FILES + [COMBINED_REPORT], zip_path)
+    record_bytes("zip", os.path.getsize(zip_path))
+    return COMBINED_REPORT
+
+def export_report(output_format: str) -> str:
+    """
+    Build the report tables from the fetched reports in csvdata/ and write them
+    as csv, parquet or json, without running the workbook pipeline.
+
+    Returns:
+        str: Path of the written export.
+    """
+    from functions.table_export import build_tables, write_tables
+
+    with time_stage("export"):
+        tables = build_tables(AGING_SOURCES, BALANCE_SOURCES)
+        path = write_tables(tables, output_format, EXPORT_OUTPUT)
+    record_bytes("export", os.path.getsize(path))
+    return path
+
+def cached_report_response(entry: dict, if_none_match: str, background_tasks: BackgroundTasks,
+                           output_format: str = "xlsx"):
+    """
+    Serve a cached report in output_format, or 304 when the client already has it.
+    """
+    headers = {"ETag": entry["etag"], "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, entry["etag"]):
+        return Response(status_code=304, headers=headers)
+    filename, media_type = REPORT_FORMATS[output_format]
+    # Eviction leaves the file in place until the response has been sent
+    if not result_cache.hold(entry):
+        raise FileNotFoundError(entry["path"])
+    background_tasks.add_task(result_cache.release, entry)
+    return FileResponse(entry["path"], filename=filename, media_type=media_type, headers=headers)
+
+async def build_report(date_filter: str, output_format: str = "xlsx", force_fetch: bool = False):
+    """
+    Fetch the source reports and build the combined report (or, for the other
+    REPORT_FORMATS, the table export) unless it is cached.
+    The blocking steps run on the pipeline executor while holding one of its slots.
+    force_fetch fetches from Zoho even if the report store holds recent copies.
+
+    Returns:
+        tuple: The cache entry, the source fingerprint and the snapshot folder from
+        store_result (None on a cache hit and for table exports).
+    """
+    async with pipeline_executor.slot():
+        # Step 1: Fetch the source reports; reuse the cached result if Zoho's data is unchanged
+        # Table exports read the fetched reports only, so they leave output/ alone
+        fingerprint = await pipeline_executor.run(fetch_reports, date_filter, force_fetch, output_format == "xlsx")
+        result_cache.remember_fingerprint(date_filter, fingerprint)
+        entry = result_cache.get(date_filter, fingerprint, output_format)
+        if entry is not None:
+            RESULT_CACHE_REQUESTS.labels(outcome="hit").inc()
+            return entry, fingerprint, None
+
+        RESULT_CACHE_REQUESTS.labels(outcome="miss").inc()
+        if output_format != "xlsx":
+            # Tables only: the workbook stages, the query index and the snapshot are skipped
+            export_file = await pipeline_executor.run(export_report, output_format)
+            entry = await asyncio.to_thread(result_cache.put, date_filter, fingerprint, export_file, output_format)
+            return entry, fingerprint, None
+
+        # Step 2: Run processing pipeline and cache its result
+        combined_file = await pipeline_executor.run(run_pipeline)
+        entry, snapshot_dir = await asyncio.to_thread(store_result, date_filter, fingerprint, combined_file)
+        return entry, fingerprint, snapshot_dir
+
+def result_is_fresh(date_filter: str, fresh_seconds: float = None) -> bool:
+    """
+    True when date_filter's sources were fetched within fresh_seconds and the report built from them is cached.
+    """
+    fingerprint = result_cache.fresh_fingerprint(date_filter, fresh_seconds)
+    return fingerprint is not None and result_cache.get(date_filter, fingerprint) is not None
+
+async def precompute_report(date_filter: str):
+    """
+    Scheduled rebuild of one date filter; interactive requests for it meanwhile join this build.
+    The sources are always fetched from Zoho, since the stored copies are what it is refreshing.
+    """
+    (entry, fingerprint, snapshot_dir), leader = await report_builds.do(
+        build_key(date_filter, force_fetch=True), build_report, date_filter, "xlsx", True
+    )
+    if leader and snapshot_dir is not None:
+        await asyncio.to_thread(snapshot_results, date_filter, fingerprint, snapshot_dir)
+
+# Keeps the reports of the common date filters fresh in the cache (see functions/precompute.py)
+precompute = PrecomputeScheduler(
+    parse_filters(PRECOMPUTE_FILTERS), precompute_report, pipeline_executor.idle, result_is_fresh
+)
+
+@app.post("/process_and_download")
+async def process_and_download(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    date_filter: str = Query(..., description="Date filter for fetching reports"),
+    output_format: str = Query(
+        "xlsx", alias="format",
+        description="xlsx for the Combined_Report workbook; csv (zip), parquet (zip) or json for the plain tables"
+    )
+):
+    if output_format not in REPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {output_format}")
+    try:
+        if_none_match = request.headers.get("if-none-match")
+
+        # Step 0: Serve straight from the cache while the last fetch is still fresh;
+        # scheduled filters stay fresh for their precompute interval
+        fingerprint = result_cache.fresh_fingerprint(date_filter, precompute.interval(date_filter))
+        if fingerprint is not None:
+            entry = result_cache.get(date_filter, fingerprint, output_format)
+            if entry is not None:
+                RESULT_CACHE_REQUESTS.labels(outcome="fresh_hit").inc()
+                return cached_report_response(entry, if_none_match, background_tasks, output_format)
+
+        # Steps 1-2: fetch and build, shared with identical requests already in flight;
+        # a workbook request also joins the precompute scheduler's forced build
+        key = build_key(date_filter, output_format)
+        if build_key(date_filter, output_format, force_fetch=True) in report_builds.in_flight():
+            key = build_key(date_filter, output_format, force_fetch=True)
+        (entry, fingerprint, snapshot_dir), leader = await report_builds.do(
+            key, build_report, date_filter, output_format
         )
+        if leader and snapshot_dir is not None:
+            # Keep this run's results for trend queries once the response is sent
+            background_tasks.add_task(snapshot_results, date_filter, fingerprint, snapshot_dir)
+
+        # Step 3: Return the combined Excel file or the table export as response
+        return cached_report_response(entry, if_none_match, background_tasks, output_format)
 
+    except QueueFull as busy:
+        raise HTTPException(status_code=429, detail=str(busy), headers={"Retry-After": str(busy.retry_after)})
     except FileNotFoundError as fnf_error:
         raise HTTPException(status_code=404, detail=f"File not found: {str(fnf_error)}")
     except PermissionError as perm_error:
         raise HTTPException(status_code=403, detail=f"Permission error: {str(perm_error)}")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+@app.get("/metrics")
+def metrics():
+    """
+    Expose pipeline and Zoho call metrics in Prometheus text format.
+    """
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
+def current_results():
+    """
+    The latest results index, or 404 before any pipeline run.
+    """
+    index = latest_index
+    if index is None:
+        raise HTTPException(status_code=404, detail="No results yet; run /process_and_download first")
+    return index
+
+@app.get("/customers/{name}/aging")
+def customer_aging(name: str, org: str = Query(None, description="Limit to one org, e.g. NVB or SMCS")):
+    """
+    Aging buckets and open invoices for one customer from the last run.
+    """
+    result = current_results().customer_aging(name, org)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Customer not found: {name}")
+    return result
+
+@app.get("/balances")
+def balances(balance_range: str = Query(None, alias="range", description="Balance range, e.g. 2L-5L")):
+    """
+    Consolidated customer balances from the last run, largest first.
+    """
+    index = current_results()
+    try:
+        rows = index.balances_in_range(balance_range)
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Unknown range: {balance_range}")
+    return {"date_filter": index.date_filter, "range": balance_range, "customers": rows}
+
+@app.get("/summary")
+def summary():
+    """
+    Age summary and balance range totals from the last run.
+    """
+    return current_results().summary()
+
+@app.get("/pipeline/last_run")
+def pipeline_last_run():
+    """
+    Stage timings of the last pipeline run: wall time, the critical path through
+    the stage graph and how much slack every other stage had.
+    """
+    try:
+        with open(PIPELINE_RUN_REPORT) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="No pipeline run yet")
+
+@app.get("/health")
+def health():
+    """
+    Liveness check; "warm" reports whether the startup warm-up has finished,
+    "pipeline" the executor's running and waiting report builds and the date
+    filters being built, and "precompute" the scheduled filters.
+    """
+    pipeline = dict(pipeline_executor.stats(), in_flight=report_builds.in_flight())
+    return {"status": "ok", "warm": warmup_done.is_set(), "pipeline": pipeline, "precompute": precompute.stats()}